@@ -0,0 +1,58 @@
+# Microbenchmark of the DTO serialization in the producer and consumer hot paths
+# Run from the project root with: python -m bench.dto_benchmark
+
+import json
+import sys
+import timeit
+
+from dto.message_descriptor import MessageDescriptor
+
+# Configuration variables
+iterations = 200000
+repeat = 5
+
+
+class LegacyMessageDescriptor:
+    """ Original __dict__ based MessageDescriptor used as baseline of the benchmark """
+
+    def __init__(self, timestamp, value_type, value):
+        self.timestamp = timestamp
+        self.value_type = value_type
+        self.value = value
+
+    def to_json(self):
+        return json.dumps(self, default=lambda o: o.__dict__)
+
+
+def best_rate(statement):
+    """ Messages per second of the best run of a statement """
+
+    best_time = min(timeit.repeat(statement, number=iterations, repeat=repeat))
+    return iterations / best_time
+
+
+def report(name, before, after):
+    """ Print a benchmark line comparing the legacy and the new implementation """
+    print(f"{name:32} before: {before:12,.0f} msg/s   after: {after:12,.0f} msg/s   speedup: {after / before:5.2f}x")
+
+
+# Main Script
+if __name__ == "__main__":
+
+    payload = MessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 36.612345).to_json().encode("utf-8")
+
+    # Producer path: build the DTO and serialize it
+    report("create + to_json",
+           best_rate(lambda: LegacyMessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 36.612345).to_json()),
+           best_rate(lambda: MessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 36.612345).to_json()))
+
+    # Consumer path: decode the MQTT payload (bytes) and build the DTO
+    report("payload bytes -> DTO",
+           best_rate(lambda: LegacyMessageDescriptor(**json.loads(str(payload.decode("utf-8"))))),
+           best_rate(lambda: MessageDescriptor.from_bytes(payload)))
+
+    # Memory footprint of a single instance
+    legacy = LegacyMessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 36.612345)
+    legacy_size = sys.getsizeof(legacy) + sys.getsizeof(legacy.__dict__)
+    slotted_size = sys.getsizeof(MessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 36.612345))
+    print(f"{'instance size':32} before: {legacy_size:8} bytes      after: {slotted_size:8} bytes")
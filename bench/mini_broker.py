@@ -0,0 +1,504 @@
+import asyncio
+import itertools
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from utils.topic_dispatcher import TopicDispatcher
+
+# MQTT control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def _encode_remaining_length(length):
+    """ Encode the MQTT variable length integer of the fixed header """
+
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length > 0:
+            byte |= 0x80
+        encoded.append(byte)
+        if length == 0:
+            return bytes(encoded)
+
+
+def _packet(packet_type, flags, body):
+    """ Build a control packet with its fixed header """
+    return bytes([(packet_type << 4) | flags]) + _encode_remaining_length(len(body)) + body
+
+
+def _read_properties(packet_type, body, offset):
+    """ Read the MQTT v5 properties of a packet """
+
+    properties = Properties(packet_type)
+    _, length = properties.unpack(body[offset:])
+    return properties, offset + length
+
+
+def _property_data(properties):
+    """ Encoded MQTT v5 properties without their length prefix (b"" if there is none) """
+
+    if properties is None:
+        return b""
+    packed = properties.pack()
+    offset = 0
+    while packed[offset] & 0x80:
+        offset += 1
+    return packed[offset + 1:]
+
+
+def _read_string(body, offset):
+    """ Read a length prefixed UTF-8 string from the packet body """
+
+    length = struct.unpack_from("!H", body, offset)[0]
+    offset += 2
+    return body[offset:offset + length], offset + length
+
+
+class _Subscription:
+    """ Subscription of a single session to a topic filter (with the MQTT v5 subscription identifier and No Local option) """
+
+    __slots__ = ("session", "qos", "identifier", "no_local")
+
+    def __init__(self, session, qos, identifier=None, no_local=False):
+        self.session = session
+        self.qos = qos
+        self.identifier = identifier
+        self.no_local = no_local
+
+    def deliver(self, topic, payload, qos, retain, property_data=b"", origin=None):
+        if self.no_local and origin is self.session:
+            return
+        self.session.send_publish(topic, payload, min(qos, self.qos), retain, property_data, self.identifier)
+
+
+class _SharedSubscription:
+    """ Shared subscription group ($share/<group>/<filter>): each message is delivered to one member """
+
+    __slots__ = ("members", "_next")
+
+    def __init__(self):
+        self.members = []
+        self._next = 0
+
+    def deliver(self, topic, payload, qos, retain, property_data=b"", origin=None):
+        if not self.members:
+            return
+        self._next = (self._next + 1) % len(self.members)
+        self.members[self._next].deliver(topic, payload, qos, retain, property_data, origin)
+
+
+class _Session:
+    """ Connection of a single MQTT Client to the broker """
+
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.protocol_level = 4
+        self.subscriptions = {}
+        self._packet_ids = itertools.cycle(range(1, 65536))
+
+        # MQTT v5 topic aliases of the messages published by the client (alias -> topic)
+        self.topic_aliases = {}
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def send_publish(self, topic, payload, qos, retain, property_data=b"", subscription_identifier=None):
+        """ Forward a PUBLISH packet to the client (QoS 2 is downgraded to QoS 1). The MQTT v5 clients receive the
+        properties of the message and the identifier of the matching subscription """
+
+        qos = min(qos, 1)
+        body = struct.pack("!H", len(topic)) + topic
+        if qos > 0:
+            body += struct.pack("!H", next(self._packet_ids))
+        if self.protocol_level == 5:
+            if subscription_identifier is not None:
+                property_data += b"\x0b" + _encode_remaining_length(subscription_identifier)
+            body += _encode_remaining_length(len(property_data)) + property_data
+        self.send(_packet(PUBLISH, (qos << 1) | (1 if retain else 0), body + payload))
+
+    async def run(self):
+        """ Read and handle the control packets of the connection """
+
+        try:
+            while True:
+                header = await self.reader.readexactly(1)
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = (await self.reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await self.reader.readexactly(length) if length else b""
+                if not self.handle(header[0] >> 4, header[0] & 0x0F, body):
+                    break
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.remove_session(self)
+            self.writer.close()
+
+    def handle(self, packet_type, flags, body):
+        """
+        Handle a single control packet
+        :return: False when the connection must be closed
+        """
+
+        if packet_type == CONNECT:
+            protocol_name, offset = _read_string(body, 0)
+            protocol_level, connect_flags = body[offset], body[offset + 1]
+            offset += 4
+            if protocol_level not in (4, 5):
+                # Only MQTT 3.1.1 and MQTT v5 are supported: unacceptable protocol version
+                self.send(_packet(CONNACK, 0, b"\x00\x01"))
+                return False
+            self.protocol_level = protocol_level
+            if protocol_level == 5:
+                _, offset = _read_properties(PacketTypes.CONNECT, body, offset)
+            client_id, offset = _read_string(body, offset)
+            self.client_id = client_id.decode("utf-8")
+            self.broker.add_session(self)
+            if protocol_level == 5:
+                connack_properties = Properties(PacketTypes.CONNACK)
+                connack_properties.TopicAliasMaximum = self.broker.topic_alias_maximum
+                self.send(_packet(CONNACK, 0, b"\x00\x00" + connack_properties.pack()))
+            else:
+                self.send(_packet(CONNACK, 0, b"\x00\x00"))
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            retain = bool(flags & 0x01)
+            topic, offset = _read_string(body, 0)
+            packet_id = None
+            if qos > 0:
+                packet_id = body[offset:offset + 2]
+                offset += 2
+            properties = None
+            if self.protocol_level == 5:
+                properties, offset = _read_properties(PacketTypes.PUBLISH, body, offset)
+                topic_alias = getattr(properties, "TopicAlias", None)
+                if topic_alias is not None:
+                    # The first message of an alias sets its topic, the next ones have an empty topic
+                    if topic:
+                        self.topic_aliases[topic_alias] = topic
+                    else:
+                        topic = self.topic_aliases.get(topic_alias)
+                        if topic is None:
+                            # Protocol error: unknown topic alias
+                            return False
+                    delattr(properties, "TopicAlias")
+            if packet_id is not None:
+                self.send(_packet(PUBACK if qos == 1 else PUBREC, 0, packet_id))
+            self.broker.publish(topic, body[offset:], qos, retain, properties, self)
+        elif packet_type == PUBREL:
+            self.send(_packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            packet_id = body[:2]
+            offset = 2
+            identifier = None
+            if self.protocol_level == 5:
+                properties, offset = _read_properties(PacketTypes.SUBSCRIBE, body, offset)
+                identifier = getattr(properties, "SubscriptionIdentifier", [None])[0]
+            granted = bytearray()
+            while offset < len(body):
+                topic_filter, offset = _read_string(body, offset)
+                options = body[offset]
+                qos = min(options & 0x03, 1)
+                offset += 1
+                self.broker.subscribe(self, topic_filter.decode("utf-8"), qos, identifier, bool(options & 0x04))
+                granted.append(qos)
+            self.send(_packet(SUBACK, 0, packet_id + (b"\x00" if self.protocol_level == 5 else b"") + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = body[:2]
+            offset = 2
+            if self.protocol_level == 5:
+                _, offset = _read_properties(PacketTypes.UNSUBSCRIBE, body, offset)
+            reason_codes = bytearray()
+            while offset < len(body):
+                topic_filter, offset = _read_string(body, offset)
+                self.broker.unsubscribe(self, topic_filter.decode("utf-8"))
+                reason_codes.append(0)
+            if self.protocol_level == 5:
+                self.send(_packet(UNSUBACK, 0, packet_id + b"\x00" + bytes(reason_codes)))
+            else:
+                self.send(_packet(UNSUBACK, 0, packet_id))
+        elif packet_type == PINGREQ:
+            self.send(_packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            return False
+
+        # PUBACK, PUBREC and PUBCOMP sent by the clients do not require any action
+        return True
+
+
+class MiniBroker:
+    """ Minimal in-process MQTT 3.1.1 and MQTT v5 broker used as a stand-in for benchmarks and replays.
+    It supports QoS 0 and 1 (QoS 2 is acknowledged and delivered as QoS 1), retained messages,
+    wildcard and shared ($share/<group>/...) subscriptions. The MQTT v5 clients can use topic aliases,
+    subscription identifiers, the No Local option and the message properties (forwarded to the v5 subscribers,
+    the message expiry interval applies to the retained messages). There is no persistence, no authentication
+    and no support for will messages """
+
+    def __init__(self, host="127.0.0.1", port=1883, topic_alias_maximum=1000):
+        """
+        Constructor for MiniBroker class
+        :param host: Listening address
+        :param port: Listening port (0 to pick a free port)
+        :param topic_alias_maximum: Topic aliases accepted from each MQTT v5 client (CONNACK Topic Alias Maximum)
+        """
+
+        self.host = host
+        self.port = port
+        self.topic_alias_maximum = topic_alias_maximum
+
+        self._server = None
+        self._sessions = {}
+        self._retained = {}
+        self._dispatcher = TopicDispatcher()
+        self._shared_groups = {}
+
+        # Statistics of the broker
+        self.received_count = 0
+        self.delivered_count = 0
+
+    async def start(self):
+        """ Start listening for the MQTT connections """
+
+        self._server = await asyncio.start_server(self._on_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """ Close the listening socket and all the sessions """
+
+        self._server.close()
+        await self._server.wait_closed()
+        for session in list(self._sessions.values()):
+            session.writer.close()
+
+    async def _on_connection(self, reader, writer):
+        await _Session(self, reader, writer).run()
+
+    def add_session(self, session):
+        """ Register a connected session, closing an existing one with the same client id """
+
+        previous = self._sessions.get(session.client_id)
+        if previous is not None and previous is not session:
+            self.remove_session(previous)
+            previous.writer.close()
+        self._sessions[session.client_id] = session
+
+    def remove_session(self, session):
+        """ Remove all the subscriptions of a closed session """
+
+        for topic_filter in list(session.subscriptions):
+            self.unsubscribe(session, topic_filter)
+        if self._sessions.get(session.client_id) is session:
+            del self._sessions[session.client_id]
+
+    def subscribe(self, session, topic_filter, qos, identifier=None, no_local=False):
+        """ Add a subscription and deliver the matching retained messages """
+
+        if topic_filter in session.subscriptions:
+            self.unsubscribe(session, topic_filter)
+
+        subscription = _Subscription(session, qos, identifier, no_local)
+        session.subscriptions[topic_filter] = subscription
+
+        if topic_filter.startswith("$share/"):
+            _, group, shared_filter = topic_filter.split("/", 2)
+            key = (group, shared_filter)
+            shared_subscription = self._shared_groups.get(key)
+            if shared_subscription is None:
+                shared_subscription = _SharedSubscription()
+                self._shared_groups[key] = shared_subscription
+                self._dispatcher.add_handler(shared_filter, shared_subscription)
+            shared_subscription.members.append(subscription)
+            return
+
+        self._dispatcher.add_handler(topic_filter, subscription)
+
+        # Retained messages are delivered only to the new (non shared) subscription
+        matcher = TopicDispatcher()
+        matcher.add_handler(topic_filter, subscription)
+        now = time.monotonic()
+        for topic, (payload, retained_qos, properties, expiry_time) in list(self._retained.items()):
+            if expiry_time is not None and now >= expiry_time:
+                # Expired retained message
+                del self._retained[topic]
+                continue
+            if matcher.resolve(topic.decode("utf-8")):
+                if expiry_time is not None:
+                    # The subscriber receives the remaining lifetime of the message
+                    properties.MessageExpiryInterval = max(1, int(expiry_time - now))
+                subscription.deliver(topic, payload, retained_qos, True, _property_data(properties))
+
+    def unsubscribe(self, session, topic_filter):
+        """ Remove a subscription of a session """
+
+        subscription = session.subscriptions.pop(topic_filter, None)
+        if subscription is None:
+            return
+
+        if topic_filter.startswith("$share/"):
+            _, group, shared_filter = topic_filter.split("/", 2)
+            shared_subscription = self._shared_groups.get((group, shared_filter))
+            if shared_subscription is not None:
+                shared_subscription.members.remove(subscription)
+                if not shared_subscription.members:
+                    self._dispatcher.remove_handler(shared_filter, shared_subscription)
+                    del self._shared_groups[(group, shared_filter)]
+            return
+
+        self._dispatcher.remove_handler(topic_filter, subscription)
+
+    def publish(self, topic, payload, qos, retain, properties=None, origin=None):
+        """
+        Route a published message to the matching subscriptions
+        :param properties: MQTT v5 properties of the message (None for the MQTT 3.1.1 clients)
+        :param origin: Session publishing the message (No Local subscriptions)
+        """
+
+        self.received_count += 1
+
+        if retain:
+            if payload:
+                expiry_interval = getattr(properties, "MessageExpiryInterval", None)
+                expiry_time = time.monotonic() + expiry_interval if expiry_interval is not None else None
+                self._retained[topic] = (payload, qos, properties, expiry_time)
+            else:
+                self._retained.pop(topic, None)
+
+        property_data = _property_data(properties)
+        for subscription in self._dispatcher.resolve(topic.decode("utf-8")):
+            subscription.deliver(topic, payload, qos, False, property_data, origin)
+            self.delivered_count += 1
+
+
+class BrokerStandIn:
+    """ Local broker used by the benchmarks: a spawned mosquitto process when available on the PATH,
+    otherwise the in-process MiniBroker running on its own event loop thread.
+    Usage: with BrokerStandIn() as (host, port): ... """
+
+    def __init__(self, prefer_mosquitto=True, host="127.0.0.1", port=0):
+        """
+        Constructor for BrokerStandIn class
+        :param prefer_mosquitto: Use mosquitto if it is installed
+        :param host: Listening address
+        :param port: Listening port (0 to pick a free port)
+        """
+
+        self.host = host
+        self.port = port
+        self.prefer_mosquitto = prefer_mosquitto
+        self.kind = None
+        self.broker = None
+
+        self._process = None
+        self._config_file = None
+        self._loop = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self.host, self.port
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """ Start the broker and wait until it accepts connections """
+
+        if self.port == 0:
+            with socket.socket() as probe:
+                probe.bind((self.host, 0))
+                self.port = probe.getsockname()[1]
+
+        mosquitto_path = shutil.which("mosquitto") if self.prefer_mosquitto else None
+        if mosquitto_path is not None:
+            self.kind = "mosquitto"
+            self._config_file = tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False)
+            self._config_file.write(f"listener {self.port} {self.host}\nallow_anonymous true\n")
+            self._config_file.close()
+            self._process = subprocess.Popen([mosquitto_path, "-c", self._config_file.name],
+                                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            self.kind = "mini_broker"
+            started = threading.Event()
+            self._loop = asyncio.new_event_loop()
+            self.broker = MiniBroker(self.host, self.port)
+
+            def run_loop():
+                asyncio.set_event_loop(self._loop)
+                self._loop.run_until_complete(self.broker.start())
+                started.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=run_loop, name="MiniBroker", daemon=True)
+            self._thread.start()
+            started.wait()
+
+        # Wait until the broker accepts connections
+        deadline = time.monotonic() + 5.0
+        while True:
+            try:
+                socket.create_connection((self.host, self.port), timeout=0.5).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def stop(self):
+        """ Stop the broker """
+
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.broker.stop(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+
+
+# Main Script
+if __name__ == "__main__":
+
+    async def main():
+        broker = MiniBroker()
+        await broker.start()
+        print(f"Mini Broker listening on {broker.host}:{broker.port}")
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+# End-to-end throughput and latency benchmark of the producers and consumers
+# Run from the project root with: python -m bench.throughput_benchmark --help
+
+import argparse
+import itertools
+import json
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from bench.mini_broker import BrokerStandIn
+from dto.message_descriptor import MessageDescriptor
+from dto.payload_codec import get_codec, codec_topic, codec_for_message
+
+
+class BenchmarkSubscriber:
+    """ Consumer of the benchmark (json_consumer/device_consumer style) measuring the end-to-end latency.
+    The timestamp of each MessageDescriptor carries the perf_counter_ns of the publisher """
+
+    def __init__(self, client_id, host, port, topic_filter, qos):
+        self.topic_filter = topic_filter
+        self.qos = qos
+        self.latencies_ns = []
+        self.received_count = 0
+        self.error_count = 0
+        self._subscribed = threading.Event()
+
+        self.mqtt_client = mqtt.Client(client_id)
+        self.mqtt_client.on_connect = self._on_connect
+        self.mqtt_client.on_subscribe = self._on_subscribe
+        self.mqtt_client.on_message = self._on_message
+        self.mqtt_client.connect(host, port)
+        self.mqtt_client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe(self.topic_filter, self.qos)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        self._subscribed.set()
+
+    def _on_message(self, client, userdata, message):
+        try:
+            codec, _ = codec_for_message(message)
+            message_descriptor = codec.decode(message.payload, MessageDescriptor)
+            self.latencies_ns.append(time.perf_counter_ns() - message_descriptor.timestamp)
+            self.received_count += 1
+        except Exception:
+            self.error_count += 1
+
+    def wait_subscribed(self, timeout=5.0):
+        if not self._subscribed.wait(timeout):
+            raise TimeoutError(f"Subscription to {self.topic_filter} not acknowledged")
+
+    def stop(self):
+        self.mqtt_client.disconnect()
+        self.mqtt_client.loop_stop()
+
+
+class BenchmarkPublisher:
+    """ Producer of the benchmark (json_producer/device_producer style) publishing at a fixed rate """
+
+    def __init__(self, client_id, host, port, topics, codec, qos, rate, duration):
+        self.topics = topics
+        self.codec = codec
+        self.qos = qos
+        self.rate = rate
+        self.duration = duration
+        self.sent_count = 0
+
+        self.mqtt_client = mqtt.Client(client_id)
+        self.mqtt_client.max_inflight_messages_set(1000)
+        self.mqtt_client.connect(host, port)
+        self.mqtt_client.loop_start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self):
+        self._thread.join()
+
+    def _run(self):
+        """ Publish on the topics in round robin until the end of the benchmark duration """
+
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        start_time = time.monotonic()
+        next_send = start_time
+        value = 20.0
+
+        for topic in itertools.cycle(self.topics):
+            now = time.monotonic()
+            if now - start_time >= self.duration:
+                break
+            if interval:
+                if next_send > now:
+                    time.sleep(next_send - now)
+                next_send += interval
+
+            value = 20.0 + (value + 0.37) % 20.0
+            payload = self.codec.encode(MessageDescriptor(time.perf_counter_ns(), "TEMPERATURE_SENSOR", value))
+            self.mqtt_client.publish(topic, payload, self.qos)
+            self.sent_count += 1
+
+    def stop(self):
+        self.mqtt_client.disconnect()
+        self.mqtt_client.loop_stop()
+
+
+def percentile(sorted_values, fraction):
+    """ Nearest rank percentile of an already sorted list """
+
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(host, port, scenario, codec_name, qos, rate, duration, publishers, subscribers, devices, drain_timeout):
+    """
+    Run a single benchmark scenario
+    :param scenario: "json" (single topic device/temperature) or "device" (device/<id>/sensor/temperature topics)
+    :return: Dictionary with the results of the scenario
+    """
+
+    codec = get_codec(codec_name)
+
+    if scenario == "json":
+        topic_filter = "device/temperature/#"
+        publisher_topics = [[codec_topic("device/temperature", codec)] for _ in range(publishers)]
+    else:
+        topic_filter = "device/+/sensor/#"
+        publisher_topics = [[codec_topic(f"device/bench-{p:03d}-{d:05d}/sensor/temperature", codec) for d in range(devices)]
+                            for p in range(publishers)]
+
+    consumer_clients = [BenchmarkSubscriber(f"bench-consumer-{i}", host, port, topic_filter, qos) for i in range(subscribers)]
+    for consumer in consumer_clients:
+        consumer.wait_subscribed()
+
+    producer_clients = [BenchmarkPublisher(f"bench-producer-{i}", host, port, publisher_topics[i], codec, qos, rate, duration)
+                        for i in range(publishers)]
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    for producer in producer_clients:
+        producer.start()
+    for producer in producer_clients:
+        producer.join()
+
+    # Wait until all the expected messages are received (or the drain timeout expires)
+    sent = sum(producer.sent_count for producer in producer_clients)
+    expected = sent * subscribers
+    deadline = time.monotonic() + drain_timeout
+    while sum(consumer.received_count for consumer in consumer_clients) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    wall_time = time.monotonic() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    for client in producer_clients + consumer_clients:
+        client.stop()
+
+    received = sum(consumer.received_count for consumer in consumer_clients)
+    latencies = sorted(itertools.chain.from_iterable(consumer.latencies_ns for consumer in consumer_clients))
+
+    def latency_ms(fraction):
+        value = percentile(latencies, fraction)
+        return None if value is None else value / 1e6
+
+    return {
+        "scenario": scenario,
+        "codec": codec_name,
+        "qos": qos,
+        "target_rate_per_publisher": rate,
+        "publishers": publishers,
+        "subscribers": subscribers,
+        "devices_per_publisher": devices if scenario == "device" else 1,
+        "sent": sent,
+        "received": received,
+        "lost": expected - received,
+        "decode_errors": sum(consumer.error_count for consumer in consumer_clients),
+        "duration_sec": wall_time,
+        "sent_msgs_per_sec": sent / wall_time,
+        "received_msgs_per_sec": received / wall_time,
+        "latency_p50_ms": latency_ms(0.50),
+        "latency_p99_ms": latency_ms(0.99),
+        "latency_p999_ms": latency_ms(0.999),
+        "cpu_us_per_message": (cpu_time / received * 1e6) if received else None
+    }
+
+
+# Main Script
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="End-to-end MQTT throughput/latency benchmark")
+    parser.add_argument("--scenario", nargs="+", default=["json", "device"], choices=["json", "device"])
+    parser.add_argument("--codec", nargs="+", default=["json", "binary"], help="Payload codecs to benchmark")
+    parser.add_argument("--qos", nargs="+", type=int, default=[0, 1], choices=[0, 1, 2])
+    parser.add_argument("--rate", type=float, default=2000.0, help="Messages per second of each publisher (0 = max)")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of publishing for each scenario")
+    parser.add_argument("--publishers", type=int, default=1)
+    parser.add_argument("--subscribers", type=int, default=1)
+    parser.add_argument("--devices", type=int, default=100, help="Devices simulated by each publisher in the device scenario")
+    parser.add_argument("--drain-timeout", type=float, default=10.0)
+    parser.add_argument("--broker", default=None, help="host:port of an existing broker (default: local broker stand-in)")
+    parser.add_argument("--no-mosquitto", action="store_true", help="Always use the in-process MiniBroker")
+    parser.add_argument("--output", default=None, help="JSON file of the results (default: stdout)")
+    args = parser.parse_args()
+
+    broker_stand_in = None
+    if args.broker:
+        broker_host, broker_port = args.broker.rsplit(":", 1)
+        broker_port = int(broker_port)
+        broker_kind = "external"
+    else:
+        broker_stand_in = BrokerStandIn(prefer_mosquitto=not args.no_mosquitto)
+        broker_stand_in.start()
+        broker_host, broker_port, broker_kind = broker_stand_in.host, broker_stand_in.port, broker_stand_in.kind
+
+    results = []
+    try:
+        for scenario, codec_name, qos in itertools.product(args.scenario, args.codec, args.qos):
+            result = run_scenario(broker_host, broker_port, scenario, codec_name, qos, args.rate, args.duration,
+                                  args.publishers, args.subscribers, args.devices, args.drain_timeout)
+            result["broker"] = broker_kind
+            # The in-process MiniBroker shares the process, so its CPU time is part of cpu_us_per_message
+            result["cpu_includes_broker"] = broker_kind == "mini_broker"
+            results.append(result)
+    finally:
+        if broker_stand_in is not None:
+            broker_stand_in.stop()
+
+    report = json.dumps({"timestamp": int(time.time()), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    else:
+        print(report)
@@ -0,0 +1,64 @@
+# Benchmark of the time-series storage sink: insert rate, time range queries and downsampling
+# Run from the project root with: python -m bench.timeseries_benchmark
+
+import shutil
+import tempfile
+import time
+
+from dto.message_descriptor import MessageDescriptor
+from utils.timeseries_store import TimeSeriesStore
+
+# Configuration variables
+device_count = 100
+samples_per_device = 10000
+query_count = 1000
+query_range_sec = 600
+downsample_bucket_sec = 60
+
+
+def report(name, count, elapsed, unit):
+    """ Print a benchmark line with the rate of an operation """
+    print(f"{name:32} {count:10,} {unit:8} in {elapsed:8.3f} s   {count / elapsed:14,.0f} {unit}/s")
+
+
+# Main Script
+if __name__ == "__main__":
+
+    root_path = tempfile.mkdtemp(prefix="timeseries-benchmark-")
+    try:
+        store = TimeSeriesStore(root_path)
+        device_ids = [f"device{index:05d}" for index in range(device_count)]
+        first_timestamp = 1700000000
+
+        # Consumer path: one MessageDescriptor for each received message, interleaving the devices as the broker does
+        descriptors = [MessageDescriptor(first_timestamp + second, "TEMPERATURE_SENSOR", 20.0 + (second % 100) / 10.0)
+                       for second in range(samples_per_device)]
+        insert_count = device_count * samples_per_device
+        start_time = time.perf_counter()
+        for message_descriptor in descriptors:
+            for device_id in device_ids:
+                store.append_descriptor(device_id, message_descriptor)
+        store.flush()
+        report("append_descriptor + flush", insert_count, time.perf_counter() - start_time, "inserts")
+
+        # Random time range queries on the memory-mapped segments
+        start_time = time.perf_counter()
+        record_count = 0
+        for query_index in range(query_count):
+            range_start = first_timestamp + (query_index * 7919) % (samples_per_device - query_range_sec)
+            timestamps, values = store.query(device_ids[query_index % device_count], "TEMPERATURE_SENSOR",
+                                             range_start, range_start + query_range_sec)
+            record_count += len(timestamps)
+        elapsed = time.perf_counter() - start_time
+        report(f"query ({query_range_sec} s range)", query_count, elapsed, "queries")
+        print(f"{'':32} {record_count / query_count:10,.0f} records/query")
+
+        # Downsampling of the complete series of each device
+        start_time = time.perf_counter()
+        for device_id in device_ids:
+            store.downsample(device_id, "TEMPERATURE_SENSOR", downsample_bucket_sec)
+        report(f"downsample ({downsample_bucket_sec} s mean)", device_count * samples_per_device, time.perf_counter() - start_time, "records")
+
+        store.stop()
+    finally:
+        shutil.rmtree(root_path, ignore_errors=True)
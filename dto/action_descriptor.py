@@ -1,15 +1,30 @@
-import json
+from collections import namedtuple
 
+from dto.json_serializer import encode_json, decode_json
 
-class ActionDescriptor:
-    """ ActionDescriptor class contains the action information """
 
-    def __init__(self, action_type, action_value):
-        """ Constructor for DeviceDescriptor class """
-        self.action_type = action_type
-        self.action_value = action_value
+class ActionDescriptor(namedtuple("ActionDescriptor", ("action_type", "action_value", "sequence"), defaults=(None,))):
+    """ ActionDescriptor class contains the action information.
+    It is an immutable slotted record (no per instance __dict__) with the following fields:
+    :param action_type: Type of the action
+    :param action_value: Value of the action
+    :param sequence: Optional sequence number increasing for each action of a device, used by the devices to drop
+                     the stale or replayed actions (None for the actions without sequence)
+    """
+
+    __slots__ = ()
 
     def to_json(self):
-        """ Convert the object to a JSON string """
-        return json.dumps(self, default=lambda o: o.__dict__)
+        """ Convert the object to a JSON string (the sequence is omitted when it is None) """
+        if self[2] is None:
+            return encode_json({"action_type": self[0], "action_value": self[1]})
+        return encode_json({"action_type": self[0], "action_value": self[1], "sequence": self[2]})
 
+    @classmethod
+    def from_bytes(cls, payload):
+        """
+        Create an ActionDescriptor from a JSON payload
+        :param payload: JSON payload as bytes (e.g. the MQTT message payload) or str, decoded only once
+        """
+        fields = decode_json(payload)
+        return tuple.__new__(cls, (fields["action_type"], fields["action_value"], fields.get("sequence")))
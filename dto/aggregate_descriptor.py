@@ -0,0 +1,46 @@
+from collections import namedtuple
+
+from dto.json_serializer import encode_json, decode_json
+
+
+class AggregateDescriptor(namedtuple("AggregateDescriptor", ("timestamp", "value_type", "window_sec", "count",
+                                                             "min_value", "max_value", "mean_value", "p50_value", "p95_value"))):
+    """ AggregateDescriptor class contains the downsampled statistics of a telemetry window.
+    It is an immutable slotted record (no per instance __dict__) with the following fields:
+    :param timestamp: The timestamp of the end of the window
+    :param value_type: The type of the aggregated values
+    :param window_sec: The duration of the window in seconds
+    :param count: The number of samples of the window
+    :param min_value: The min value of the window
+    :param max_value: The max value of the window
+    :param mean_value: The mean value of the window
+    :param p50_value: The estimated median of the window
+    :param p95_value: The estimated 95th percentile of the window
+    """
+
+    __slots__ = ()
+
+    def to_json(self):
+        """ Convert the object to a JSON string """
+        return encode_json(dict(zip(self._fields, self)))
+
+    @classmethod
+    def from_bytes(cls, payload):
+        """
+        Create an AggregateDescriptor from a JSON payload
+        :param payload: JSON payload as bytes (e.g. the MQTT message payload) or str, decoded only once
+        """
+        fields = decode_json(payload)
+        return tuple.__new__(cls, tuple(fields[name] for name in cls._fields))
+
+    @classmethod
+    def from_window_statistics(cls, value_type, statistics):
+        """
+        Create an AggregateDescriptor from the statistics of a closed TumblingWindow
+        :param value_type: The type of the aggregated values
+        :param statistics: Dictionary returned by TumblingWindow.statistics()
+        """
+        quantiles = statistics["quantiles"]
+        return cls(statistics["window_end"], value_type, statistics["window_end"] - statistics["window_start"],
+                   statistics["count"], statistics["min"], statistics["max"], statistics["mean"],
+                   quantiles.get(0.5), quantiles.get(0.95))
@@ -1,16 +1,27 @@
-import json
+from collections import namedtuple
 
+from dto.json_serializer import encode_json, decode_json
 
-class DeviceDescriptor:
-    """ DeviceDescriptor class contains the device information """
 
-    def __init__(self, device_id, producer, software_version):
-        """ Constructor for DeviceDescriptor class """
-        self.device_id = device_id
-        self.producer = producer
-        self.software_version = software_version
+class DeviceDescriptor(namedtuple("DeviceDescriptor", ("device_id", "producer", "software_version"))):
+    """ DeviceDescriptor class contains the device information.
+    It is an immutable slotted record (no per instance __dict__) with the following fields:
+    :param device_id: Unique identifier of the device
+    :param producer: Manufacturer of the device
+    :param software_version: Software version of the device
+    """
+
+    __slots__ = ()
 
     def to_json(self):
         """ Convert the object to a JSON string """
-        return json.dumps(self, default=lambda o: o.__dict__)
+        return encode_json({"device_id": self[0], "producer": self[1], "software_version": self[2]})
 
+    @classmethod
+    def from_bytes(cls, payload):
+        """
+        Create a DeviceDescriptor from a JSON payload
+        :param payload: JSON payload as bytes (e.g. the MQTT message payload) or str, decoded only once
+        """
+        fields = decode_json(payload)
+        return tuple.__new__(cls, (fields["device_id"], fields["producer"], fields["software_version"]))
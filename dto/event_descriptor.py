@@ -1,21 +1,27 @@
-import json
+from collections import namedtuple
 
+from dto.json_serializer import encode_json, decode_json
 
-class EventDescriptor:
-    """ EventDescriptor class contains the event information """
 
-    def __init__(self, timestamp, event_type, event_value):
-        """
-        Constructor for EventDescriptor class
-        :param timestamp: Timestamp of the event
-        :param event_type: Type of the event
-        :param event_value: Value of the event
-        """
+class EventDescriptor(namedtuple("EventDescriptor", ("timestamp", "event_type", "event_value"))):
+    """ EventDescriptor class contains the event information.
+    It is an immutable slotted record (no per instance __dict__) with the following fields:
+    :param timestamp: Timestamp of the event
+    :param event_type: Type of the event
+    :param event_value: Value of the event
+    """
 
-        self.timestamp = timestamp
-        self.event_type = event_type
-        self.event_value = event_value
+    __slots__ = ()
 
     def to_json(self):
         """ Convert the object to a JSON string """
-        return json.dumps(self, default=lambda o: o.__dict__)
+        return encode_json({"timestamp": self[0], "event_type": self[1], "event_value": self[2]})
+
+    @classmethod
+    def from_bytes(cls, payload):
+        """
+        Create an EventDescriptor from a JSON payload
+        :param payload: JSON payload as bytes (e.g. the MQTT message payload) or str, decoded only once
+        """
+        fields = decode_json(payload)
+        return tuple.__new__(cls, (fields["timestamp"], fields["event_type"], fields["event_value"]))
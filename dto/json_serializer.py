@@ -0,0 +1,29 @@
+import json
+import json.scanner
+
+# Encoder compiled once and shared by all the DTOs (same output format of json.dumps)
+encode_json = json.JSONEncoder().encode
+
+# C scanner of the standard library decoder, used directly to skip the whitespace handling of json.loads
+_scan_json = json.scanner.make_scanner(json.JSONDecoder())
+
+
+def decode_json(payload):
+    """
+    Decode a JSON document from the MQTT message payload
+    :param payload: JSON payload as bytes (decoded once as UTF-8) or str
+    :return: Decoded Python object
+    """
+
+    if not isinstance(payload, str):
+        payload = bytes(payload).decode("utf-8")
+
+    try:
+        value, end = _scan_json(payload, 0)
+        if end == len(payload):
+            return value
+    except StopIteration:
+        pass
+
+    # Leading/trailing whitespace or invalid document: use the complete (and validating) decoder
+    return json.loads(payload)
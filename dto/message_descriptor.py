@@ -1,20 +1,27 @@
-import json
+from collections import namedtuple
 
+from dto.json_serializer import encode_json, decode_json
 
-class MessageDescriptor:
-    """ MessageDescriptor class contains the message information """
 
-    def __init__(self, timestamp, value_type, value):
-        """ Constructor for MessageDescriptor class wih the following parameters:
-        :param timestamp: The timestamp of the message
-        :param value_type: The type of the value
-        :param value: The value of the message
-        """
+class MessageDescriptor(namedtuple("MessageDescriptor", ("timestamp", "value_type", "value"))):
+    """ MessageDescriptor class contains the message information.
+    It is an immutable slotted record (no per instance __dict__) with the following fields:
+    :param timestamp: The timestamp of the message
+    :param value_type: The type of the value
+    :param value: The value of the message
+    """
 
-        self.timestamp = timestamp
-        self.value_type = value_type
-        self.value = value
+    __slots__ = ()
 
     def to_json(self):
         """ Convert the object to a JSON string """
-        return json.dumps(self, default=lambda o: o.__dict__)
+        return encode_json({"timestamp": self[0], "value_type": self[1], "value": self[2]})
+
+    @classmethod
+    def from_bytes(cls, payload):
+        """
+        Create a MessageDescriptor from a JSON payload
+        :param payload: JSON payload as bytes (e.g. the MQTT message payload) or str, decoded only once
+        """
+        fields = decode_json(payload)
+        return tuple.__new__(cls, (fields["timestamp"], fields["value_type"], fields["value"]))
@@ -0,0 +1,324 @@
+import struct
+
+from dto.action_descriptor import ActionDescriptor
+from dto.device_descriptor import DeviceDescriptor
+from dto.event_descriptor import EventDescriptor
+from dto.message_descriptor import MessageDescriptor
+
+
+def dto_to_dict(dto):
+    """ Convert a DTO to a dictionary with its serialized fields """
+    return dict(zip(dto._fields, dto))
+
+
+class JsonCodec:
+    """ Default JSON codec, the same format produced by the to_json method of the DTOs """
+
+    name = "json"
+    content_type = "application/json"
+    topic_suffix = None
+
+    def encode(self, dto):
+        """ Serialize a DTO to a JSON string """
+        return dto.to_json()
+
+    def decode(self, payload, dto_class):
+        """ Deserialize a JSON payload (str or bytes) to a DTO of the given class """
+        return dto_class.from_bytes(payload)
+
+
+class BinaryCodec:
+    """ Compact fixed layout binary codec based on struct packing (little endian).
+    Each payload starts with one byte identifying the DTO kind:
+    - MessageDescriptor: kind(B) timestamp(q) value_type(type code) value(tagged value) -> 19 bytes for a float reading
+    - EventDescriptor: kind(B) timestamp(q) event_type(type code) event_value(tagged value)
+    - ActionDescriptor: kind(B) action_type(type code) action_value(tagged value) [sequence(q), only if not None]
+    - DeviceDescriptor: kind(B) device_id(str) producer(str) software_version(str)
+    Well known types and string values are encoded as one byte enum, any other string
+    is encoded with a 2 bytes length prefix """
+
+    name = "binary"
+    content_type = "application/x-iot-binary"
+    topic_suffix = "bin"
+
+    KIND_MESSAGE = 1
+    KIND_EVENT = 2
+    KIND_ACTION = 3
+    KIND_DEVICE = 4
+
+    # Enumerations of the well known types and string values (append only to stay compatible)
+    TYPE_CODES = ("TEMPERATURE_SENSOR", "SWITCH", "OVER_HEATING")
+    STRING_VALUE_CODES = ("ON", "OFF")
+
+    # Type code used when the type is not in the enumeration (followed by the type string)
+    CUSTOM_TYPE = 0xFF
+
+    # Tags of the encoded values
+    TAG_FLOAT = 0
+    TAG_INT = 1
+    TAG_ENUM_STRING = 2
+    TAG_STRING = 3
+    TAG_NONE = 4
+    TAG_BOOL = 5
+
+    _HEADER_TIMESTAMP = struct.Struct("<Bq")
+    _FLOAT_MESSAGE = struct.Struct("<BqBBd")
+    _FLOAT = struct.Struct("<d")
+    _INT = struct.Struct("<q")
+    _LENGTH = struct.Struct("<H")
+
+    def __init__(self):
+        """ Constructor for BinaryCodec class """
+
+        self._type_codes = {value: index for index, value in enumerate(self.TYPE_CODES)}
+        self._string_value_codes = {value: index for index, value in enumerate(self.STRING_VALUE_CODES)}
+
+    def encode(self, dto):
+        """ Serialize a DTO to bytes """
+
+        dto_class = type(dto)
+
+        if dto_class is MessageDescriptor:
+            type_code = self._type_codes.get(dto.value_type)
+
+            # Fast path for the most common payload: well known type with a float value
+            if type_code is not None and type(dto.value) is float:
+                return self._FLOAT_MESSAGE.pack(self.KIND_MESSAGE, dto.timestamp, type_code, self.TAG_FLOAT, dto.value)
+
+            return (self._HEADER_TIMESTAMP.pack(self.KIND_MESSAGE, dto.timestamp)
+                    + self._pack_type(dto.value_type) + self._pack_value(dto.value))
+
+        if dto_class is EventDescriptor:
+            return (self._HEADER_TIMESTAMP.pack(self.KIND_EVENT, dto.timestamp)
+                    + self._pack_type(dto.event_type) + self._pack_value(dto.event_value))
+
+        if dto_class is ActionDescriptor:
+            payload = bytes([self.KIND_ACTION]) + self._pack_type(dto.action_type) + self._pack_value(dto.action_value)
+            return payload if dto.sequence is None else payload + self._INT.pack(dto.sequence)
+
+        if dto_class is DeviceDescriptor:
+            return (bytes([self.KIND_DEVICE]) + self._pack_string(dto.device_id)
+                    + self._pack_string(dto.producer) + self._pack_string(dto.software_version))
+
+        raise ValueError(f"Unsupported DTO class: {dto_class.__name__}")
+
+    def decode(self, payload, dto_class):
+        """ Deserialize a binary payload to a DTO of the given class """
+
+        payload = bytes(payload)
+        kind = payload[0]
+
+        if dto_class is MessageDescriptor and kind == self.KIND_MESSAGE:
+            if len(payload) == self._FLOAT_MESSAGE.size and payload[10] == self.TAG_FLOAT and payload[9] != self.CUSTOM_TYPE:
+                _, timestamp, type_code, _, value = self._FLOAT_MESSAGE.unpack(payload)
+                return MessageDescriptor(timestamp, self.TYPE_CODES[type_code], value)
+            _, timestamp = self._HEADER_TIMESTAMP.unpack_from(payload, 0)
+            value_type, offset = self._unpack_type(payload, self._HEADER_TIMESTAMP.size)
+            value, _ = self._unpack_value(payload, offset)
+            return MessageDescriptor(timestamp, value_type, value)
+
+        if dto_class is EventDescriptor and kind == self.KIND_EVENT:
+            _, timestamp = self._HEADER_TIMESTAMP.unpack_from(payload, 0)
+            event_type, offset = self._unpack_type(payload, self._HEADER_TIMESTAMP.size)
+            event_value, _ = self._unpack_value(payload, offset)
+            return EventDescriptor(timestamp, event_type, event_value)
+
+        if dto_class is ActionDescriptor and kind == self.KIND_ACTION:
+            action_type, offset = self._unpack_type(payload, 1)
+            action_value, offset = self._unpack_value(payload, offset)
+            sequence = self._INT.unpack_from(payload, offset)[0] if len(payload) >= offset + self._INT.size else None
+            return ActionDescriptor(action_type, action_value, sequence)
+
+        if dto_class is DeviceDescriptor and kind == self.KIND_DEVICE:
+            device_id, offset = self._unpack_string(payload, 1)
+            producer, offset = self._unpack_string(payload, offset)
+            software_version, _ = self._unpack_string(payload, offset)
+            return DeviceDescriptor(device_id, producer, software_version)
+
+        raise ValueError(f"Payload kind {kind} is not a {dto_class.__name__}")
+
+    def _pack_string(self, value):
+        encoded = value.encode("utf-8")
+        return self._LENGTH.pack(len(encoded)) + encoded
+
+    def _unpack_string(self, payload, offset):
+        length = self._LENGTH.unpack_from(payload, offset)[0]
+        offset += self._LENGTH.size
+        return payload[offset:offset + length].decode("utf-8"), offset + length
+
+    def _pack_type(self, value):
+        type_code = self._type_codes.get(value)
+        if type_code is not None:
+            return bytes([type_code])
+        return bytes([self.CUSTOM_TYPE]) + self._pack_string(value)
+
+    def _unpack_type(self, payload, offset):
+        type_code = payload[offset]
+        if type_code != self.CUSTOM_TYPE:
+            return self.TYPE_CODES[type_code], offset + 1
+        return self._unpack_string(payload, offset + 1)
+
+    def _pack_value(self, value):
+        if value is None:
+            return bytes([self.TAG_NONE])
+        if isinstance(value, bool):
+            return bytes([self.TAG_BOOL, int(value)])
+        if isinstance(value, int):
+            return bytes([self.TAG_INT]) + self._INT.pack(value)
+        if isinstance(value, float):
+            return bytes([self.TAG_FLOAT]) + self._FLOAT.pack(value)
+        if isinstance(value, str):
+            value_code = self._string_value_codes.get(value)
+            if value_code is not None:
+                return bytes([self.TAG_ENUM_STRING, value_code])
+            return bytes([self.TAG_STRING]) + self._pack_string(value)
+        raise ValueError(f"Unsupported value type: {type(value).__name__}")
+
+    def _unpack_value(self, payload, offset):
+        tag = payload[offset]
+        offset += 1
+        if tag == self.TAG_FLOAT:
+            return self._FLOAT.unpack_from(payload, offset)[0], offset + self._FLOAT.size
+        if tag == self.TAG_INT:
+            return self._INT.unpack_from(payload, offset)[0], offset + self._INT.size
+        if tag == self.TAG_ENUM_STRING:
+            return self.STRING_VALUE_CODES[payload[offset]], offset + 1
+        if tag == self.TAG_STRING:
+            return self._unpack_string(payload, offset)
+        if tag == self.TAG_NONE:
+            return None, offset
+        if tag == self.TAG_BOOL:
+            return bool(payload[offset]), offset + 1
+        raise ValueError(f"Unknown value tag: {tag}")
+
+
+class MsgPackCodec:
+    """ MessagePack codec (optional, requires: pip install msgpack) """
+
+    name = "msgpack"
+    content_type = "application/msgpack"
+    topic_suffix = "msgpack"
+
+    def __init__(self):
+        """ Constructor for MsgPackCodec class """
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, dto):
+        return self._packb(dto_to_dict(dto))
+
+    def decode(self, payload, dto_class):
+        return dto_class(**self._unpackb(payload))
+
+
+class CborCodec:
+    """ CBOR codec (optional, requires: pip install cbor2) """
+
+    name = "cbor"
+    content_type = "application/cbor"
+    topic_suffix = "cbor"
+
+    def __init__(self):
+        """ Constructor for CborCodec class """
+        import cbor2
+        self._dumps = cbor2.dumps
+        self._loads = cbor2.loads
+
+    def encode(self, dto):
+        return self._dumps(dto_to_dict(dto))
+
+    def decode(self, payload, dto_class):
+        return dto_class(**self._loads(payload))
+
+
+# Registry of the available codecs (the optional ones are registered only if their library is installed)
+JSON_CODEC = JsonCodec()
+_codecs_by_name = {}
+_codecs_by_content_type = {}
+_codecs_by_topic_suffix = {}
+
+
+def register_codec(codec):
+    """
+    Register a codec for the negotiation by name, content type and topic suffix
+    :param codec: Codec instance with name, content_type, topic_suffix, encode and decode
+    """
+
+    _codecs_by_name[codec.name] = codec
+    _codecs_by_content_type[codec.content_type] = codec
+    if codec.topic_suffix is not None:
+        _codecs_by_topic_suffix[codec.topic_suffix] = codec
+
+
+register_codec(JSON_CODEC)
+register_codec(BinaryCodec())
+for _optional_codec_class in (MsgPackCodec, CborCodec):
+    try:
+        register_codec(_optional_codec_class())
+    except ImportError:
+        pass
+
+
+def get_codec(name):
+    """
+    Get a registered codec by name
+    :param name: Codec name (json, binary, msgpack, cbor)
+    """
+
+    codec = _codecs_by_name.get(name)
+    if codec is None:
+        raise ValueError(f"Codec not available: {name} (available: {', '.join(_codecs_by_name)})")
+    return codec
+
+
+def available_codecs():
+    """ Names of the registered codecs """
+    return list(_codecs_by_name)
+
+
+def codec_topic(topic, codec):
+    """
+    Build the topic used to publish with a codec: the codec suffix is appended as last level
+    (e.g. device/<id>/telemetry/temperature/bin), the default JSON codec uses the plain topic
+    """
+
+    if codec.topic_suffix is None:
+        return topic
+    return f"{topic}/{codec.topic_suffix}"
+
+
+def codec_for_topic(topic):
+    """
+    Negotiate the codec from the last level of a topic
+    :return: Tuple (codec, topic without the codec suffix)
+    """
+
+    base_topic, separator, last_level = topic.rpartition("/")
+    if separator:
+        codec = _codecs_by_topic_suffix.get(last_level)
+        if codec is not None:
+            return codec, base_topic
+    return JSON_CODEC, topic
+
+
+def codec_for_content_type(content_type):
+    """ Negotiate the codec from an MQTT v5 content type property (JSON if unknown or missing) """
+    return _codecs_by_content_type.get(content_type, JSON_CODEC)
+
+
+def codec_for_message(message):
+    """
+    Negotiate the codec of a received MQTT message: the MQTT v5 content type property has priority
+    over the topic suffix
+    :return: Tuple (codec, topic without the codec suffix)
+    """
+
+    properties = getattr(message, "properties", None)
+    content_type = getattr(properties, "ContentType", None)
+    if content_type:
+        codec = codec_for_content_type(content_type)
+        suffix_codec, base_topic = codec_for_topic(message.topic)
+        return codec, base_topic if suffix_codec is codec else message.topic
+    return codec_for_topic(message.topic)
+
@@ -3,10 +3,19 @@ import random
 
 class TemperatureSensor:
     """ This class represents a temperature sensor that can measure the temperature in the environment
-    generating random values between 20.0 and 40.0 """
+    generating random values between 20.0 and 40.0, or the slowly drifting values of a stable room """
 
-    def __init__(self):
-        """ Constructor for TemperatureSensor class """
+    def __init__(self, room_temperature=None, noise=0.02, drift=0.01):
+        """
+        Constructor for TemperatureSensor class
+        :param room_temperature: Temperature of a stable room (None for random values between 20.0 and 40.0)
+        :param noise: Standard deviation of the measurement noise of the stable room
+        :param drift: Standard deviation of the random walk of the stable room temperature at each measure
+        """
+
+        self.room_temperature = room_temperature
+        self.noise = noise
+        self.drift = drift
 
         # Set the initial temperature value to 0.0
         self.temperature_value = 0.0
@@ -15,7 +24,12 @@ class TemperatureSensor:
         self.measure_temperature()
 
     def measure_temperature(self):
-        """ Method to generate a random temperature value between 20.0 and 40.0 """
+        """ Method to generate a random temperature value between 20.0 and 40.0 (or around the room temperature) """
 
-        # Generate a random temperature value between 20.0 and 40.0
-        self.temperature_value = random.uniform(20.0, 40.0)
+        if self.room_temperature is None:
+            # Generate a random temperature value between 20.0 and 40.0
+            self.temperature_value = random.uniform(20.0, 40.0)
+        else:
+            # The room temperature drifts slowly and the measure adds the sensor noise
+            self.room_temperature += random.gauss(0.0, self.drift)
+            self.temperature_value = self.room_temperature + random.gauss(0.0, self.noise)
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+class TemperatureSensorArray:
+    """ This class represents an array of N temperature sensors generating their readings at once in NumPy arrays.
+    Each reading is the sum of the following components of a realistic temperature model:
+    - base temperature of the sensor (random between min_base_temperature and max_base_temperature)
+    - diurnal sine wave with a random phase for each sensor
+    - mean reverting random walk (slow drift of the environment)
+    - gaussian measurement noise
+    - injected positive spikes (e.g. overheating) with a configurable probability
+    A seeded RNG makes the generated series reproducible """
+
+    def __init__(self, sensor_count, sampling_interval=1.0, seed=None,
+                 min_base_temperature=22.0, max_base_temperature=30.0,
+                 diurnal_amplitude=3.0, diurnal_period=86400.0,
+                 random_walk_sigma=0.05, mean_reversion=0.01,
+                 noise_sigma=0.1,
+                 spike_probability=0.0005, spike_magnitude=12.0):
+        """
+        Constructor for TemperatureSensorArray class
+        :param sensor_count: Number of sensors of the array
+        :param sampling_interval: Seconds between two consecutive samples
+        :param seed: Seed of the random generator (None for a non reproducible series)
+        :param min_base_temperature: Min base temperature of a sensor
+        :param max_base_temperature: Max base temperature of a sensor
+        :param diurnal_amplitude: Amplitude of the diurnal sine wave
+        :param diurnal_period: Period in seconds of the diurnal sine wave
+        :param random_walk_sigma: Standard deviation of each random walk step
+        :param mean_reversion: Fraction of the random walk drift recovered at each step (0 for a pure random walk)
+        :param noise_sigma: Standard deviation of the gaussian measurement noise
+        :param spike_probability: Probability of a spike for each sample
+        :param spike_magnitude: Max magnitude of a spike
+        """
+
+        self.sensor_count = sensor_count
+        self.sampling_interval = sampling_interval
+        self.diurnal_amplitude = diurnal_amplitude
+        self.diurnal_period = diurnal_period
+        self.random_walk_sigma = random_walk_sigma
+        self.mean_reversion = mean_reversion
+        self.noise_sigma = noise_sigma
+        self.spike_probability = spike_probability
+        self.spike_magnitude = spike_magnitude
+
+        self.rng = np.random.default_rng(seed)
+
+        # Static characteristics of each sensor
+        self.base_temperatures = self.rng.uniform(min_base_temperature, max_base_temperature, sensor_count)
+        self.diurnal_phases = self.rng.uniform(0.0, 2.0 * np.pi, sensor_count)
+
+        # Dynamic state: current random walk drift and elapsed time of the next sample
+        self.drift = np.zeros(sensor_count)
+        self.elapsed_time = 0.0
+
+        # Set the initial temperature values (one for each sensor) generating the first sample
+        self.temperature_values = np.zeros(sensor_count)
+        self.measure_temperature()
+
+    def measure_temperature(self):
+        """ Method to generate a new sample for all the sensors (same API of TemperatureSensor) """
+        self.temperature_values = self.generate(1)[0]
+
+    def generate(self, sample_count):
+        """
+        Generate the next sample_count readings of all the sensors
+        :param sample_count: Number of consecutive samples
+        :return: Array with shape (sample_count, sensor_count)
+        """
+
+        shape = (sample_count, self.sensor_count)
+
+        # Diurnal component computed for all the samples and sensors with broadcasting
+        times = self.elapsed_time + np.arange(sample_count) * self.sampling_interval
+        angles = (2.0 * np.pi / self.diurnal_period) * times[:, np.newaxis] + self.diurnal_phases
+        samples = self.base_temperatures + self.diurnal_amplitude * np.sin(angles)
+
+        # Random walk component
+        steps = self.rng.normal(0.0, self.random_walk_sigma, shape)
+        if self.mean_reversion == 0.0:
+            # Pure random walk: a single cumulative sum over the samples
+            walk = self.drift + np.cumsum(steps, axis=0)
+        else:
+            # Mean reverting walk: vectorized over the sensors, sequential over the samples
+            walk = np.empty(shape)
+            drift = self.drift
+            retention = 1.0 - self.mean_reversion
+            for index in range(sample_count):
+                drift = drift * retention + steps[index]
+                walk[index] = drift
+        self.drift = walk[-1].copy()
+        samples += walk
+
+        # Gaussian measurement noise
+        if self.noise_sigma > 0.0:
+            samples += self.rng.normal(0.0, self.noise_sigma, shape)
+
+        # Injected spikes
+        if self.spike_probability > 0.0:
+            spikes = self.rng.random(shape) < self.spike_probability
+            spike_count = int(spikes.sum())
+            if spike_count:
+                samples[spikes] += self.rng.uniform(0.5, 1.0, spike_count) * self.spike_magnitude
+
+        self.elapsed_time += sample_count * self.sampling_interval
+        return samples
+
+    def chunks(self, chunk_size, chunk_count=None):
+        """
+        Generator of consecutive chunks of readings to feed the publishers
+        :param chunk_size: Number of samples of each chunk
+        :param chunk_count: Number of chunks (None for an infinite generator)
+        :return: Arrays with shape (chunk_size, sensor_count)
+        """
+
+        generated = 0
+        while chunk_count is None or generated < chunk_count:
+            yield self.generate(chunk_size)
+            generated += 1
+
+
+# Generation rate check
+if __name__ == "__main__":
+
+    import time
+
+    sensor_array = TemperatureSensorArray(1000, seed=42)
+    start_time = time.perf_counter()
+    total_samples = 0
+    for chunk in sensor_array.chunks(1000, chunk_count=10):
+        total_samples += chunk.size
+    elapsed_time = time.perf_counter() - start_time
+    print(f"Generated {total_samples} samples in {elapsed_time:.3f} s ({total_samples / elapsed_time:,.0f} samples/s)")
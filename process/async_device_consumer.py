@@ -0,0 +1,81 @@
+# For this example we rely on the Paho MQTT Library for Python driven by an asyncio event loop
+# You can install it through the following command: pip install paho-mqtt
+
+from dto.device_descriptor import DeviceDescriptor
+from dto.message_descriptor import MessageDescriptor
+from utils.async_mqtt_client import AsyncMqttClient
+from utils.logger import configure_logging, get_logger, CONNECTION, INFO, TELEMETRY
+import asyncio
+
+# Configuration variables
+client_id = "clientId0001-Consumer"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+device_info_topic = "device/+/info"
+data_topic = "device/+/sensor/#"
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+telemetry_logger = get_logger(TELEMETRY)
+
+
+async def consume_device_info(mqtt_client):
+    """
+    Handle the device info messages received from the broker
+    :param mqtt_client: Connected AsyncMqttClient
+    """
+
+    async for message in mqtt_client.subscribe(device_info_topic):
+        try:
+            # Create a DeviceDescriptor object from the JSON payload
+            device_descriptor = DeviceDescriptor.from_bytes(message.payload)
+
+            # Log the message received from the broker
+            info_logger.info("Received IoT Message (Retained:%s): Topic: %s DeviceId: %s Manufacturer: %s SoftwareVersion: %s", message.retain, message.topic, device_descriptor.device_id, device_descriptor.producer, device_descriptor.software_version)
+        except Exception as e:
+            info_logger.error("Error processing message: %s", e)
+
+
+async def consume_device_telemetry(mqtt_client):
+    """
+    Handle the device telemetry messages received from the broker
+    :param mqtt_client: Connected AsyncMqttClient
+    """
+
+    async for message in mqtt_client.subscribe(data_topic):
+        try:
+            # Create a MessageDescriptor object from the JSON payload
+            message_descriptor = MessageDescriptor.from_bytes(message.payload)
+
+            # Log the message received from the broker
+            telemetry_logger.info("Received IoT Message: Topic: %s Timestamp: %s Type: %s Value: %s", message.topic, message_descriptor.timestamp, message_descriptor.value_type, message_descriptor.value)
+        except Exception as e:
+            telemetry_logger.error("Error processing message: %s", e)
+
+
+async def main():
+
+    # Create a new asyncio MQTT Client and wait for the connection to the target MQTT Broker
+    mqtt_client = AsyncMqttClient(client_id, broker_ip, broker_port)
+    await mqtt_client.connect()
+    connection_logger.info("Connected !")
+
+    # Each subscription is consumed by its own task on the same event loop
+    connection_logger.info("Subscribed to: %s", device_info_topic)
+    connection_logger.info("Subscribed to: %s", data_topic)
+    await asyncio.gather(consume_device_info(mqtt_client), consume_device_telemetry(mqtt_client))
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+# For this example we rely on the Paho MQTT Library for Python driven by an asyncio event loop
+# You can install it through the following command: pip install paho-mqtt
+
+from model.temperature_sensor import TemperatureSensor
+from dto.message_descriptor import MessageDescriptor
+from dto.device_descriptor import DeviceDescriptor
+from utils.async_mqtt_client import AsyncMqttClient
+from utils.logger import configure_logging, get_logger, CONNECTION, INFO, TELEMETRY
+from utils.topic_schema import TopicSchema, INFO_CHANNEL
+import asyncio
+import time
+import uuid
+
+# Configuration variables
+client_id = "clientId0001-Producer"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+sensor_topic = "sensor/temperature"
+device_base_topic = "device"
+message_limit = 1000
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+telemetry_logger = get_logger(TELEMETRY)
+
+
+async def main():
+
+    # Create a new asyncio MQTT Client and wait for the connection to the target MQTT Broker
+    mqtt_client = AsyncMqttClient(client_id, broker_ip, broker_port)
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+    await mqtt_client.connect()
+
+    # Create Demo Temperature Sensor & Device Descriptor with a random UUID
+    temperature_sensor = TemperatureSensor()
+    device_descriptor = DeviceDescriptor(str(uuid.uuid1()), "PYTHON-ACME_CORPORATION", "0.1-beta")
+
+    # Build the device topics once with the topic schema
+    device_topics = TopicSchema(device_base_topic, (INFO_CHANNEL, sensor_topic)).device(device_descriptor.device_id)
+    info_topic = device_topics[INFO_CHANNEL]
+    data_topic = device_topics[sensor_topic]
+
+    # Publish the retained Device Info with QoS 1 and wait for the broker acknowledgement
+    device_payload_string = device_descriptor.to_json()
+    await mqtt_client.publish(info_topic, device_payload_string, 1, True)
+    info_logger.info("Device Info Published: Topic: %s Payload: %s", info_topic, device_payload_string)
+
+    # Publish messages with the temperature value
+    for message_id in range(message_limit):
+
+        # Measure the temperature
+        temperature_sensor.measure_temperature()
+
+        # Create the payload String in JSON format with the temperature value
+        payload_string = MessageDescriptor(int(time.time()),
+                                           "TEMPERATURE_SENSOR",
+                                           temperature_sensor.temperature_value).to_json()
+
+        # Publish the message to the target topic
+        await mqtt_client.publish(data_topic, payload_string)
+
+        # Log the message sent
+        telemetry_logger.info("Message Sent: %s Topic: %s Payload: %s", message_id, data_topic, payload_string)
+        await asyncio.sleep(1)
+
+    await mqtt_client.disconnect()
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    asyncio.run(main())
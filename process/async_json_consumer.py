@@ -0,0 +1,52 @@
+# For this example we rely on the Paho MQTT Library for Python driven by an asyncio event loop
+# You can install it through the following command: pip install paho-mqtt
+
+from dto.message_descriptor import MessageDescriptor
+from utils.async_mqtt_client import AsyncMqttClient
+from utils.logger import configure_logging, get_logger, CONNECTION, TELEMETRY
+import asyncio
+
+# Configuration variables
+client_id = "clientId0001-Consumer"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+default_topic = "device/temperature"
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+telemetry_logger = get_logger(TELEMETRY)
+
+
+async def main():
+
+    # Create a new asyncio MQTT Client and wait for the connection to the target MQTT Broker
+    mqtt_client = AsyncMqttClient(client_id, broker_ip, broker_port)
+    await mqtt_client.connect()
+    connection_logger.info("Connected !")
+
+    # Iterate over the messages received on the default topic
+    connection_logger.info("Subscribed to: %s", default_topic)
+    async for message in mqtt_client.subscribe(default_topic):
+        try:
+            # Create a MessageDescriptor object from the JSON payload
+            message_descriptor = MessageDescriptor.from_bytes(message.payload)
+
+            # Log the message received from the broker
+            telemetry_logger.info("Received IoT Message: Topic: %s Timestamp: %s Type: %s Value: %s", message.topic, message_descriptor.timestamp, message_descriptor.value_type, message_descriptor.value)
+        except Exception as e:
+            # Log the error message with the exception traceback
+            telemetry_logger.error("Error processing message: %s", e, exc_info=True)
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+# For this example we rely on the Paho MQTT Library for Python driven by an asyncio event loop
+# You can install it through the following command: pip install paho-mqtt
+
+from model.temperature_sensor import TemperatureSensor
+from dto.message_descriptor import MessageDescriptor
+from utils.async_mqtt_client import AsyncMqttClient
+from utils.logger import configure_logging, get_logger, CONNECTION, TELEMETRY
+import asyncio
+import time
+
+# Configuration variables
+client_id = "clientId0001-Producer"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+default_topic = "device/temperature"
+message_limit = 1000
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+telemetry_logger = get_logger(TELEMETRY)
+
+
+async def main():
+
+    # Create a new asyncio MQTT Client and wait for the connection to the target MQTT Broker
+    mqtt_client = AsyncMqttClient(client_id, broker_ip, broker_port)
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+    await mqtt_client.connect()
+    connection_logger.info("Connected !")
+
+    # Create Demo Temperature Sensor
+    temperature_sensor = TemperatureSensor()
+
+    # Publish messages with the temperature value
+    for message_id in range(message_limit):
+
+        # Measure the temperature
+        temperature_sensor.measure_temperature()
+
+        # Create the payload String in JSON format with the temperature value
+        payload_string = MessageDescriptor(int(time.time()),
+                                           "TEMPERATURE_SENSOR",
+                                           temperature_sensor.temperature_value).to_json()
+
+        # Publish the message to the default topic
+        await mqtt_client.publish(default_topic, payload_string)
+
+        # Log the message sent
+        telemetry_logger.info("Message Sent: %s Topic: %s Payload: %s", message_id, default_topic, payload_string)
+
+        # Wait for 1 second before sending the next message without blocking the event loop
+        await asyncio.sleep(1)
+
+    await mqtt_client.disconnect()
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    asyncio.run(main())
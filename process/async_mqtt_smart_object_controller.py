@@ -0,0 +1,151 @@
+# For this example we rely on the Paho MQTT Library for Python driven by an asyncio event loop
+# You can install it through the following command: pip install paho-mqtt
+
+from dto.action_descriptor import ActionDescriptor
+from dto.device_descriptor import DeviceDescriptor
+from dto.event_descriptor import EventDescriptor
+from dto.message_descriptor import MessageDescriptor
+from utils.async_mqtt_client import AsyncMqttClient
+from utils.logger import configure_logging, get_logger, ACTION, CONNECTION, EVENT, INFO, TELEMETRY
+from utils.topic_schema import parse_topic
+import asyncio
+
+# Configuration variables
+client_id = "clientId0001-Consumer"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+target_monitored_device = "device001"
+device_info_topic = f'device/{target_monitored_device}/info'
+device_telemetry_topic = f'device/{target_monitored_device}/telemetry/#'
+device_event_topic = f'device/{target_monitored_device}/event/#'
+device_action_topic = f'device/{target_monitored_device}/action/switch'
+TEMPERATURE_LIMIT = 37
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+telemetry_logger = get_logger(TELEMETRY)
+event_logger = get_logger(EVENT)
+action_logger = get_logger(ACTION)
+
+# Pending scheduled action for each device (a newer action replaces the pending one)
+pending_device_actions = {}
+
+# Tasks of the actions being published (the event loop keeps only weak references to its tasks)
+action_tasks = set()
+
+
+async def trigger_switch_action(mqtt_client, switch_action, switch_value):
+    """
+    Publish a switch action to the broker for a target device and wait for the QoS 1 acknowledgement
+    :param mqtt_client: Connected AsyncMqttClient
+    :param switch_action: Action to trigger
+    :param switch_value: Value of the action
+    """
+    try:
+        action_descriptor_json = ActionDescriptor(action_type=switch_action, action_value=switch_value).to_json()
+        await mqtt_client.publish(device_action_topic, action_descriptor_json, qos=1, retain=False)
+        action_logger.info("Action Published: %s", action_descriptor_json)
+    except Exception as e:
+        action_logger.error("Error processing message: %s", e)
+
+
+def start_switch_action(mqtt_client, switch_action, switch_value):
+    """
+    Publish a switch action in a task of the event loop, without blocking the caller
+    :return: Task publishing the action (referenced by action_tasks until it is done)
+    """
+    task = asyncio.ensure_future(trigger_switch_action(mqtt_client, switch_action, switch_value))
+    action_tasks.add(task)
+    task.add_done_callback(action_tasks.discard)
+    return task
+
+
+def schedule_device_action(mqtt_client, delay_sec, switch_action, switch_value, device_id=target_monitored_device):
+    """
+    Schedule a device action on the event loop (no thread is created for the timer)
+    :param mqtt_client: Connected AsyncMqttClient
+    :param delay_sec: Seconds to wait before triggering the action
+    :param switch_action: Action to trigger
+    :param switch_value: Value of the action
+    :param device_id: Target device used as coalescing key of the pending actions
+    """
+    action_logger.info("Scheduling Action: %s Value: %s in %s seconds", switch_action, switch_value, delay_sec)
+
+    def fire():
+        pending_device_actions.pop(device_id, None)
+        start_switch_action(mqtt_client, switch_action, switch_value)
+
+    previous_handle = pending_device_actions.get(device_id)
+    if previous_handle is not None:
+        previous_handle.cancel()
+    pending_device_actions[device_id] = mqtt_client.call_later(delay_sec, fire)
+
+
+async def consume_device_info(mqtt_client):
+    """ Handle the device info messages received from the broker """
+
+    async for message in mqtt_client.subscribe(device_info_topic):
+        try:
+            device_descriptor = DeviceDescriptor.from_bytes(message.payload)
+            info_logger.info("Received IoT Message (Retained:%s): Topic: %s DeviceId: %s Manufacturer: %s SoftwareVersion: %s", message.retain, message.topic, device_descriptor.device_id, device_descriptor.producer, device_descriptor.software_version)
+        except Exception as e:
+            info_logger.error("Error processing message: %s", e)
+
+
+async def consume_device_telemetry(mqtt_client):
+    """ Handle the device telemetry messages received from the broker """
+
+    async for message in mqtt_client.subscribe(device_telemetry_topic):
+        try:
+            message_descriptor = MessageDescriptor.from_bytes(message.payload)
+            telemetry_logger.info("Received IoT Message: Topic: %s Timestamp: %s Type: %s Value: %s", message.topic, message_descriptor.timestamp, message_descriptor.value_type, message_descriptor.value)
+
+            # Check if the telemetry value is above the temperature limit
+            if message_descriptor.value_type == "TEMPERATURE_SENSOR" and message_descriptor.value > TEMPERATURE_LIMIT:
+
+                # Trigger a switch action to turn off the device without blocking the telemetry consumption
+                start_switch_action(mqtt_client, "SWITCH", "OFF")
+
+                # Schedule a switch action to turn on the device after 10 seconds
+                schedule_device_action(mqtt_client, 10, "SWITCH", "ON", parse_topic(message.topic)[0])
+        except Exception as e:
+            telemetry_logger.error("Error processing message: %s", e)
+
+
+async def consume_device_events(mqtt_client):
+    """ Handle the device event messages received from the broker """
+
+    async for message in mqtt_client.subscribe(device_event_topic):
+        try:
+            event_descriptor = EventDescriptor.from_bytes(message.payload)
+            event_logger.info("Received Event: Topic: %s Type: %s Value: %s", message.topic, event_descriptor.event_type, event_descriptor.event_value)
+        except Exception as e:
+            event_logger.error("Error processing message: %s", e)
+
+
+async def main():
+
+    # Create a new asyncio MQTT Client and wait for the connection to the target MQTT Broker
+    mqtt_client = AsyncMqttClient(client_id, broker_ip, broker_port)
+    await mqtt_client.connect()
+    connection_logger.info("Connected !")
+
+    # All the subscriptions and the scheduled actions share the same event loop
+    await asyncio.gather(consume_device_info(mqtt_client),
+                         consume_device_telemetry(mqtt_client),
+                         consume_device_events(mqtt_client))
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    asyncio.run(main())
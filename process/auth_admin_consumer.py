@@ -4,26 +4,26 @@ import time
 
 import paho.mqtt.client as mqtt
 
+from utils.logger import configure_logging, get_logger, CONNECTION, TELEMETRY
+
 
 # Full MQTT client creation with all the parameters. The only one mandatory in the ClientId that should be unique
 # mqtt_client = Client(client_id="", clean_session=True, userdata=None, protocol=MQTTv311, transport=”tcp”)
 
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
-    print("Connected with result code " + str(rc))
+    connection_logger.info("Connected with result code %s", rc)
     target_topic = account_topic_prefix + "#"
     mqtt_client.subscribe(target_topic)
-    print("Subscribed to: " + target_topic)
+    connection_logger.info("Subscribed to: %s", target_topic)
 
 
 # Define a callback method to receive asynchronous messages
 def on_message(client, userdata, message):
-    print("\n##########################################################")
-    print("message received: ", str(message.payload.decode("utf-8")))
-    print("message topic=", message.topic)
-    print("message qos=", message.qos)
-    print("message retain flag=", message.retain)
-    print("##########################################################")
+    telemetry_logger.info("\n##########################################################\n"
+                          "message received: %s\nmessage topic= %s\nmessage qos= %s\nmessage retain flag= %s\n"
+                          "##########################################################",
+                          message.payload.decode("utf-8"), message.topic, message.qos, message.retain)
 
 
 # Configuration variables
@@ -36,21 +36,36 @@ username = "<admin_account>"
 password = "<admin_password>"
 account_topic_prefix = ""
 
-# Create a new MQTT Client
-mqtt_client = mqtt.Client(client_id)
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
 
-# Attack Paho OnMessage Callback Method
-mqtt_client.on_message = on_message
-mqtt_client.on_connect = on_connect
+    # Attack Paho OnMessage Callback Method
+    mqtt_client.on_message = on_message
+    mqtt_client.on_connect = on_connect
 
-# Set Account Username & Password
-mqtt_client.username_pw_set(username, password)
+    # Set Account Username & Password
+    mqtt_client.username_pw_set(username, password)
 
-# Connect to the target MQTT Broker
-mqtt_client.connect(broker_ip, broker_port)
+    # Connect to the target MQTT Broker
+    mqtt_client.connect(broker_ip, broker_port)
 
-# Blocking call that processes network traffic, dispatches callbacks and
-# handles reconnecting.
-# Other loop*() functions are available that give a threaded interface and a
-# manual interface.
-mqtt_client.loop_forever()
+    # Blocking call that processes network traffic, dispatches callbacks and
+    # handles reconnecting.
+    # Other loop*() functions are available that give a threaded interface and a
+    # manual interface.
+    mqtt_client.loop_forever()
@@ -5,10 +5,12 @@ from model.temperature_sensor import TemperatureSensor
 import paho.mqtt.client as mqtt
 import time
 
+from utils.logger import configure_logging, get_logger, CONNECTION, TELEMETRY
+
 
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
-    print("Connected with result code " + str(rc))
+    connection_logger.info("Connected with result code %s", rc)
 
 #def on_publish(mqttc, obj, mid):
     #print("mid: " + str(mid))
@@ -27,43 +29,58 @@ username = "<your_username>"
 password = "<your_password>"
 account_topic_prefix = "/iot/user/<your_username>/"
 
-# Create a new MQTT Client
-mqtt_client = mqtt.Client(client_id)
-mqtt_client.on_connect = on_connect
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
+    mqtt_client.on_connect = on_connect
 
-# Set Account Username & Password
-mqtt_client.username_pw_set(username, password)
+    # Set Account Username & Password
+    mqtt_client.username_pw_set(username, password)
 
-# Connect to the target MQTT Broker
-print("Connecting to " + broker_ip + " port: " + str(broker_port))
-mqtt_client.connect(broker_ip, broker_port)
+    # Connect to the target MQTT Broker
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+    mqtt_client.connect(broker_ip, broker_port)
 
-# Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
-mqtt_client.loop_start()
+    # Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
+    mqtt_client.loop_start()
 
-# Create Demo Temperature Sensor
-temperature_sensor = TemperatureSensor()
+    # Create Demo Temperature Sensor
+    temperature_sensor = TemperatureSensor()
 
-# MQTT Paho Publish method with all the available parameters
-# mqtt_client.publish(topic, payload=None, qos=0, retain=False)
+    # MQTT Paho Publish method with all the available parameters
+    # mqtt_client.publish(topic, payload=None, qos=0, retain=False)
 
-# Publish messages with the temperature value
-for message_id in range(message_limit):
+    # Publish messages with the temperature value
+    for message_id in range(message_limit):
 
-    # Measure the temperature
-    temperature_sensor.measure_temperature()
+        # Measure the temperature
+        temperature_sensor.measure_temperature()
 
-    # Create the payload string with the temperature value
-    payload_string = temperature_sensor.temperature_value
+        # Create the payload string with the temperature value
+        payload_string = temperature_sensor.temperature_value
 
-    # Publish the message to the target topic composed by the account topic prefix and the default topic
-    target_topic = account_topic_prefix + default_topic
+        # Publish the message to the target topic composed by the account topic prefix and the default topic
+        target_topic = account_topic_prefix + default_topic
 
-    # Publish the message to the topic
-    mqtt_client.publish(target_topic, payload_string)
+        # Publish the message to the topic
+        mqtt_client.publish(target_topic, payload_string)
 
-    # Print the message sent and sleep for 1 second
-    print(f"Message Sent: {message_id} Topic: {target_topic} Payload: {payload_string}")
-    time.sleep(1)
+        # Log the message sent and sleep for 1 second
+        telemetry_logger.info("Message Sent: %s Topic: %s Payload: %s", message_id, target_topic, payload_string)
+        time.sleep(1)
 
-mqtt_client.loop_stop()
+    mqtt_client.loop_stop()
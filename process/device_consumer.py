@@ -4,7 +4,14 @@
 import paho.mqtt.client as mqtt
 from dto.device_descriptor import DeviceDescriptor
 from dto.message_descriptor import MessageDescriptor
-import json
+from dto.payload_codec import codec_for_message
+from utils.device_registry import DeviceRegistry
+from utils.logger import configure_logging, get_logger, CONNECTION, INFO, TELEMETRY
+from utils.metrics import MqttClientMetrics, REGISTRY, start_http_server
+from utils.timeseries_store import TimeSeriesStore
+from utils.topic_dispatcher import TopicDispatcher
+from utils.topic_schema import parse_topic
+from utils.work_dispatcher import WorkDispatcher
 
 
 # Full MQTT client creation with all the parameters. The only one mandatory in the ClientId that should be unique
@@ -13,32 +20,33 @@ import json
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
 
-    # Print the connection result contained in the variable rc
-    print("Connected with result code " + str(rc))
+    # Log the connection result contained in the variable rc
+    connection_logger.info("Connected with result code %s", rc)
 
     # After the connection is established, subscribe to the device info and data topics
     mqtt_client.subscribe(device_info_topic)
     mqtt_client.subscribe(data_topic)
 
-    # Print the topics we are subscribed to
-    print("Subscribed to: " + device_info_topic)
-    print("Subscribed to: " + data_topic)
+    # Log the topics we are subscribed to
+    connection_logger.info("Subscribed to: %s", device_info_topic)
+    connection_logger.info("Subscribed to: %s", data_topic)
 
 
 # Define a callback method to receive asynchronous messages
 def on_message(client, userdata, message):
 
-    # If the message received is in the device info topic
-    # We use the MQTT Paho topic_matches_sub method to match the topic with the device info topic
-    if mqtt.topic_matches_sub(device_info_topic, message.topic):
-        handle_device_info_message(message)
-    # If the message received is in the data topic
-    # We use the MQTT Paho topic_matches_sub method to match the topic with the device info topic
-    elif mqtt.topic_matches_sub(data_topic, message.topic):
-        handle_device_telemetry_message(message)
-    # If the message received is in an unmanaged topic
-    else:
-        print("Unmanaged Topic !")
+    # The message is queued in the shard of its device and routed by the TopicDispatcher (single walk of the compiled
+    # topic filters) on the handler pool, so the network thread is never blocked by the handlers
+    work_dispatcher.submit(message)
+
+
+def handle_unmanaged_message(message):
+    """
+    Handle a message received on an unmanaged topic
+    :param message:
+    :return:
+    """
+    connection_logger.warning("Unmanaged Topic: %s", message.topic)
 
 
 def handle_device_info_message(message):
@@ -49,21 +57,26 @@ def handle_device_info_message(message):
     """
 
     try:
-        # Decode the message payload from an array of bytes to a string
-        message_payload = str(message.payload.decode("utf-8"))
+        # An empty retained message clears the info of a removed device (device/<device_id>/info)
+        if not message.payload:
+            device_registry.remove(parse_topic(message.topic)[0])
+            info_logger.info("Device Removed: Topic: %s", message.topic)
+            return
 
-        # Create a DeviceDescriptor object from the JSON payload
-        device_descriptor = DeviceDescriptor(**json.loads(message_payload))
+        # Create a DeviceDescriptor object directly from the JSON payload bytes
+        device_descriptor = DeviceDescriptor.from_bytes(message.payload)
 
-        # Print the message received from the broker
-        print(f"Received IoT Message (Retained:{message.retain}): Topic: {message.topic} DeviceId: {device_descriptor.device_id} Manufacturer: {device_descriptor.producer} SoftwareVersion: {device_descriptor.software_version}")
-    except Exception as e:
+        # Log the message received from the broker
+        info_logger.info("Received IoT Message (Retained:%s): Topic: %s DeviceId: %s Manufacturer: %s SoftwareVersion: %s", message.retain, message.topic, device_descriptor.device_id, device_descriptor.producer, device_descriptor.software_version)
 
-        # Print the exception traceback
-        #traceback.print_exc()
+        # Keep the descriptor in the registry for the per device lookups
+        device_registry.update(device_descriptor)
+    except Exception as e:
 
-        # Print the error message
-        print(f"Error processing message: {e}")
+        # Log the error message (add exc_info=True to log the exception traceback)
+        info_logger.error("Error processing message: %s", e)
+        if client_metrics is not None:
+            client_metrics.parse_error(message.topic)
 
 
 def handle_device_telemetry_message(message):
@@ -73,22 +86,26 @@ def handle_device_telemetry_message(message):
     :return:
     """
     try:
-        # Decode the message payload from an array of bytes to a string
-        message_payload = str(message.payload.decode("utf-8"))
+        # Negotiate the payload codec from the topic suffix (JSON by default) and create a MessageDescriptor object
+        codec, _ = codec_for_message(message)
+        message_descriptor = codec.decode(message.payload, MessageDescriptor)
 
-        # Create a MessageDescriptor object from the JSON payload
-        message_descriptor = MessageDescriptor(**json.loads(message_payload))
+        # Log the message received from the broker
+        telemetry_logger.info("Received IoT Message: Topic: %s Timestamp: %s Type: %s Value: %s", message.topic, message_descriptor.timestamp, message_descriptor.value_type, message_descriptor.value)
 
-        # Print the message received from the broker
-        print(
-            f"Received IoT Message: Topic: {message.topic} Timestamp: {message_descriptor.timestamp} Type: {message_descriptor.value_type} Value: {message_descriptor.value}")
-    except Exception as e:
+        # Update the last seen time of the device (device/<device_id>/sensor/...)
+        device_id = parse_topic(message.topic)[0]
+        device_registry.touch(device_id)
 
-        # Print the exception traceback
-        #traceback.print_exc()
+        # Append the numeric values to the storage sink
+        if timeseries_store is not None:
+            timeseries_store.append_descriptor(device_id, message_descriptor)
+    except Exception as e:
 
-        # Print the error message
-        print(f"Error processing message: {e}")
+        # Log the error message (add exc_info=True to log the exception traceback)
+        telemetry_logger.error("Error processing message: %s", e)
+        if client_metrics is not None:
+            client_metrics.parse_error(message.topic)
 
 
 # Configuration variables
@@ -99,18 +116,101 @@ device_info_topic = "device/+/info"
 data_topic = "device/+/sensor/#"
 message_limit = 1000
 
-# Create a new MQTT Client
-mqtt_client = mqtt.Client(client_id)
-
-# Attack Paho OnMessage Callback Method
-mqtt_client.on_message = on_message
-mqtt_client.on_connect = on_connect
-
-# Connect to the target MQTT Broker
-mqtt_client.connect(broker_ip, broker_port)
-
-# Blocking call that processes network traffic, dispatches callbacks and
-# handles reconnecting.
-# Other loop*() functions are available that give a threaded interface and a
-# manual interface.
-mqtt_client.loop_forever()
+# Handler execution: the network thread only queues the messages, a pool of thread shards executes the handlers
+# keeping the order of the messages of each device (the handlers update the device registry and the time-series store
+# of the script, so the consumer uses the "thread" mode: the "process" shards would update copies lost at their exit)
+dispatch_shard_count = 4
+dispatch_queue_size = 1000
+metrics_report_interval_sec = 10
+
+# Device registry: descriptors of the retained info messages, evicted after device_ttl_sec without messages and
+# saved to the snapshot file every registry_maintenance_interval_sec to warm up a restart (opt-in, e.g. "device_registry.json")
+device_ttl_sec = 3600
+device_registry_snapshot_path = None
+registry_maintenance_interval_sec = 60
+
+# Time-series storage sink: the numeric telemetry is appended to per device columnar segments
+# and written every timeseries_flush_interval_sec (opt-in, e.g. "timeseries")
+timeseries_store_path = None
+timeseries_flush_interval_sec = 1.0
+
+# OpenMetrics endpoint of the client metrics (messages, bytes, latencies, errors): http://<host>:<metrics_port>/metrics (None to disable)
+metrics_port = None
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Registry of the known devices (per device lookups without the broker)
+device_registry = DeviceRegistry(ttl_sec=device_ttl_sec, snapshot_path=device_registry_snapshot_path)
+
+# Time-series storage sink (created by the main script)
+timeseries_store = None
+
+# Metrics of the MQTT Client (created by the main script when the metrics endpoint is enabled)
+client_metrics = None
+
+# Compile the managed topic filters into the dispatcher (registration order is the matching priority)
+topic_dispatcher = TopicDispatcher(default_handler=handle_unmanaged_message)
+topic_dispatcher.add_handler(device_info_topic, handle_device_info_message)
+topic_dispatcher.add_handler(data_topic, handle_device_telemetry_message)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Warm up the device registry from the last snapshot and start its eviction and snapshot thread
+    loaded_count = device_registry.load_snapshot()
+    info_logger.info("Device Registry: %s devices loaded from %s", loaded_count, device_registry_snapshot_path)
+    device_registry.start(registry_maintenance_interval_sec)
+
+    # Open the time-series storage sink and start its flush thread
+    if timeseries_store_path:
+        timeseries_store = TimeSeriesStore(timeseries_store_path)
+        timeseries_store.start(timeseries_flush_interval_sec)
+
+    # Start the handler pool with bounded queues (backpressure) and periodic queue depth and latency reports
+    work_dispatcher = WorkDispatcher(topic_dispatcher.dispatch, shard_count=dispatch_shard_count, max_queue_size=dispatch_queue_size,
+                                     mode="thread", report_interval=metrics_report_interval_sec)
+    work_dispatcher.start()
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
+
+    # Attack Paho OnMessage Callback Method
+    mqtt_client.on_message = on_message
+    mqtt_client.on_connect = on_connect
+
+    # Instrument the client (after setting its callbacks) and expose the metrics on the OpenMetrics endpoint
+    if metrics_port:
+        client_metrics = MqttClientMetrics(client_id)
+        client_metrics.instrument(mqtt_client)
+        REGISTRY.add_collector("work_dispatcher", work_dispatcher.metrics)
+        start_http_server(metrics_port)
+
+    # Connect to the target MQTT Broker
+    mqtt_client.connect(broker_ip, broker_port)
+
+    # Blocking call that processes network traffic, dispatches callbacks and
+    # handles reconnecting.
+    # Other loop*() functions are available that give a threaded interface and a
+    # manual interface.
+    try:
+        mqtt_client.loop_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Execute the queued messages, then write the buffered records and save a last snapshot of the registry
+        mqtt_client.disconnect()
+        work_dispatcher.stop()
+        if timeseries_store is not None:
+            timeseries_store.stop()
+        device_registry.stop()
@@ -0,0 +1,355 @@
+# For this example we rely on the Paho MQTT Library for Python
+# You can install it through the following command: pip install paho-mqtt
+
+from dto.action_descriptor import ActionDescriptor
+from dto.event_descriptor import EventDescriptor
+from dto.message_descriptor import MessageDescriptor
+from dto.device_descriptor import DeviceDescriptor
+from dto.payload_codec import get_codec, codec_for_message
+from model.switch_actuator import SwitchActuator
+from model.temperature_sensor import TemperatureSensor
+from utils.asyncio_mqtt_helper import AsyncioMqttHelper
+from utils.connection_pool import MqttConnectionPool
+from utils.logger import configure_logging, get_logger, ACTION, CONNECTION, METRICS, TELEMETRY
+from utils.topic_schema import TopicSchema, ACTION_CHANNEL, EVENT_CHANNEL, INFO_CHANNEL, SWITCH_CHANNEL, TEMPERATURE_CHANNEL
+import paho.mqtt.client as mqtt
+import asyncio
+import time
+
+# Configuration variables
+client_id_prefix = "clientId-Fleet"
+device_id_prefix = "fleet-device"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+device_base_topic = "device"
+device_count = 1000
+shared_connection = True
+
+# Gateway mode: the devices are multiplexed on a pool of connection_pool_size connections (0 to disable)
+connection_pool_size = 0
+connection_pool_max_inflight = 20
+sampling_interval_sec = 1.0
+stagger_slots = 100
+
+# Vectorized sensor readings (requires NumPy): samples generated in chunks for all the devices at once
+use_sensor_array = False
+sensor_array_chunk_samples = 60
+sensor_array_seed = 42
+report_interval_sec = 10.0
+TEMPERATURE_ALERT_LIMIT = 35
+
+# Payload codec of telemetry and events (json, binary, msgpack, cbor), the device info is always JSON
+payload_codec = get_codec("json")
+
+# Topic hierarchy of the devices (the codec suffix is appended to the telemetry and event topics)
+topic_schema = TopicSchema(device_base_topic, codec=payload_codec)
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+action_logger = get_logger(ACTION)
+metrics_logger = get_logger(METRICS)
+
+
+class VirtualSmartObject:
+    """ This class represents a single virtual MQTT Smart Object of the fleet, with the same behaviour of
+    mqtt_smart_object.py (temperature telemetry, OVER_HEATING events, switch actions) but without any
+    module level global so that thousands of instances can live in the same process """
+
+    __slots__ = ("sensor_index", "device_descriptor", "temperature_sensor", "switch_actuator", "mqtt_client",
+                 "info_topic", "temperature_topic", "switch_topic", "event_topic", "action_topic", "last_action_sequence")
+
+    def __init__(self, device_id, mqtt_client=None, sensor_index=0):
+        """
+        Constructor for VirtualSmartObject class
+        :param device_id: Unique identifier of the virtual device
+        :param mqtt_client: MQTT Client used by the device (shared with other devices or dedicated)
+        :param sensor_index: Index of the device in the readings of a TemperatureSensorArray
+        """
+
+        self.sensor_index = sensor_index
+        self.device_descriptor = DeviceDescriptor(device_id, "PYTHON-ACME_CORPORATION", "0.1-beta")
+        self.temperature_sensor = TemperatureSensor()
+        self.switch_actuator = SwitchActuator()
+        self.mqtt_client = mqtt_client
+
+        # Topics are built only once for each device by the topic schema
+        device_topics = topic_schema.device(device_id)
+        self.info_topic = device_topics[INFO_CHANNEL]
+        self.temperature_topic = device_topics[TEMPERATURE_CHANNEL]
+        self.switch_topic = device_topics[SWITCH_CHANNEL]
+        self.event_topic = device_topics[EVENT_CHANNEL]
+        self.action_topic = topic_schema.subscription(ACTION_CHANNEL, device_id)
+
+        # Sequence number of the last applied action (older actions are stale or replayed)
+        self.last_action_sequence = None
+
+    def publish_device_info(self):
+        """ Publish the retained device descriptor """
+        self.mqtt_client.publish(self.info_topic, self.device_descriptor.to_json(), 0, True)
+
+    def publish_switch_telemetry(self):
+        """ Publish the current status of the switch actuator """
+
+        switch_value = "ON" if self.switch_actuator.switch_status else "OFF"
+        payload_string = payload_codec.encode(MessageDescriptor(int(time.time()), "SWITCH", switch_value))
+        self.mqtt_client.publish(self.switch_topic, payload_string)
+
+    def sample(self, temperature_value=None):
+        """
+        Measure the temperature and publish the telemetry (and the OVER_HEATING event if required)
+        :param temperature_value: Reading provided by a TemperatureSensorArray, None to use the device TemperatureSensor
+        :return: Number of published messages
+        """
+
+        if temperature_value is None:
+            self.temperature_sensor.measure_temperature()
+        else:
+            self.temperature_sensor.temperature_value = temperature_value
+
+        if not self.switch_actuator.switch_status:
+            return 0
+
+        temperature_value = self.temperature_sensor.temperature_value
+        timestamp = int(time.time())
+        self.mqtt_client.publish(self.temperature_topic,
+                                 payload_codec.encode(MessageDescriptor(timestamp, "TEMPERATURE_SENSOR", temperature_value)))
+
+        if temperature_value > TEMPERATURE_ALERT_LIMIT:
+            self.mqtt_client.publish(self.event_topic,
+                                     payload_codec.encode(EventDescriptor(timestamp, "OVER_HEATING", temperature_value)))
+            return 2
+
+        return 1
+
+    def handle_action_message(self, message):
+        """
+        Handle the device action message received from the broker
+        :param message: Message received from the broker
+        """
+
+        try:
+            codec, _ = codec_for_message(message)
+            action_descriptor = codec.decode(message.payload, ActionDescriptor)
+
+            if action_descriptor.action_type != "SWITCH":
+                return
+
+            # Drop the stale or replayed actions (the actions without sequence are always applied)
+            if action_descriptor.sequence is not None:
+                if self.last_action_sequence is not None and action_descriptor.sequence <= self.last_action_sequence:
+                    return
+                self.last_action_sequence = action_descriptor.sequence
+
+            if action_descriptor.action_value == "ON" and not self.switch_actuator.switch_status:
+                self.switch_actuator.set_switch_status(True)
+            elif action_descriptor.action_value == "OFF" and self.switch_actuator.switch_status:
+                self.switch_actuator.set_switch_status(False)
+
+            # The status is reported even if the action was already applied, so the controller state cache converges
+            self.publish_switch_telemetry()
+        except Exception as e:
+            action_logger.error("Error processing message: %s", e)
+
+
+class DeviceFleet:
+    """ This class hosts N virtual smart objects in a single process driven by one asyncio event loop.
+    Devices can share a single MQTT connection (topic based identity), a small pool of connections with failover
+    (gateway mode) or use a dedicated connection with a per-device client id. The sampling of the devices is staggered over a fixed number of slots
+    of the sampling interval so that the publishing load is spread uniformly over time """
+
+    def __init__(self, device_count, shared_connection=True, sampling_interval=1.0, stagger_slots=100, sensor_array=None,
+                 pool_size=0):
+        """
+        Constructor for DeviceFleet class
+        :param device_count: Number of virtual devices
+        :param shared_connection: If True all the devices share the same MQTT connection
+        :param pool_size: If > 0 the devices are multiplexed on a MqttConnectionPool of pool_size connections
+        :param sampling_interval: Seconds between two samples of the same device
+        :param stagger_slots: Number of slots used to spread the devices over the sampling interval
+        :param sensor_array: Optional TemperatureSensorArray with device_count sensors feeding the readings in chunks
+        """
+
+        self.shared_connection = shared_connection
+        self.pool_size = pool_size
+        self.pool = None
+        self.sampling_interval = sampling_interval
+        self.stagger_slots = max(1, min(stagger_slots, device_count))
+
+        self.devices = {}
+        self.clients = []
+
+        # Devices assigned to each slot of the sampling interval
+        self._slots = [[] for _ in range(self.stagger_slots)]
+        for index in range(device_count):
+            device = VirtualSmartObject(f"{device_id_prefix}-{index:06d}", sensor_index=index)
+            self.devices[device.device_descriptor.device_id] = device
+            self._slots[index % self.stagger_slots].append(device)
+
+        self._helper = None
+
+        # Chunk of readings of the sensor array and current sample (row) of the chunk
+        self.sensor_array = sensor_array
+        self._readings = None
+        self._reading_rows = []
+
+        # Statistics of the fleet
+        self.published_count = 0
+        self.max_lag = 0.0
+
+    def _create_client(self, client_id):
+        """ Create a MQTT Client driven by the asyncio event loop """
+
+        client = mqtt.Client(client_id)
+        self._helper.attach(client)
+        self.clients.append(client)
+        return client
+
+    def _on_shared_message(self, client, userdata, message):
+        """ Route an action received on the shared connection to the target virtual device """
+
+        # Topic structure: device/<device_id>/action/switch
+        device = self.devices.get(topic_schema.device_id(message.topic))
+        if device is not None:
+            device.handle_action_message(message)
+
+    def _on_device_message(self, client, userdata, message):
+        """ Route an action received on a dedicated connection (the device is the client userdata) or on a pool connection """
+
+        device = userdata if isinstance(userdata, VirtualSmartObject) else self.devices.get(topic_schema.device_id(message.topic))
+        if device is not None:
+            device.handle_action_message(message)
+
+    def connect(self):
+        """ Connect the MQTT Clients of the fleet and publish the device infos """
+
+        self._helper = AsyncioMqttHelper(asyncio.get_running_loop())
+
+        if self.pool_size:
+            self.pool = MqttConnectionPool(f"{client_id_prefix}-pool", self.pool_size, connection_pool_max_inflight,
+                                           client_factory=self._create_client)
+            for device in self.devices.values():
+                device.mqtt_client = self.pool.device_client(device.device_descriptor.device_id)
+                device.mqtt_client.subscribe(device.action_topic, self._on_device_message)
+            self.pool.connect(broker_ip, broker_port, loop_start=False)
+        elif self.shared_connection:
+            client = self._create_client(f"{client_id_prefix}-shared")
+            client.on_message = self._on_shared_message
+            client.connect(broker_ip, broker_port)
+            client.subscribe(topic_schema.subscription(ACTION_CHANNEL))
+            for device in self.devices.values():
+                device.mqtt_client = client
+        else:
+            for device in self.devices.values():
+                client = self._create_client(f"{client_id_prefix}-{device.device_descriptor.device_id}")
+                client.user_data_set(device)
+                client.on_message = self._on_device_message
+                client.connect(broker_ip, broker_port)
+                client.subscribe(device.action_topic)
+                device.mqtt_client = client
+
+        for device in self.devices.values():
+            device.publish_device_info()
+            device.publish_switch_telemetry()
+
+    async def run(self, duration_sec=None):
+        """
+        Run the staggered sampling of all the devices
+        :param duration_sec: Seconds of simulation, None to run forever
+        """
+
+        self.connect()
+        connection_logger.info("Fleet Started: %s devices Shared Connection: %s Pool Size: %s Clients: %s",
+                               len(self.devices), self.shared_connection, self.pool_size, len(self.clients))
+
+        slot_interval = self.sampling_interval / self.stagger_slots
+        start_time = time.monotonic()
+        next_slot_time = start_time
+        next_report_time = start_time + report_interval_sec
+        report_published_count = 0
+        slot_index = 0
+
+        while duration_sec is None or time.monotonic() - start_time < duration_sec:
+
+            # Sample all the devices of the current slot
+            if self.sensor_array is None:
+                for device in self._slots[slot_index]:
+                    self.published_count += device.sample()
+            else:
+                # A new sample of the sensor array is used at the beginning of each sampling cycle
+                if slot_index == 0:
+                    self._next_readings()
+                readings = self._readings
+                for device in self._slots[slot_index]:
+                    self.published_count += device.sample(readings[device.sensor_index])
+
+            slot_index = (slot_index + 1) % self.stagger_slots
+            next_slot_time += slot_interval
+
+            # Wait for the next slot giving the event loop the time to send and receive, or track the lag when late
+            now = time.monotonic()
+            lag = now - next_slot_time
+            if lag < 0:
+                await asyncio.sleep(-lag)
+            else:
+                self.max_lag = max(self.max_lag, lag)
+                await asyncio.sleep(0)
+
+            if now >= next_report_time:
+                rate = (self.published_count - report_published_count) / report_interval_sec
+                metrics_logger.info("Fleet Report: Published: %s Rate: %.1f msg/s Max Lag: %.1f ms", self.published_count, rate, self.max_lag * 1000.0)
+                report_published_count = self.published_count
+                next_report_time += report_interval_sec
+                self.max_lag = 0.0
+
+                # The pool connections driven by the event loop are reconnected by the fleet
+                if self.pool is not None and self.pool.connected_count() < self.pool_size:
+                    metrics_logger.info("Connection Pool: %s", self.pool.metrics())
+                    self.pool.reconnect()
+
+        self.disconnect()
+
+    def _next_readings(self):
+        """ Move to the next sample of the sensor array, generating a new chunk when the current one is consumed """
+
+        if not self._reading_rows:
+            # Rows are converted once to lists of Python floats (cheaper to index and to serialize)
+            self._reading_rows = self.sensor_array.generate(sensor_array_chunk_samples).tolist()
+            self._reading_rows.reverse()
+        self._readings = self._reading_rows.pop()
+
+    def disconnect(self):
+        """ Disconnect all the MQTT Clients of the fleet """
+
+        if self.pool is not None:
+            self.pool.disconnect()
+        else:
+            for client in self.clients:
+                client.disconnect()
+        self._helper.close()
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create the optional sensor array (NumPy is imported only when it is used)
+    fleet_sensor_array = None
+    if use_sensor_array:
+        from model.temperature_sensor_array import TemperatureSensorArray
+        fleet_sensor_array = TemperatureSensorArray(device_count, sampling_interval=sampling_interval_sec, seed=sensor_array_seed)
+
+    # Create the fleet of virtual devices and run it on the asyncio event loop
+    fleet = DeviceFleet(device_count,
+                        shared_connection=shared_connection,
+                        sampling_interval=sampling_interval_sec,
+                        stagger_slots=stagger_slots,
+                        sensor_array=fleet_sensor_array,
+                        pool_size=connection_pool_size)
+    asyncio.run(fleet.run())
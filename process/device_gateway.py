@@ -0,0 +1,86 @@
+# For this example we rely on the Paho MQTT Library for Python
+# You can install it through the following command: pip install paho-mqtt
+# Gateway proxying many temperature sensors: the logical devices are multiplexed on a small pool of broker connections
+# (topic based identity device/<device_id>/...) instead of opening one connection for each sensor
+
+from model.temperature_sensor import TemperatureSensor
+from dto.message_descriptor import MessageDescriptor
+from dto.device_descriptor import DeviceDescriptor
+from utils.connection_pool import MqttConnectionPool
+from utils.topic_schema import TopicSchema, INFO_CHANNEL
+import time
+
+from utils.logger import configure_logging, get_logger, CONNECTION, INFO, METRICS, TELEMETRY
+
+# Configuration variables
+client_id_prefix = "clientId0001-Gateway"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+sensor_topic = "sensor/temperature"
+device_base_topic = "device"
+device_id_prefix = "gateway-device"
+device_count = 200
+pool_size = 4
+pool_max_inflight = 20
+telemetry_qos = 0
+sampling_interval_sec = 1.0
+message_limit = 1000
+metrics_report_interval_sec = 10
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 100
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+metrics_logger = get_logger(METRICS)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create the pool of connections, each one driven by its Paho network thread (automatic reconnection)
+    connection_pool = MqttConnectionPool(client_id_prefix, pool_size, pool_max_inflight)
+    connection_logger.info("Connecting %s connections to %s port: %s", pool_size, broker_ip, broker_port)
+    connection_pool.connect(broker_ip, broker_port)
+
+    # Create the logical devices: a sensor, a descriptor, a pooled client and the topics of each device (built once)
+    topic_schema = TopicSchema(device_base_topic, (INFO_CHANNEL, sensor_topic))
+    devices = []
+    for device_index in range(device_count):
+        device_descriptor = DeviceDescriptor(f"{device_id_prefix}-{device_index:06d}", "PYTHON-ACME_CORPORATION", "0.1-beta")
+        device_topics = topic_schema.device(device_descriptor.device_id)
+        devices.append((TemperatureSensor(),
+                        device_descriptor,
+                        connection_pool.device_client(device_descriptor.device_id),
+                        device_topics[sensor_topic]))
+
+    # Publish the retained Device Info of each device
+    for _, device_descriptor, device_client, _ in devices:
+        device_client.publish(topic_schema.device(device_descriptor.device_id)[INFO_CHANNEL], device_descriptor.to_json(), 0, True)
+    info_logger.info("Device Info Published for %s devices", device_count)
+
+    # Publish the temperature of all the devices every sampling interval
+    next_report_time = time.monotonic() + metrics_report_interval_sec
+    for message_id in range(message_limit):
+        sample_start = time.monotonic()
+
+        for temperature_sensor, device_descriptor, device_client, data_topic in devices:
+            temperature_sensor.measure_temperature()
+            payload_string = MessageDescriptor(int(time.time()), "TEMPERATURE_SENSOR", temperature_sensor.temperature_value).to_json()
+            device_client.publish(data_topic, payload_string, telemetry_qos)
+            telemetry_logger.info("Message Sent: %s Topic: %s Payload: %s", message_id, data_topic, payload_string)
+
+        if time.monotonic() >= next_report_time:
+            metrics_logger.info("Connection Pool: %s", connection_pool.metrics())
+            next_report_time += metrics_report_interval_sec
+
+        time.sleep(max(0.0, sampling_interval_sec - (time.monotonic() - sample_start)))
+
+    # Disconnect the connections of the pool
+    connection_pool.disconnect()
@@ -8,19 +8,23 @@ import paho.mqtt.client as mqtt
 import time
 import uuid
 
+from utils.logger import configure_logging, get_logger, CONNECTION, INFO, TELEMETRY
+from utils.metrics import MqttClientMetrics, start_http_server
+from utils.topic_schema import TopicSchema, INFO_CHANNEL
+
 
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
-    # Print the connection result contained in the variable rc
-    print("Connected with result code " + str(rc))
+    # Log the connection result contained in the variable rc
+    connection_logger.info("Connected with result code %s", rc)
 
 
 def publish_device_info():
     # MQTT Paho Publish method with all the available parameters
     # mqtt_client.publish(topic, payload=None, qos=0, retain=False)
 
-    # Build the target topic and the payload string
-    target_topic = "{0}/{1}/info".format(device_base_topic, device_descriptor.device_id)
+    # Precomputed device info topic and the payload string
+    target_topic = device_topics[INFO_CHANNEL]
 
     # Serialize the Device Descriptor to a JSON string
     device_payload_string = device_descriptor.to_json()
@@ -28,8 +32,8 @@ def publish_device_info():
     # Publish the Device Descriptor to the target topic
     mqtt_client.publish(target_topic, device_payload_string, 0, True)
 
-    # Print the Device Info Published
-    print(f"Device Info Published: Topic: {target_topic} Payload: {device_payload_string}")
+    # Log the Device Info Published
+    info_logger.info("Device Info Published: Topic: %s Payload: %s", target_topic, device_payload_string)
 
 
 # Configuration variables
@@ -40,48 +44,74 @@ sensor_topic = "sensor/temperature"
 device_base_topic = "device"
 message_limit = 1000
 
-# Create a new MQTT Client
-mqtt_client = mqtt.Client(client_id)
+# OpenMetrics endpoint of the client metrics (messages, bytes, latencies, errors): http://<host>:<metrics_port>/metrics (None to disable)
+metrics_port = None
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
+
+    # Attach Paho OnMessage Callback Method
+    mqtt_client.on_connect = on_connect
 
-# Attach Paho OnMessage Callback Method
-mqtt_client.on_connect = on_connect
+    # Instrument the client (after setting its callbacks) and expose the metrics on the OpenMetrics endpoint
+    if metrics_port:
+        client_metrics = MqttClientMetrics(client_id)
+        client_metrics.instrument(mqtt_client)
+        start_http_server(metrics_port)
 
-# Connect to the target MQTT Broker
-print("Connecting to " + broker_ip + " port: " + str(broker_port))
-mqtt_client.connect(broker_ip, broker_port)
+    # Connect to the target MQTT Broker
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+    mqtt_client.connect(broker_ip, broker_port)
 
-# Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
-mqtt_client.loop_start()
+    # Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
+    mqtt_client.loop_start()
 
-# Create Demo Temperature Sensor & Device Descriptor
-temperature_sensor = TemperatureSensor()
+    # Create Demo Temperature Sensor & Device Descriptor
+    temperature_sensor = TemperatureSensor()
 
-# Create a Device Descriptor with a random UUID (Universally Unique Identifier - Standardized 128-bit format)
-device_descriptor = DeviceDescriptor(str(uuid.uuid1()), "PYTHON-ACME_CORPORATION", "0.1-beta")
+    # Create a Device Descriptor with a random UUID (Universally Unique Identifier - Standardized 128-bit format)
+    device_descriptor = DeviceDescriptor(str(uuid.uuid1()), "PYTHON-ACME_CORPORATION", "0.1-beta")
 
-# Publish the Device Info with the dedicated method
-publish_device_info()
+    # Build the topics of the device only once with the topic schema
+    device_topics = TopicSchema(device_base_topic, (INFO_CHANNEL, sensor_topic)).device(device_descriptor.device_id)
+    data_topic = device_topics[sensor_topic]
 
-# Publish messages with the temperature value
-for message_id in range(message_limit):
+    # Publish the Device Info with the dedicated method
+    publish_device_info()
 
-    # Measure the temperature
-    temperature_sensor.measure_temperature()
+    # Publish messages with the temperature value
+    for message_id in range(message_limit):
 
-    # Create the payload String in JSON format with the temperature value
-    payload_string = MessageDescriptor(int(time.time()),
-                                       "TEMPERATURE_SENSOR",
-                                       temperature_sensor.temperature_value).to_json()
+        # Measure the temperature
+        temperature_sensor.measure_temperature()
 
-    # Build the target topic
-    data_topic = "{0}/{1}/{2}".format(device_base_topic, device_descriptor.device_id, sensor_topic)
+        # Create the payload String in JSON format with the temperature value
+        payload_string = MessageDescriptor(int(time.time()),
+                                           "TEMPERATURE_SENSOR",
+                                           temperature_sensor.temperature_value).to_json()
 
-    # Publish the message to the target topic
-    mqtt_client.publish(data_topic, payload_string)
+        # Publish the message to the target topic
+        mqtt_client.publish(data_topic, payload_string)
 
-    # Print the message sent
-    print(f"Message Sent: {message_id} Topic: {data_topic} Payload: {payload_string}")
-    time.sleep(1)
+        # Log the message sent
+        telemetry_logger.info("Message Sent: %s Topic: %s Payload: %s", message_id, data_topic, payload_string)
+        time.sleep(1)
 
-# Stop the MQTT Client with the loop_stop method in order to stop the processing of the callbacks
-mqtt_client.loop_stop()
+    # Stop the MQTT Client with the loop_stop method in order to stop the processing of the callbacks
+    mqtt_client.loop_stop()
@@ -3,8 +3,9 @@
 
 import paho.mqtt.client as mqtt
 from dto.message_descriptor import MessageDescriptor
-import json
-import traceback
+from utils.logger import configure_logging, get_logger, CONNECTION, TELEMETRY
+from utils.topic_dispatcher import TopicDispatcher
+from utils.work_dispatcher import WorkDispatcher
 
 # Full MQTT client creation with all the parameters. The only one mandatory in the ClientId that should be unique
 # mqtt_client = Client(client_id="", clean_session=True, userdata=None, protocol=MQTTv311, transport=”tcp”)
@@ -12,37 +13,38 @@ import traceback
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
 
-    # Print the connection result contained in the variable rc
-    print("Connected with result code " + str(rc))
+    # Log the connection result contained in the variable rc
+    connection_logger.info("Connected with result code %s", rc)
 
     # After the connection is established, we subscribe to the default topic
     mqtt_client.subscribe(default_topic)
 
-    # Print the topic we are subscribed to
-    print("Subscribed to: " + default_topic)
+    # Log the topic we are subscribed to
+    connection_logger.info("Subscribed to: %s", default_topic)
 
 
 # Define a callback method to receive asynchronous messages
 def on_message(client, userdata, message):
 
-    # If the message received is in the default topic, we print the message
-    if message.topic == default_topic:
-        try:
-            # Decode the message payload from an array of bytes to a string
-            message_payload = str(message.payload.decode("utf-8"))
+    # The message is queued for the handler pool and routed by the TopicDispatcher to the handler registered for its topic,
+    # so the network thread is never blocked by the handlers
+    work_dispatcher.submit(message)
 
-            # Create a MessageDescriptor object from the JSON payload
-            message_descriptor = MessageDescriptor(**json.loads(message_payload))
 
-            # Print the message received from the broker
-            print(
-                f"Received IoT Message: Topic: {message.topic} Timestamp: {message_descriptor.timestamp} Type: {message_descriptor.value_type} Value: {message_descriptor.value}")
-        except Exception as e:
-            # Print the exception traceback
-            traceback.print_exc()
+def handle_telemetry_message(message):
+    """
+    Handle the telemetry message received on the default topic
+    :param message: Message received from the broker
+    """
+    try:
+        # Create a MessageDescriptor object directly from the JSON payload bytes
+        message_descriptor = MessageDescriptor.from_bytes(message.payload)
 
-            # Print the error message
-            print(f"Error processing message: {e}")
+        # Log the message received from the broker
+        telemetry_logger.info("Received IoT Message: Topic: %s Timestamp: %s Type: %s Value: %s", message.topic, message_descriptor.timestamp, message_descriptor.value_type, message_descriptor.value)
+    except Exception as e:
+        # Log the error message with the exception traceback
+        telemetry_logger.error("Error processing message: %s", e, exc_info=True)
 
 # Configuration variables
 client_id = "clientId0001-Consumer"
@@ -51,18 +53,49 @@ broker_port = 1883
 default_topic = "device/temperature"
 message_limit = 1000
 
-# Create a new MQTT Client
-mqtt_client = mqtt.Client(client_id)
+# Handler execution: the network thread only queues the messages, a pool of "thread" or "process" shards
+# executes the handlers keeping the order of the messages of each device
+dispatch_mode = "thread"
+dispatch_shard_count = 4
+dispatch_queue_size = 1000
+metrics_report_interval_sec = 10
 
-# Attack Paho OnMessage Callback Method
-mqtt_client.on_message = on_message
-mqtt_client.on_connect = on_connect
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
 
-# Connect to the target MQTT Broker
-mqtt_client.connect(broker_ip, broker_port)
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+telemetry_logger = get_logger(TELEMETRY)
 
-# Blocking call that processes network traffic, dispatches callbacks and
-# handles reconnecting.
-# Other loop*() functions are available that give a threaded interface and a
-# manual interface.
-mqtt_client.loop_forever()
+# Register the handler of the default topic into the dispatcher
+topic_dispatcher = TopicDispatcher()
+topic_dispatcher.add_handler(default_topic, handle_telemetry_message)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Start the handler pool with bounded queues (backpressure) and periodic queue depth and latency reports
+    work_dispatcher = WorkDispatcher(topic_dispatcher.dispatch, shard_count=dispatch_shard_count, max_queue_size=dispatch_queue_size,
+                                     mode=dispatch_mode, report_interval=metrics_report_interval_sec)
+    work_dispatcher.start()
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
+
+    # Attack Paho OnMessage Callback Method
+    mqtt_client.on_message = on_message
+    mqtt_client.on_connect = on_connect
+
+    # Connect to the target MQTT Broker
+    mqtt_client.connect(broker_ip, broker_port)
+
+    # Blocking call that processes network traffic, dispatches callbacks and
+    # handles reconnecting.
+    # Other loop*() functions are available that give a threaded interface and a
+    # manual interface.
+    mqtt_client.loop_forever()
@@ -6,9 +6,11 @@ from dto.message_descriptor import MessageDescriptor
 import paho.mqtt.client as mqtt
 import time
 
+from utils.logger import configure_logging, get_logger, CONNECTION, TELEMETRY
+
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
-    print("Connected with result code " + str(rc))
+    connection_logger.info("Connected with result code %s", rc)
 
 # Full MQTT client creation with all the parameters. The only one mandatory in the ClientId that should be unique
 # mqtt_client = Client(client_id="", clean_session=True, userdata=None, protocol=MQTTv311, transport=”tcp”)
@@ -21,44 +23,59 @@ broker_port = 1883
 default_topic = "device/temperature"
 message_limit = 1000
 
-# Create a new MQTT Client
-mqtt_client = mqtt.Client(client_id)
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
 
-# Attach Paho OnMessage Callback Method
-mqtt_client.on_connect = on_connect
+    # Attach Paho OnMessage Callback Method
+    mqtt_client.on_connect = on_connect
 
-# Connect to the target MQTT Broker
-print("Connecting to "+ broker_ip + " port: " + str(broker_port))
-mqtt_client.connect(broker_ip, broker_port)
+    # Connect to the target MQTT Broker
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+    mqtt_client.connect(broker_ip, broker_port)
 
-# Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
-mqtt_client.loop_start()
+    # Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
+    mqtt_client.loop_start()
 
-# Create Demo Temperature Sensor
-temperature_sensor = TemperatureSensor()
+    # Create Demo Temperature Sensor
+    temperature_sensor = TemperatureSensor()
 
-# MQTT Paho Publish method with all the available parameters
-# mqtt_client.publish(topic, payload=None, qos=0, retain=False)
+    # MQTT Paho Publish method with all the available parameters
+    # mqtt_client.publish(topic, payload=None, qos=0, retain=False)
 
-# Publish messages with the temperature value
-for message_id in range(message_limit):
+    # Publish messages with the temperature value
+    for message_id in range(message_limit):
 
-    # Measure the temperature
-    temperature_sensor.measure_temperature()
+        # Measure the temperature
+        temperature_sensor.measure_temperature()
 
-    # Create the payload String in JSON format with the temperature value
-    payload_string = MessageDescriptor(int(time.time()),
-                                       "TEMPERATURE_SENSOR",
-                                       temperature_sensor.temperature_value).to_json()
+        # Create the payload String in JSON format with the temperature value
+        payload_string = MessageDescriptor(int(time.time()),
+                                           "TEMPERATURE_SENSOR",
+                                           temperature_sensor.temperature_value).to_json()
 
-    # Publish the message to the default topic
-    mqtt_client.publish(default_topic, payload_string)
+        # Publish the message to the default topic
+        mqtt_client.publish(default_topic, payload_string)
 
-    # Print the message sent
-    print(f"Message Sent: {message_id} Topic: {default_topic} Payload: {payload_string}")
+        # Log the message sent
+        telemetry_logger.info("Message Sent: %s Topic: %s Payload: %s", message_id, default_topic, payload_string)
 
-    # Wait for 1 second before sending the next message
-    time.sleep(1)
+        # Wait for 1 second before sending the next message
+        time.sleep(1)
 
-# Stop the MQTT Client with the loop_stop method in order to stop the processing of the callbacks
-mqtt_client.loop_stop()
+    # Stop the MQTT Client with the loop_stop method in order to stop the processing of the callbacks
+    mqtt_client.loop_stop()
@@ -4,10 +4,17 @@ from model.switch_actuator import SwitchActuator
 from model.temperature_sensor import TemperatureSensor
 from dto.message_descriptor import MessageDescriptor
 from dto.device_descriptor import DeviceDescriptor
+from dto.payload_codec import get_codec, codec_for_message
+from utils.offline_buffer import OfflineBuffer
+from utils.logger import configure_logging, get_logger, ACTION, CONNECTION, EVENT, INFO, METRICS, TELEMETRY
+from utils.metrics import MqttClientMetrics, REGISTRY, start_http_server
+from utils.mqtt_v5 import Mqtt5Session, create_client
+from utils.telemetry_compression import create_telemetry_filter
+from utils.telemetry_publisher import TelemetryPublisher
+from utils.topic_schema import TopicSchema, INFO_CHANNEL
 import paho.mqtt.client as mqtt
 import time
 import threading
-import json
 
 # Configuration variables
 client_id = "clientId0001-Producer"
@@ -17,33 +24,122 @@ broker_port = 1883
 temperature_telemetry_topic = "telemetry/temperature"
 switch_telemetry_topic = "telemetry/switch"
 event_topic = "event"
-action_topic_subscribe_filter = f'device/{device_id}/action/switch'
+action_topic_subscribe_filter = f'device/{device_id}/action/switch/#'
 device_base_topic = "device"
 message_limit = 1000
 TEMPERATURE_ALERT_LIMIT = 35
 
+# Telemetry pipeline configuration: sampling period, publishing rate and backpressure limits
+sampling_interval_sec = 1.0
+publish_interval_sec = 0.1
+publish_batch_size = 100
+publish_queue_size = 1000
+metrics_report_interval_sec = 10.0
+
+# Report by exception of the temperature telemetry (None to publish every sample): "deadband" publishes a sample when it
+# moves out of the absolute and/or percentage deadband of the last published value, "swinging_door" publishes the vertices
+# of a piecewise linear series within telemetry_swinging_door_deviation of every sample (one sample of delay).
+# A sample is published at least every telemetry_max_silence_sec (heartbeat), the OVER_HEATING events check every sample
+telemetry_compression = None
+telemetry_deadband_absolute = 0.1
+telemetry_deadband_percent = 0.0
+telemetry_swinging_door_deviation = 0.1
+telemetry_max_silence_sec = 60.0
+
+# Temperature of a stable room simulated by the sensor (None for random values between 20.0 and 40.0)
+sensor_room_temperature = None
+
+# Store-and-forward: while the broker is unreachable the telemetry is stored in a disk-backed ring buffer of
+# offline_buffer_size_bytes and replayed at offline_replay_rate messages per second after the reconnection.
+# Overflow policy of a full buffer: "drop_oldest", "drop_newest" or "downsample". The buffer is opt-in: set the path
+# of its file (e.g. f"{device_id}-offline.buf") to enable it
+offline_buffer_path = None
+offline_buffer_size_bytes = 64 * 1024 * 1024
+offline_overflow_policy = "drop_oldest"
+offline_replay_rate = 200
+
+# Payload codec of telemetry and events (json, binary, msgpack, cbor), the device info is always JSON
+payload_codec = get_codec("json")
+
+# MQTT v5 (opt-in): topic aliases shrink the repeated telemetry topics, the broker drops the telemetry and the events
+# not delivered within their expiry interval (0 for no expiry) and the actions are dispatched by subscription identifier
+mqtt_v5 = False
+max_topic_aliases = 100
+telemetry_expiry_sec = 60
+event_expiry_sec = 3600
+
+# OpenMetrics endpoint of the client metrics (messages, bytes, latencies, errors): http://<host>:<metrics_port>/metrics (None to disable)
+metrics_port = None
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+telemetry_logger = get_logger(TELEMETRY)
+event_logger = get_logger(EVENT)
+action_logger = get_logger(ACTION)
+metrics_logger = get_logger(METRICS)
+
+# Topics are built only once for the device by the topic schema instead of for each published message
+# Non JSON codecs are negotiated by the codec suffix appended to the topic (e.g. .../telemetry/temperature/bin)
+topic_schema = TopicSchema(device_base_topic, (INFO_CHANNEL, temperature_telemetry_topic, switch_telemetry_topic, event_topic), codec=payload_codec)
+device_topics = topic_schema.device(device_id)
+device_info_topic = device_topics[INFO_CHANNEL]
+temperature_data_topic = device_topics[temperature_telemetry_topic]
+switch_data_topic = device_topics[switch_telemetry_topic]
+device_event_topic = device_topics[event_topic]
+
 # Initialize the Temperature Sensor, Actuator and Device Descriptor
-temperature_sensor = TemperatureSensor()
+temperature_sensor = TemperatureSensor(sensor_room_temperature)
 switch_actuator = SwitchActuator()
 
 # Create a Device Descriptor with the device id
 device_descriptor = DeviceDescriptor(device_id, "PYTHON-ACME_CORPORATION", "0.1-beta")
 
-# Global Variables for the MQTT Client, Device Thread and Publishing Status
+# Global Variables for the MQTT Client, Device Thread, Telemetry Publisher, Offline Buffer and Publishing Status
 mqtt_client = None
 device_thread = None
+telemetry_publisher = None
+offline_buffer = None
+
+# Report by exception filter of the temperature telemetry (None if every sample is published)
+telemetry_filter = create_telemetry_filter(telemetry_compression,
+                                           absolute_deadband=telemetry_deadband_absolute,
+                                           percent_deadband=telemetry_deadband_percent,
+                                           deviation=telemetry_swinging_door_deviation,
+                                           max_silence_sec=telemetry_max_silence_sec)
+
+# Metrics of the MQTT Client (created by the main script when the metrics endpoint is enabled)
+client_metrics = None
+
+# MQTT v5 features of the client (created by the main script when mqtt_v5 is enabled)
+mqtt_v5_session = None
+
+# Sequence number of the last applied action (older actions are stale or replayed)
+last_action_sequence = None
 
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
     """Callback for when the client receives a CONNACK response from the server."""
     global device_thread
 
-    # Print the connection result contained in the variable rc
-    print("Connected with result code " + str(rc))
+    # Log the connection result contained in the variable rc
+    connection_logger.info("Connected with result code %s", rc)
 
     # Check the connection result
     if rc == 0:
-        print("Connection successful !")
+        connection_logger.info("Connection successful !")
+
+        # After a reconnection the device behaviour is still running (the telemetry of the outage is replayed
+        # by the Telemetry Publisher): only restore the subscription and the device info
+        if device_thread is not None and device_thread.is_alive():
+            subscribe_device_actions()
+            publish_device_info()
+            return
 
         # Start device behaviour in a separate thread
         # This is due to the fact that the on_connect method is called in the main thread
@@ -51,18 +147,34 @@ def on_connect(client, userdata, flags, rc):
         device_thread = threading.Thread(target=device_behaviour)
         device_thread.start()
     else:
-        print(f'Connection failed with result code {str(rc)}')
+        connection_logger.error('Connection failed with result code %s', rc)
+
+# The callback for when the client is disconnected from the broker (loop_forever reconnects automatically)
+def on_disconnect(client, userdata, rc):
+    connection_logger.warning("Disconnected with result code %s, the telemetry is stored until the reconnection", rc)
 
 # Define a callback method to receive asynchronous messages
 def on_message(client, userdata, message):
 
+    # With MQTT v5 the message is dispatched by the identifier of its subscription, without matching the topic
+    if mqtt_v5_session is not None and mqtt_v5_session.dispatch(message):
+        return
+
     # If the message received is in the device info topic
     # We use the MQTT Paho topic_matches_sub method to match the topic with the device info topic
     if mqtt.topic_matches_sub(action_topic_subscribe_filter, message.topic):
         handle_device_action_topic(message)
     # If the message received is in an unmanaged topic
     else:
-        print("Unmanaged Topic !")
+        connection_logger.warning("Unmanaged Topic: %s", message.topic)
+
+def subscribe_device_actions():
+    """ Subscribe to the device actions (with a subscription identifier dispatching to the action handler with MQTT v5) """
+
+    if mqtt_v5_session is not None:
+        mqtt_v5_session.subscribe(action_topic_subscribe_filter, handle_device_action_topic)
+    else:
+        mqtt_client.subscribe(action_topic_subscribe_filter)
 
 def handle_device_action_topic(message):
     """
@@ -70,39 +182,47 @@ def handle_device_action_topic(message):
     :param message:
     :return:
     """
-    global switch_actuator
+    global switch_actuator, last_action_sequence
 
     try:
-        # Decode the message payload from an array of bytes to a string
-        message_payload = str(message.payload.decode("utf-8"))
+        # Negotiate the payload codec from the topic suffix and create an ActionDescriptor object
+        codec, _ = codec_for_message(message)
+        action_descriptor = codec.decode(message.payload, ActionDescriptor)
 
-        # Create a DeviceDescriptor object from the JSON payload
-        action_descriptor = ActionDescriptor(**json.loads(message_payload))
+        # Drop the stale or replayed actions (the actions without sequence are always applied)
+        if action_descriptor.sequence is not None:
+            if last_action_sequence is not None and action_descriptor.sequence <= last_action_sequence:
+                action_logger.info("Stale Action Dropped: %s Value: %s Sequence: %s (Last: %s)", action_descriptor.action_type, action_descriptor.action_value, action_descriptor.sequence, last_action_sequence)
+                return
+            last_action_sequence = action_descriptor.sequence
 
         # Check the action type and action value
         if action_descriptor.action_type == "SWITCH" and action_descriptor.action_value == "ON" and not switch_actuator.switch_status:
             switch_actuator.set_switch_status(True)
-            print(f"Action Received: {action_descriptor.action_type} Value: {action_descriptor.action_value}")
+            action_logger.info("Action Received: %s Value: %s", action_descriptor.action_type, action_descriptor.action_value)
             publish_switch_telemetry()
         elif action_descriptor.action_type == "SWITCH" and action_descriptor.action_value == "OFF" and switch_actuator.switch_status:
             switch_actuator.set_switch_status(False)
-            print(f"Action Received: {action_descriptor.action_type} Value: {action_descriptor.action_value}")
+            action_logger.info("Action Received: %s Value: %s", action_descriptor.action_type, action_descriptor.action_value)
+            publish_switch_telemetry()
+        elif action_descriptor.action_type == "SWITCH" and action_descriptor.action_value in ("ON", "OFF"):
+            # Already applied: report the status again, so the controller state cache converges
+            action_logger.info("Action Already Applied: %s Value: %s", action_descriptor.action_type, action_descriptor.action_value)
             publish_switch_telemetry()
         else:
-            print(f"Unmanaged Action Received: {action_descriptor.action_type} Value: {action_descriptor.action_value}")
+            action_logger.info("Unmanaged Action Received: %s Value: %s", action_descriptor.action_type, action_descriptor.action_value)
     except Exception as e:
 
-        # Print the exception traceback
-        #traceback.print_exc()
-
-        # Print the error message
-        print(f"Error processing message: {e}")
+        # Log the error message (add exc_info=True to log the exception traceback)
+        action_logger.error("Error processing message: %s", e)
+        if client_metrics is not None:
+            client_metrics.parse_error(message.topic)
 
 def device_behaviour():
     """Device Behaviour: Publishes the Device Info and Telemetry Data"""
 
     # Subscribe to the action topic
-    mqtt_client.subscribe(action_topic_subscribe_filter)
+    subscribe_device_actions()
 
     # Publish the device info
     publish_device_info()
@@ -114,13 +234,44 @@ def device_behaviour():
     start_telemetry_publishing()
 
 
+def enqueue_temperature_telemetry(samples):
+    """ Enqueue the (timestamp, value) temperature samples on the Telemetry Publisher """
+
+    for timestamp, value in samples:
+        telemetry_publisher.enqueue(temperature_data_topic, MessageDescriptor(int(timestamp), "TEMPERATURE_SENSOR", value))
+
 def start_telemetry_publishing():
-    """Publishes the temperature sensor data to the broker"""
+    """Samples the temperature sensor and enqueues the data on the Telemetry Publisher"""
+    global telemetry_publisher, offline_buffer
 
     try:
-        print("Starting Telemetry Publishing ...")
-
-        # Publish messages with the temperature value
+        telemetry_logger.info("Starting Telemetry Publishing ...")
+
+        # Open the offline buffer (the backlog of a previous run is replayed first)
+        if offline_buffer_path:
+            offline_buffer = OfflineBuffer(offline_buffer_path, offline_buffer_size_bytes, offline_overflow_policy)
+            telemetry_logger.info("Offline Buffer: %s messages to replay", len(offline_buffer))
+
+        # Start the publisher stage draining the telemetry queue in batches on a dedicated thread
+        telemetry_publisher = TelemetryPublisher(mqtt_client,
+                                                 max_queue_size=publish_queue_size,
+                                                 batch_size=publish_batch_size,
+                                                 publish_interval=publish_interval_sec,
+                                                 codec=payload_codec,
+                                                 offline_buffer=offline_buffer,
+                                                 replay_rate=offline_replay_rate)
+        telemetry_publisher.start()
+
+        # Expose the backpressure metrics of the publisher on the OpenMetrics endpoint
+        if client_metrics is not None:
+            REGISTRY.add_collector("telemetry_publisher", telemetry_publisher.metrics)
+            if telemetry_filter is not None:
+                REGISTRY.add_collector("telemetry_compression", telemetry_filter.metrics)
+
+        next_sample_time = time.monotonic()
+        next_report_time = next_sample_time + metrics_report_interval_sec
+
+        # Sample the temperature value and enqueue the messages without waiting for the publish
         for message_id in range(message_limit):
 
             # Measure the temperature
@@ -129,102 +280,137 @@ def start_telemetry_publishing():
             # Send the message only if the publishing status is True
             if switch_actuator.switch_status:
 
-                # Create the payload String in JSON format with the temperature value
-                payload_string = MessageDescriptor(int(time.time()),
-                                                   "TEMPERATURE_SENSOR",
-                                                   temperature_sensor.temperature_value).to_json()
-
-                # Build the target topic
-                data_topic = "{0}/{1}/{2}".format(device_base_topic, device_descriptor.device_id, temperature_telemetry_topic)
-
-                # Publish the message to the target topic
-                mqtt_client.publish(data_topic, payload_string)
-
-                # Print the message sent
-                print(f"Message Sent: {message_id} Topic: {data_topic} Payload: {payload_string}")
+                # Enqueue the telemetry message, the serialization is done by the publisher thread
+                # With the report by exception only the samples selected by the filter are enqueued
+                if telemetry_filter is None:
+                    enqueue_temperature_telemetry(((time.time(), temperature_sensor.temperature_value),))
+                else:
+                    enqueue_temperature_telemetry(telemetry_filter.offer(time.time(), temperature_sensor.temperature_value))
 
+                # The events are checked on every sample, whatever the telemetry compression
                 # If temperature is above 40 send an OVER_HEATING Event
                 if temperature_sensor.temperature_value > TEMPERATURE_ALERT_LIMIT:
 
-                    print("Temperature is above 40 degrees !")
-
-                    # Create the payload String in JSON format with the temperature value
-                    payload_string = EventDescriptor(int(time.time()),
-                                                       "OVER_HEATING",
-                                                       temperature_sensor.temperature_value).to_json()
-
-                    # Build the target topic
-                    target_event_topic = "{0}/{1}/{2}".format(device_base_topic, device_descriptor.device_id, event_topic)
-
-                    # Publish the message to the target topic
-                    mqtt_client.publish(target_event_topic, payload_string)
-
-                    # Print the message sent
-                    print(f"Event Sent: Topic: {target_event_topic} Payload: {payload_string}")
-
-            # Sleep for 1 second
-            time.sleep(1)
+                    event_logger.info("Temperature is above 40 degrees !")
+
+                    # Create the payload with the configured codec with the temperature value
+                    payload_string = payload_codec.encode(EventDescriptor(int(time.time()),
+                                                                          "OVER_HEATING",
+                                                                          temperature_sensor.temperature_value))
+
+                    # Events are rare and published directly so they are never dropped by the telemetry queue
+                    mqtt_client.publish(device_event_topic, payload_string)
+
+                    # Log the message sent
+                    event_logger.info("Event Sent: Topic: %s Payload: %s", device_event_topic, payload_string)
+
+            elif telemetry_filter is not None:
+                # The telemetry is paused: publish the sample held by the filter, the series restarts on the resume
+                enqueue_temperature_telemetry(telemetry_filter.flush())
+                telemetry_filter.reset()
+
+            # Periodically report the backpressure metrics of the publisher
+            now = time.monotonic()
+            if now >= next_report_time:
+                metrics_logger.info("Telemetry Publisher Metrics: %s", telemetry_publisher.metrics())
+                if telemetry_filter is not None:
+                    metrics_logger.info("Telemetry Compression Metrics: %s", telemetry_filter.metrics())
+                if mqtt_v5_session is not None:
+                    metrics_logger.info("MQTT v5 Session Metrics: %s", mqtt_v5_session.metrics())
+                next_report_time = now + metrics_report_interval_sec
+
+            # Sleep until the next sampling time (fixed rate, not affected by the loop duration)
+            next_sample_time += sampling_interval_sec
+            delay = next_sample_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        # Publish the remaining messages and stop the publisher
+        if telemetry_filter is not None:
+            enqueue_temperature_telemetry(telemetry_filter.flush())
+            metrics_logger.info("Telemetry Compression Metrics: %s", telemetry_filter.metrics())
+        telemetry_publisher.stop(flush=True)
+        metrics_logger.info("Telemetry Publisher Metrics: %s", telemetry_publisher.metrics())
+
+        # The messages not replayed yet stay in the buffer file for the next run
+        if offline_buffer is not None:
+            metrics_logger.info("Offline Buffer Metrics: %s", offline_buffer.metrics())
+            offline_buffer.close()
 
     except Exception as e:
-        print(f"Error starting Telemetry Publishing: {str(e)}")
+        telemetry_logger.error("Error starting Telemetry Publishing: %s", e)
 
 def publish_switch_telemetry():
     """ Publishes the switch telemetry data to the broker """
 
     try:
-        print("Publishing Switch Telemetry ...")
+        telemetry_logger.info("Publishing Switch Telemetry ...")
 
         switch_value = "ON" if switch_actuator.switch_status else "OFF"
 
-        # Create the payload String in JSON format with the switch value
-        payload_string = MessageDescriptor(int(time.time()),
-                                        "SWITCH",
-                                        switch_value).to_json()
-
-        # Build the target topic
-        data_topic = "{0}/{1}/{2}".format(device_base_topic, device_descriptor.device_id, switch_telemetry_topic)
+        # Create the payload with the configured codec with the switch value
+        payload_string = payload_codec.encode(MessageDescriptor(int(time.time()),
+                                                                "SWITCH",
+                                                                switch_value))
 
-        # Publish the message to the target topic
-        mqtt_client.publish(data_topic, payload_string)
+        # Publish the message to the precomputed switch telemetry topic
+        mqtt_client.publish(switch_data_topic, payload_string)
 
-        # Print the message sent
-        print(f"Message Sent Topic: {data_topic} Payload: {payload_string}")
+        # Log the message sent
+        telemetry_logger.info("Message Sent Topic: %s Payload: %s", switch_data_topic, payload_string)
 
     except Exception as e:
-        print(f"Error publishing Switch Telemetry: {str(e)}")
+        telemetry_logger.error("Error publishing Switch Telemetry: %s", e)
 
 def publish_device_info():
     """Publishes the device descriptor to the broker"""
 
     try:
-        print("Publishing Device Info ...")
-
-        # Build the target topic and the payload string
-        target_topic = "{0}/{1}/info".format(device_base_topic, device_descriptor.device_id)
+        info_logger.info("Publishing Device Info ...")
 
         # Serialize the Device Descriptor to a JSON string
         device_payload_string = device_descriptor.to_json()
 
-        # Publish the Device Descriptor to the target topic
-        mqtt_client.publish(target_topic, device_payload_string, 0, True)
+        # Publish the Device Descriptor to the precomputed device info topic
+        mqtt_client.publish(device_info_topic, device_payload_string, 0, True)
 
-        # Print the Device Info Published
-        print(f"Device Info Published: Topic: {target_topic} Payload: {device_payload_string}")
+        # Log the Device Info Published
+        info_logger.info("Device Info Published: Topic: %s Payload: %s", device_info_topic, device_payload_string)
     except Exception as e:
-        print(f"Error publishing Device Info: {str(e)}")
+        info_logger.error("Error publishing Device Info: %s", e)
 
 # Main Script
 if __name__ == "__main__":
 
-    # Create a new MQTT Client
-    mqtt_client = mqtt.Client(client_id)
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create a new MQTT Client (MQTT 3.1.1 or MQTT v5)
+    mqtt_client = create_client(client_id, mqtt_v5)
 
     # Attach Paho OnMessage Callback Method
     mqtt_client.on_connect = on_connect
+    mqtt_client.on_disconnect = on_disconnect
     mqtt_client.on_message = on_message
 
+    # Attach the MQTT v5 features (after setting the callbacks): topic aliases, expiry of the telemetry and of the events
+    if mqtt_v5:
+        mqtt_v5_session = Mqtt5Session(message_expiry=[(topic_schema.subscription(temperature_telemetry_topic, device_id), telemetry_expiry_sec),
+                                                       (topic_schema.subscription(switch_telemetry_topic, device_id), telemetry_expiry_sec),
+                                                       (topic_schema.subscription(event_topic, device_id), event_expiry_sec)],
+                                       max_topic_aliases=max_topic_aliases)
+        mqtt_v5_session.attach(mqtt_client)
+
+    # Instrument the client (after setting its callbacks) and expose the metrics on the OpenMetrics endpoint
+    if metrics_port:
+        client_metrics = MqttClientMetrics(client_id)
+        client_metrics.instrument(mqtt_client)
+        if mqtt_v5_session is not None:
+            REGISTRY.add_collector("mqtt_v5_session", mqtt_v5_session.metrics)
+        start_http_server(metrics_port)
+
     # Connect to the target MQTT Broker
-    print("Connecting to " + broker_ip + " port: " + str(broker_port))
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
     mqtt_client.connect(broker_ip, broker_port)
 
     # Start the MQTT Client with the loop_forever method to process the callbacks in a blocking way
@@ -1,60 +1,175 @@
 # For this example we rely on the Paho MQTT Library for Python
 # You can install it through the following command: pip install paho-mqtt
 
-import paho.mqtt.client as mqtt
-
 from dto.action_descriptor import ActionDescriptor
+from dto.aggregate_descriptor import AggregateDescriptor
 from dto.device_descriptor import DeviceDescriptor
 from dto.event_descriptor import EventDescriptor
 from dto.message_descriptor import MessageDescriptor
-import json
-import threading
+from dto.payload_codec import get_codec, codec_for_message
+from utils.action_scheduler import ActionScheduler
+from utils.device_registry import DeviceRegistry
+from utils.device_state_cache import DeviceStateCache
+from utils.logger import configure_logging, get_logger, ACTION, CONNECTION, EVENT, INFO, TELEMETRY
+from utils.metrics import MqttClientMetrics, REGISTRY, start_http_server
+from utils.mqtt_v5 import Mqtt5Session, create_client
+from utils.rule_engine import RuleEngine
+from utils.telemetry_compression import SeriesReconstructor
+from utils.timeseries_store import TimeSeriesStore
+from utils.topic_dispatcher import TopicDispatcher
+from utils.topic_schema import DEVICE_SCHEMA, ACTION_CHANNEL, AGGREGATE_CHANNEL, TopicSchema, parse_topic
+from utils.window_aggregator import DeviceWindowAggregator
+from utils.work_dispatcher import WorkDispatcher
 
 # Configuration variables
 client_id = "clientId0001-Consumer"
 broker_ip = "127.0.0.1"
 broker_port = 1883
+
+# Monitored devices: a device id, or "+" to monitor all the devices (e.g. for the group rules over several devices).
+# The actions are published on the action topic of the device whose telemetry fired the rule
 target_monitored_device = "device001"
 device_info_topic = f'device/{target_monitored_device}/info'
 device_telemetry_topic = f'device/{target_monitored_device}/telemetry/#'
+device_aggregate_topic = f'device/{target_monitored_device}/telemetry/aggregate'
 device_event_topic = f'device/{target_monitored_device}/event/#'
 device_action_topic = f'device/{target_monitored_device}/action/switch'
 message_limit = 1000
 TEMPERATURE_LIMIT = 37
 
+# Windowed aggregation: the default rule fires on the mean of its sliding window instead of a single raw sample
+# and the statistics of each closed tumbling window are published as downsampled aggregates
+sliding_window_sec = 30
+sliding_window_min_samples = 5
+tumbling_window_sec = 60
+publish_aggregates = True
+
+# Rules of the controller (syntax in utils/rule_engine.py), e.g. one rule for each group of devices:
+#   group lab = device001, device002
+#   lab-overheating: avg(temperature, 30s) > 35 for device in group lab => SWITCH OFF, schedule ON after 10s
+# The rules are read from rules_path when it is set, and the file is reloaded when it changes (checked every
+# rules_reload_interval_sec). The windowed functions (avg, min, max) fire after sliding_window_min_samples samples
+controller_rules = f"overheating: avg(temperature, {sliding_window_sec}s) > {TEMPERATURE_LIMIT} => SWITCH OFF, schedule ON after 10s"
+rules_path = None
+rules_reload_interval_sec = 5
+rule_value_type_aliases = {"temperature": "TEMPERATURE_SENSOR"}
+
+# Reconstruction of the compressed telemetry (report by exception of the smart objects): the samples between two received
+# samples are interpolated at telemetry_sampling_interval_sec ("linear" for the swinging door compression, "step" for
+# the deadband compression) before the windowed aggregation, so the windows see the sampled series and not only the
+# reported samples. Gaps longer than telemetry_reconstruction_max_gap_sec are not filled (None to disable)
+telemetry_reconstruction = None
+telemetry_sampling_interval_sec = 1.0
+telemetry_reconstruction_max_gap_sec = 300
+
+# Action deduplication: an action is published only when the desired switch status differs from the status reported
+# by the device telemetry, and an action not applied by the device is sent again after action_resend_interval_sec
+action_resend_interval_sec = 5.0
+
+# Device registry: descriptors of the retained info messages, evicted after device_ttl_sec without messages and
+# saved to the snapshot file every registry_maintenance_interval_sec to warm up a restart (opt-in, e.g. "controller_device_registry.json")
+device_ttl_sec = 3600
+device_registry_snapshot_path = None
+registry_maintenance_interval_sec = 60
+
+# Time-series storage sink: the numeric telemetry is appended to per device columnar segments
+# and written every timeseries_flush_interval_sec (opt-in, e.g. "controller_timeseries")
+timeseries_store_path = None
+timeseries_flush_interval_sec = 1.0
+
+# Handler execution: the network thread only queues the messages, a pool of thread shards executes the handlers
+# keeping the order of the messages of each device (the handlers share the windows, the scheduler and the MQTT client,
+# so the controller uses the "thread" mode)
+dispatch_shard_count = 4
+dispatch_queue_size = 1000
+metrics_report_interval_sec = 10
+
+# MQTT v5 (opt-in): topic aliases shrink the repeated aggregate topics, the broker drops the actions and the aggregates
+# not delivered within their expiry interval (0 for no expiry) and the received messages are dispatched by subscription
+# identifier (the telemetry subscription uses No Local, so the aggregates published by the controller are not received)
+mqtt_v5 = False
+max_topic_aliases = 100
+action_expiry_sec = 10
+aggregate_expiry_sec = 600
+
+# OpenMetrics endpoint of the client metrics (messages, bytes, latencies, errors): http://<host>:<metrics_port>/metrics (None to disable)
+metrics_port = None
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+telemetry_logger = get_logger(TELEMETRY)
+event_logger = get_logger(EVENT)
+action_logger = get_logger(ACTION)
+
+# Registry of the known devices (per device lookups without the broker)
+device_registry = DeviceRegistry(ttl_sec=device_ttl_sec, snapshot_path=device_registry_snapshot_path)
+
+# Time-series storage sink (created by the main script)
+timeseries_store = None
+
+# Metrics of the MQTT Client (created by the main script when the metrics endpoint is enabled)
+client_metrics = None
+
+# MQTT v5 features of the client (created by the main script when mqtt_v5 is enabled)
+mqtt_v5_session = None
+
+# Payload codec of the published actions (telemetry and events codecs are negotiated for each message)
+action_payload_codec = get_codec("json")
+
+# Action topics of the devices with the codec suffix, built once for each device (non JSON codecs append their suffix)
+action_topic_schema = TopicSchema(channels=(ACTION_CHANNEL,), codec=action_payload_codec)
+
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
 
-    # Print the connection result contained in the variable rc
-    print("Connected with result code " + str(rc))
+    # Log the connection result contained in the variable rc
+    connection_logger.info("Connected with result code %s", rc)
 
     # After the connection is established, subscribe to the device info and data topics
-    mqtt_client.subscribe(device_info_topic)
-    mqtt_client.subscribe(device_telemetry_topic)
-    mqtt_client.subscribe(device_event_topic)
+    if mqtt_v5_session is not None:
+        # Each subscription identifier is dispatched to its handler by the handler pool
+        mqtt_v5_session.subscribe(device_info_topic, handle_device_info_message)
+        mqtt_v5_session.subscribe(device_telemetry_topic, handle_device_telemetry_message, no_local=True)
+        mqtt_v5_session.subscribe(device_event_topic, handle_event_message)
+    else:
+        mqtt_client.subscribe(device_info_topic)
+        mqtt_client.subscribe(device_telemetry_topic)
+        mqtt_client.subscribe(device_event_topic)
 
-    # Print the topics we are subscribed to
-    print("Subscribed to: " + device_info_topic)
-    print("Subscribed to: " + device_telemetry_topic)
-    print("Subscribed to: " + device_event_topic)
+    # Log the topics we are subscribed to
+    connection_logger.info("Subscribed to: %s", device_info_topic)
+    connection_logger.info("Subscribed to: %s", device_telemetry_topic)
+    connection_logger.info("Subscribed to: %s", device_event_topic)
 
 
 # Define a callback method to receive asynchronous messages
 def on_message(client, userdata, message):
 
-    # If the message received is in the device info topic
-    # We use the MQTT Paho topic_matches_sub method to match the topic with the device info topic
-    if mqtt.topic_matches_sub(device_info_topic, message.topic):
-        handle_device_info_message(message)
-    # If the message received is in the data topic
-    # We use the MQTT Paho topic_matches_sub method to match the topic with the device info topic
-    elif mqtt.topic_matches_sub(device_telemetry_topic, message.topic):
-        handle_device_telemetry_message(message)
-    elif mqtt.topic_matches_sub(device_event_topic, message.topic):
-        handle_event_message(message)
-    # If the message received is in an unmanaged topic
-    else:
-        print("Unmanaged Topic !")
+    # The message is queued in the shard of its device and routed by the TopicDispatcher (single walk of the compiled
+    # topic filters) on the handler pool, so the network thread is never blocked by the handlers
+    work_dispatcher.submit(message)
+
+def dispatch_message(message):
+    """
+    Handler of the WorkDispatcher: route a message by its MQTT v5 subscription identifier, or by its topic
+    :param message: Message received from the broker
+    """
+
+    if mqtt_v5_session is None or not mqtt_v5_session.dispatch(message):
+        topic_dispatcher.dispatch(message)
+
+def handle_unmanaged_message(message):
+    """
+    Handle a message received on an unmanaged topic
+    :param message: Message received from the broker
+    """
+    connection_logger.warning("Unmanaged Topic: %s", message.topic)
 
 def handle_event_message(message):
     """
@@ -63,17 +178,17 @@ def handle_event_message(message):
     """
 
     try:
-        # Decode the message payload from an array of bytes to a string
-        message_payload = str(message.payload.decode("utf-8"))
+        # Negotiate the payload codec from the topic suffix and create an EventDescriptor object
+        codec, _ = codec_for_message(message)
+        event_descriptor = codec.decode(message.payload, EventDescriptor)
 
-        # Create a DeviceDescriptor object from the JSON payload
-        event_descriptor = EventDescriptor(**json.loads(message_payload))
-
-        # Print the message received from the broker
-        print(f"Received Event: Topic: {message.topic} Type: {event_descriptor.event_type} Value: {event_descriptor.event_value}")
+        # Log the message received from the broker
+        event_logger.info("Received Event: Topic: %s Type: %s Value: %s", message.topic, event_descriptor.event_type, event_descriptor.event_value)
     except Exception as e:
-        # Print the error message
-        print(f"Error processing message: {e}")
+        # Log the error message
+        event_logger.error("Error processing message: %s", e)
+        if client_metrics is not None:
+            client_metrics.parse_error(message.topic)
 
 def handle_device_info_message(message):
     """
@@ -82,17 +197,25 @@ def handle_device_info_message(message):
     """
 
     try:
-        # Decode the message payload from an array of bytes to a string
-        message_payload = str(message.payload.decode("utf-8"))
+        # An empty retained message clears the info of a removed device (device/<device_id>/info)
+        if not message.payload:
+            device_registry.remove(parse_topic(message.topic)[0])
+            info_logger.info("Device Removed: Topic: %s", message.topic)
+            return
+
+        # Create a DeviceDescriptor object directly from the JSON payload bytes
+        device_descriptor = DeviceDescriptor.from_bytes(message.payload)
 
-        # Create a DeviceDescriptor object from the JSON payload
-        device_descriptor = DeviceDescriptor(**json.loads(message_payload))
+        # Log the message received from the broker
+        info_logger.info("Received IoT Message (Retained:%s): Topic: %s DeviceId: %s Manufacturer: %s SoftwareVersion: %s", message.retain, message.topic, device_descriptor.device_id, device_descriptor.producer, device_descriptor.software_version)
 
-        # Print the message received from the broker
-        print(f"Received IoT Message (Retained:{message.retain}): Topic: {message.topic} DeviceId: {device_descriptor.device_id} Manufacturer: {device_descriptor.producer} SoftwareVersion: {device_descriptor.software_version}")
+        # Keep the descriptor in the registry for the per device lookups
+        device_registry.update(device_descriptor)
     except Exception as e:
-        # Print the error message
-        print(f"Error processing message: {e}")
+        # Log the error message
+        info_logger.error("Error processing message: %s", e)
+        if client_metrics is not None:
+            client_metrics.parse_error(message.topic)
 
 
 def handle_device_telemetry_message(message):
@@ -101,74 +224,233 @@ def handle_device_telemetry_message(message):
     :param message: Message received from the broker
     """
     try:
-        # Decode the message payload from an array of bytes to a string
-        message_payload = str(message.payload.decode("utf-8"))
+        # Negotiate the payload codec from the topic suffix and create a MessageDescriptor object
+        codec, _ = codec_for_message(message)
+        message_descriptor = codec.decode(message.payload, MessageDescriptor)
+
+        # Log the message received from the broker
+        telemetry_logger.info("Received IoT Message: Topic: %s Timestamp: %s Type: %s Value: %s", message.topic, message_descriptor.timestamp, message_descriptor.value_type, message_descriptor.value)
+
+        # Update the last seen time of the device (device/<device_id>/telemetry/...)
+        device_id = parse_topic(message.topic)[0]
+        device_registry.touch(device_id)
+
+        # Append the numeric values to the storage sink
+        if timeseries_store is not None:
+            timeseries_store.append_descriptor(device_id, message_descriptor)
+
+        # Record the switch status reported by the device (device/<device_id>/telemetry/switch)
+        if message_descriptor.value_type == "SWITCH":
+            device_state_cache.report(device_id, "SWITCH", message_descriptor.value)
+
+            # The device pauses its telemetry while it is OFF: the pause is not interpolated (the sample held by the filter
+            # of the device is published after the OFF report, it ends the paused series)
+            if series_reconstructor is not None and message_descriptor.value == "OFF":
+                series_reconstructor.reset((device_id, "TEMPERATURE_SENSOR"), message_descriptor.timestamp)
 
-        # Create a MessageDescriptor object from the JSON payload
-        message_descriptor = MessageDescriptor(**json.loads(message_payload))
+        # Only the numeric telemetry is aggregated (e.g. the switch status is a string)
+        if not isinstance(message_descriptor.value, (int, float)):
+            return
 
-        # Print the message received from the broker
-        print(f"Received IoT Message: Topic: {message.topic} Timestamp: {message_descriptor.timestamp} Type: {message_descriptor.value_type} Value: {message_descriptor.value}")
+        # Rebuild the samples dropped by the report by exception of the device (the received sample is the last one)
+        if series_reconstructor is None:
+            samples = ((message_descriptor.timestamp, message_descriptor.value),)
+        else:
+            samples = series_reconstructor.add((device_id, message_descriptor.value_type), message_descriptor.timestamp, message_descriptor.value)
 
-        # Check if the telemetry value is above the temperature limit
-        if message_descriptor.value_type == "TEMPERATURE_SENSOR" and message_descriptor.value > TEMPERATURE_LIMIT:
+        for timestamp, value in samples:
 
-            # Trigger a switch action to turn off the device
-            trigger_switch_action("SWITCH", "OFF")
+            # Update the tumbling windows of the device
+            _, closed_window = window_aggregator.add(device_id, message_descriptor.value_type, timestamp, value)
 
-            # Schedule a switch action to turn on the device after 10 seconds
-            schedule_device_action(10, "SWITCH", "ON")
+            # Publish the downsampled statistics of the closed tumbling window
+            if closed_window is not None and publish_aggregates:
+                publish_aggregate(device_id, AggregateDescriptor.from_window_statistics(message_descriptor.value_type, closed_window))
+
+            # Report the compression ratio of the device telemetry with the closed window
+            if closed_window is not None and series_reconstructor is not None:
+                info_logger.info("Telemetry Compression: Device: %s Type: %s Ratio: %.1f", device_id, message_descriptor.value_type,
+                                 series_reconstructor.compression_ratio((device_id, message_descriptor.value_type)))
+
+        # Evaluate the rules applying to the value type, the topic and the device on its sliding windows
+        # A sustained overheating publishes a single action: the action is published only if the device does not
+        # report its value yet and no action with the same value is in flight
+        for rule, measured_value in rule_engine.evaluate(device_id, message.topic, message_descriptor.value_type, samples):
+            if not request_switch_action(device_id, rule.action_type, rule.action_value):
+                continue
+
+            action_logger.info("Rule Fired: %s Device: %s Value: %.2f Rule: %s", rule.name, device_id, measured_value, rule.source)
+
+            # Schedule the action of the rule (e.g. turn on the device after 10 seconds)
+            # The device id is used to coalesce the pending actions
+            if rule.schedule_value is not None:
+                schedule_device_action(rule.schedule_delay_sec, rule.schedule_type, rule.schedule_value, device_id)
 
     except Exception as e:
-        # Print the error message
-        print(f"Error processing message: {e}")
+        # Log the error message
+        telemetry_logger.error("Error processing message: %s", e)
+        if client_metrics is not None:
+            client_metrics.parse_error(message.topic)
 
 
-def trigger_switch_action(switch_action, switch_value):
+def handle_aggregate_message(message):
+    """
+    Handle the aggregate messages published by the controller itself on the telemetry topic tree
+    They are ignored to avoid aggregating the aggregates
+    :param message: Message received from the broker
+    """
+    pass
+
+
+def publish_aggregate(device_id, aggregate_descriptor):
+    """
+    Publish the downsampled statistics of a telemetry window on device/<device_id>/telemetry/aggregate
+    :param device_id: Device of the aggregated telemetry
+    :param aggregate_descriptor: AggregateDescriptor to publish
+    """
+    try:
+        aggregate_payload = aggregate_descriptor.to_json()
+        mqtt_client.publish(DEVICE_SCHEMA.device(device_id)[AGGREGATE_CHANNEL], aggregate_payload, qos=0, retain=False)
+        telemetry_logger.info("Aggregate Published: %s", aggregate_payload)
+    except Exception as e:
+        # Log the error message
+        telemetry_logger.error("Error processing message: %s", e)
+
+
+def request_switch_action(device_id, switch_action, switch_value):
+    """
+    Request a switch status for a device, the action is published only if the desired status differs from the reported one
+    :param device_id: Target device
+    :param switch_action: Action to trigger
+    :param switch_value: Value of the action
+    :return: True if the action has been published
+    """
+    sequence = device_state_cache.request(device_id, switch_action, switch_value)
+    if sequence is None:
+        return False
+    trigger_switch_action(device_id, switch_action, switch_value, sequence)
+    return True
+
+
+def trigger_switch_action(device_id, switch_action, switch_value, sequence=None):
     """
     Publish a switch action to the broker for a target device
+    :param device_id: Target device
     :param switch_action: Action to trigger
     :param switch_value: Value of the action
+    :param sequence: Sequence number used by the device to drop the stale or replayed actions
     :return:
     """
     try:
         # Create an ActionDescriptor object
-        action_descriptor = ActionDescriptor(action_type=switch_action, action_value=switch_value)
+        action_descriptor = ActionDescriptor(action_type=switch_action, action_value=switch_value, sequence=sequence)
 
-        # Convert the ActionDescriptor object to a JSON string
-        action_descriptor_json = json.dumps(action_descriptor.__dict__)
+        # Serialize the ActionDescriptor object with the configured codec
+        action_payload = action_payload_codec.encode(action_descriptor)
 
-        # Publish the action to the broker
-        mqtt_client.publish(device_action_topic, action_descriptor_json, qos=1, retain=False)
+        # Publish the action to the broker on the precomputed action topic of the device
+        action_topic = action_topic_schema.device(device_id)[ACTION_CHANNEL]
+        mqtt_client.publish(action_topic, action_payload, qos=1, retain=False)
 
-        print(f"Action Published: {action_descriptor_json}")
+        action_logger.info("Action Published: Topic: %s Payload: %s", action_topic, action_payload)
     except Exception as e:
-        # Print the error message
-        print(f"Error processing message: {e}")
+        # Log the error message
+        action_logger.error("Error processing message: %s", e)
 
 
-def schedule_device_action(delay_sec, switch_action, switch_value):
+def schedule_device_action(delay_sec, switch_action, switch_value, device_id):
     """
     Schedule a device action to be triggered
+    A newer scheduled action for the same device replaces the pending one
     :param delay_sec: Seconds to wait before triggering the action
     :param switch_action: Action to trigger
     :param switch_value: Value of the action
+    :param device_id: Target device, also the coalescing key of the pending actions
     :return:
     """
-    print(f"Scheduling Action: {switch_action} Value: {switch_value} in {delay_sec} seconds")
-    timer = threading.Timer(delay_sec, trigger_switch_action, args=[switch_action, switch_value])
-    timer.start()
+    action_logger.info("Scheduling Action: %s Value: %s in %s seconds (Pending Actions: %s)", switch_action, switch_value, delay_sec, action_scheduler.pending_count())
+    action_scheduler.schedule(delay_sec, request_switch_action, device_id, switch_action, switch_value, key=device_id)
+
+# Single thread scheduler for the delayed actions (replacing one threading.Timer for each action)
+action_scheduler = ActionScheduler()
+
+# Per device desired and reported switch status (deduplication and sequence numbers of the actions)
+device_state_cache = DeviceStateCache(resend_interval_sec=action_resend_interval_sec)
+
+# Per device tumbling windows of the received telemetry (the sliding windows of the rules are kept by the rule engine)
+window_aggregator = DeviceWindowAggregator(sliding_window_sec=None, tumbling_window_sec=tumbling_window_sec)
+
+# Rules of the controller compiled and indexed by value type and topic, with their own per device sliding windows
+# (the rules file is loaded by the main script)
+rule_engine = RuleEngine(controller_rules if not rules_path else "", rule_value_type_aliases, min_samples=sliding_window_min_samples)
+
+# Per device reconstruction of the compressed telemetry (None if the received samples are aggregated as they are)
+series_reconstructor = SeriesReconstructor(telemetry_sampling_interval_sec, telemetry_reconstruction,
+                                           telemetry_reconstruction_max_gap_sec) if telemetry_reconstruction else None
+
+# Compile the managed topic filters into the dispatcher (registration order is the matching priority)
+topic_dispatcher = TopicDispatcher(default_handler=handle_unmanaged_message)
+topic_dispatcher.add_handler(device_info_topic, handle_device_info_message)
+# The aggregate topic is registered before the telemetry filter that also matches it (first match wins)
+topic_dispatcher.add_handler(device_aggregate_topic, handle_aggregate_message)
+topic_dispatcher.add_handler(device_telemetry_topic, handle_device_telemetry_message)
+topic_dispatcher.add_handler(device_event_topic, handle_event_message)
 
 # Main Script
 if __name__ == "__main__":
 
-    # Create a new MQTT Client
-    mqtt_client = mqtt.Client(client_id)
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Warm up the device registry from the last snapshot and start its eviction and snapshot thread
+    loaded_count = device_registry.load_snapshot()
+    info_logger.info("Device Registry: %s devices loaded from %s", loaded_count, device_registry_snapshot_path)
+    device_registry.start(registry_maintenance_interval_sec)
+
+    # Open the time-series storage sink and start its flush thread
+    if timeseries_store_path:
+        timeseries_store = TimeSeriesStore(timeseries_store_path)
+        timeseries_store.start(timeseries_flush_interval_sec)
+
+    # Create a new MQTT Client (MQTT 3.1.1 or MQTT v5)
+    mqtt_client = create_client(client_id, mqtt_v5)
 
     # Attack Paho OnMessage Callback Method
     mqtt_client.on_message = on_message
     mqtt_client.on_connect = on_connect
 
+    # Attach the MQTT v5 features (after setting the callbacks): topic aliases, expiry of the actions and of the aggregates
+    if mqtt_v5:
+        mqtt_v5_session = Mqtt5Session(message_expiry=[(f"{device_action_topic}/#", action_expiry_sec),
+                                                       (DEVICE_SCHEMA.subscription(AGGREGATE_CHANNEL), aggregate_expiry_sec)],
+                                       max_topic_aliases=max_topic_aliases)
+        mqtt_v5_session.attach(mqtt_client)
+
+    # Load the rules file and start its reload thread
+    if rules_path:
+        rule_engine.start(rules_path, rules_reload_interval_sec)
+    action_logger.info("Rule Engine: %s rules loaded", len(rule_engine.rules()))
+
+    # Start the scheduler thread of the delayed actions
+    action_scheduler.start()
+
+    # Start the handler pool with bounded queues (backpressure) and periodic queue depth and latency reports
+    work_dispatcher = WorkDispatcher(dispatch_message, shard_count=dispatch_shard_count, max_queue_size=dispatch_queue_size,
+                                     mode="thread", report_interval=metrics_report_interval_sec)
+    work_dispatcher.start()
+
+    # Instrument the client (after setting its callbacks) and expose the metrics on the OpenMetrics endpoint
+    if metrics_port:
+        client_metrics = MqttClientMetrics(client_id)
+        client_metrics.instrument(mqtt_client)
+        REGISTRY.add_collector("work_dispatcher", work_dispatcher.metrics)
+        if mqtt_v5_session is not None:
+            REGISTRY.add_collector("mqtt_v5_session", mqtt_v5_session.metrics)
+        if series_reconstructor is not None:
+            REGISTRY.add_collector("telemetry_reconstruction", series_reconstructor.metrics)
+        REGISTRY.add_collector("rule_engine", rule_engine.metrics)
+        start_http_server(metrics_port)
+
     # Connect to the target MQTT Broker
     mqtt_client.connect(broker_ip, broker_port)
 
@@ -176,4 +458,15 @@ if __name__ == "__main__":
     # handles reconnecting.
     # Other loop*() functions are available that give a threaded interface and a
     # manual interface.
-    mqtt_client.loop_forever()
+    try:
+        mqtt_client.loop_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Execute the queued messages, then write the buffered records and save a last snapshot of the registry
+        mqtt_client.disconnect()
+        action_scheduler.stop()
+        work_dispatcher.stop()
+        if timeseries_store is not None:
+            timeseries_store.stop()
+        device_registry.stop()
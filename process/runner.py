@@ -0,0 +1,310 @@
+# Config driven runner of the producer, consumer and controller scripts.
+# A TOML file (or a YAML file, requires: pip install pyyaml) describes many instances of the scripts, each one with
+# its own values of the configuration variables of the script (broker, client id, credentials, topics, limits, ...).
+# The configuration variables of a script are the names assigned in its declared block, between the
+# "# Configuration variables" and "# End of the configuration variables" comment lines.
+# Each instance runs in its own process, the "asyncio" instances run their async main() on the shared event loop of the runner.
+# The scripts are imported lazily by the processes running them, so the startup of the runner stays fast.
+# Run from the project root with: python -m process.runner process/runner_example.toml
+# List the configuration variables of a script with: python -m process.runner --variables device_consumer
+
+import argparse
+import ast
+import asyncio
+import importlib.util
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import types
+from collections import namedtuple
+
+from utils import logger as logger_module
+from utils.logger import configure_logging, get_logger, CONNECTION
+
+# Package of the runnable scripts
+scripts_package = "process"
+
+# Comment lines delimiting the configuration block of a script
+configuration_start_line = "# Configuration variables"
+configuration_end_line = "# End of the configuration variables"
+
+# Seconds granted to the instance processes to exit after the interruption of the runner
+stop_timeout_sec = 5.0
+
+# Loggers of the runner categories
+connection_logger = get_logger(CONNECTION)
+
+
+class InstanceSpec(namedtuple("InstanceSpec", ("name", "script", "mode", "variables"))):
+    """ Instance of a script described by the runner configuration:
+    :param name: Unique name of the instance (prefix of its log records)
+    :param script: Module name of the script in the process package (e.g. "device_consumer")
+    :param mode: "process" (own process, any script) or "asyncio" (async main() on the shared event loop)
+    :param variables: Values of the configuration variables of the script
+    """
+
+    __slots__ = ()
+
+
+def load_config(path):
+    """ Load a TOML or YAML runner configuration file as a dictionary """
+
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAML configuration files require PyYAML: pip install pyyaml")
+        with open(path) as config_file:
+            return yaml.safe_load(config_file) or {}
+
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    with open(path, "rb") as config_file:
+        return tomllib.load(config_file)
+
+
+def script_path(script):
+    """ Source file of a script of the process package """
+
+    spec = importlib.util.find_spec(f"{scripts_package}.{script}")
+    if spec is None or spec.origin is None:
+        raise ValueError(f"Unknown script: {script}")
+    return spec.origin
+
+
+def _parse_script(script):
+    """ Syntax tree of a script with the (first, last) line numbers of its configuration block """
+
+    path = script_path(script)
+    with open(path) as script_file:
+        source = script_file.read()
+
+    lines = source.splitlines()
+    if configuration_start_line not in lines or configuration_end_line not in lines:
+        raise ValueError(f"{script} declares no configuration block ({configuration_start_line!r} ... {configuration_end_line!r})")
+    block = (lines.index(configuration_start_line) + 1, lines.index(configuration_end_line) + 1)
+    return path, ast.parse(source, path), block
+
+
+class _SourceDefault(str):
+    """ Default value computed from other variables (an f-string, e.g. a path built from the device id), shown as its source """
+
+    def __repr__(self):
+        return str(self)
+
+
+def _configuration_assignments(tree, block):
+    """ Assignments of a literal value or of an f-string to a single name in the configuration block of the script """
+
+    first_line, last_line = block
+    for node in tree.body:
+        if not first_line < node.lineno < last_line:
+            continue
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                yield node, node.targets[0].id, ast.literal_eval(node.value)
+            except ValueError:
+                if isinstance(node.value, ast.JoinedStr):
+                    yield node, node.targets[0].id, _SourceDefault(ast.unparse(node.value))
+
+
+def configuration_variables(script):
+    """ Configuration variables of a script with their default values (read from the source, the script is not imported) """
+
+    _, tree, block = _parse_script(script)
+    return {name: value for _, name, value in _configuration_assignments(tree, block)}
+
+
+def compile_script(script, variables):
+    """
+    Compile a script replacing the default values of its configuration variables. The values are replaced in the
+    assignments of the source, so the globals derived from them (e.g. the topics built from the device id) are consistent
+    :param script: Module name of the script in the process package
+    :param variables: Configuration variable -> value
+    :return: Code object of the script
+    """
+
+    path, tree, block = _parse_script(script)
+    assignments = {name: node for node, name, _ in _configuration_assignments(tree, block)}
+
+    unknown_variables = sorted(set(variables) - set(assignments))
+    if unknown_variables:
+        raise ValueError(f"Unknown configuration variables of {script}: {unknown_variables} (available: {sorted(assignments)})")
+
+    for name, value in variables.items():
+        node = assignments[name]
+        node.value = ast.copy_location(ast.parse(repr(value), mode="eval").body, node.value)
+    ast.fix_missing_locations(tree)
+
+    return compile(tree, path, "exec")
+
+
+def _expand_environment(value):
+    """ Expand the $VARIABLE / ${VARIABLE} references of the string values (e.g. the passwords) """
+
+    if isinstance(value, str):
+        return os.path.expandvars(value)
+    if isinstance(value, list):
+        return [_expand_environment(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _expand_environment(item) for key, item in value.items()}
+    return value
+
+
+def _replica_value(value, replica):
+    if isinstance(value, str):
+        return value.replace("{replica}", str(replica))
+    return value
+
+
+def instance_specs(config):
+    """
+    Build the instances of a runner configuration:
+    - [defaults]: values applied to every instance whose script has the variable (e.g. broker_ip)
+    - [[instance]]: name, script, optional mode ("process" or "asyncio"), optional replicas (the "{replica}" placeholder
+      of the string values is replaced by the replica index), optional enabled flag and the [instance.config] variables
+    """
+
+    defaults = config.get("defaults", {})
+    specs = []
+    for instance in config.get("instance", []):
+        if not instance.get("enabled", True):
+            continue
+
+        script = instance["script"]
+        name = instance.get("name", script)
+        mode = instance.get("mode", "process")
+        if mode not in ("process", "asyncio"):
+            raise ValueError(f"Unsupported mode of {name}: {mode}")
+
+        script_variables = configuration_variables(script)
+        variables = {key: value for key, value in defaults.items() if key in script_variables}
+        variables.update(instance.get("config", {}))
+        variables = _expand_environment(variables)
+
+        replicas = instance.get("replicas", 1)
+        for replica in range(replicas):
+            replica_name = name if replicas == 1 else f"{name}-{replica}"
+            specs.append(InstanceSpec(replica_name, script, mode,
+                                      {key: _replica_value(value, replica) for key, value in variables.items()}))
+
+    names = [spec.name for spec in specs]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Duplicated instance names: {sorted(name for name in set(names) if names.count(name) > 1)}")
+    return specs
+
+
+def load_instance(spec, run_name):
+    """
+    Execute the script of an instance in a new module (each instance has its own globals)
+    :param run_name: "__main__" to run the main script block, the module name to only define the globals and functions
+    """
+
+    module = types.ModuleType(run_name)
+    module.__file__ = script_path(spec.script)
+    exec(compile_script(spec.script, spec.variables), module.__dict__)
+    return module
+
+
+def run_process_instance(spec):
+    """ Entry point of the process of an instance: run the script as the main script """
+
+    # The records of the instance are prefixed by its name
+    logger_module.default_log_format = f"[{spec.name}] %(message)s"
+
+    # The instance leaves the process group of the terminal: the runner forwards a single interruption to it
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+
+    # The instance processes exit without running the atexit handlers: the scripts release their resources (e.g. the
+    # last flush of the time-series store) at the end of their main block
+    try:
+        load_instance(spec, "__main__")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger_module.shutdown_logging()
+
+
+async def run_asyncio_instances(specs):
+    """ Run the async main() of the instances on the current event loop """
+
+    coroutines = []
+    for spec in specs:
+        module = load_instance(spec, f"{scripts_package}.{spec.script}[{spec.name}]")
+        main_function = getattr(module, "main", None)
+        if main_function is None or not asyncio.iscoroutinefunction(main_function):
+            raise ValueError(f"{spec.script} has no async main(), run {spec.name} in process mode")
+        coroutines.append(main_function())
+
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for spec, result in zip(specs, results):
+        if isinstance(result, Exception):
+            connection_logger.error("Instance %s failed: %s", spec.name, result)
+
+
+def run(specs):
+    """ Run the instances until they exit or until the runner is interrupted """
+
+    processes = []
+    for spec in specs:
+        if spec.mode == "process":
+            process = multiprocessing.Process(target=run_process_instance, args=(spec,), name=spec.name)
+            process.start()
+            processes.append(process)
+            connection_logger.info("Instance %s started: %s (pid %s)", spec.name, spec.script, process.pid)
+
+    asyncio_specs = [spec for spec in specs if spec.mode == "asyncio"]
+    try:
+        if asyncio_specs:
+            connection_logger.info("Running %s asyncio instances on the shared event loop", len(asyncio_specs))
+            asyncio.run(run_asyncio_instances(asyncio_specs))
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Forward the interruption to the instance processes (in their own process group, so they receive it only once),
+        # wait for their exit, then terminate them
+        connection_logger.info("Stopping the instances ...")
+        if hasattr(os, "setpgrp"):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGINT)
+        deadline = time.monotonic() + stop_timeout_sec
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    for process in processes:
+        connection_logger.info("Instance %s exited with code %s", process.name, process.exitcode)
+
+
+# Main Script
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the instances of the scripts described by a TOML/YAML configuration file")
+    parser.add_argument("config", nargs="?", help="Runner configuration file")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="Run only the instances with these names")
+    parser.add_argument("--variables", metavar="SCRIPT", help="List the configuration variables of a script and exit")
+    arguments = parser.parse_args()
+
+    configure_logging()
+
+    if arguments.variables:
+        for variable_name, default_value in configuration_variables(arguments.variables).items():
+            print(f"{variable_name} = {default_value!r}")
+        sys.exit(0)
+
+    if not arguments.config:
+        parser.error("the configuration file is required")
+
+    instances = instance_specs(load_config(arguments.config))
+    if arguments.only:
+        instances = [instance for instance in instances if instance.name in arguments.only]
+
+    run(instances)
@@ -0,0 +1,317 @@
+# Horizontally scaled device consumer: N worker processes partition the devices with consistent hashing. Each worker
+# subscribes to the device topics and handles only the messages of the devices it owns on the ring, so all the messages
+# of a device follow a single path (one broker stream, one handler queue) and are handled in the order of the broker.
+# A shared subscription ($share/<group>/<filter>) would spread the messages of a device across the workers and lose
+# their order. The broker sends every message to every worker: the workers scale the handling, not the network input.
+# Run from the project root with: python -m process.shared_consumer_runner
+# Send SIGUSR1/SIGUSR2 to the runner to add/remove a worker with a graceful rebalancing of the devices
+
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from process.device_consumer import topic_dispatcher, device_info_topic, data_topic
+from utils.consistent_hash import ConsistentHashRing
+from utils.logger import configure_logging, get_logger, shutdown_logging, CONNECTION, METRICS, TELEMETRY
+from utils.topic_schema import parse_topic
+
+# Configuration variables
+client_id_prefix = "clientId0001-Consumer"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+worker_count = 4
+max_worker_count = 16
+virtual_nodes = 64
+report_interval_sec = 5
+rebalance_grace_sec = 1.0
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the runner categories
+connection_logger = get_logger(CONNECTION)
+metrics_logger = get_logger(METRICS)
+
+
+def device_id_from_topic(topic):
+    """ Device id of a device/<device_id>/... topic (None for the other topics) """
+
+    parsed = parse_topic(topic)
+    return parsed[0] if parsed is not None else None
+
+
+class ConsumerWorker:
+    """ Worker process of the runner. The MQTT network thread only filters the messages: the messages of the devices
+    owned by the worker go to the local FIFO queue, the others are skipped (they are handled by their owner).
+    A single handler thread runs the device_consumer handlers in the order of the local queue.
+    On a rebalancing the worker also keeps the devices of its previous ring for rebalance_grace_sec: the workers receive
+    the new ring at different times, so the moved devices are handled by both owners for a short time (at least once)
+    instead of being handled by none of them """
+
+    def __init__(self, worker_index, member_indexes, control_queue, stats_queue):
+        self.worker_index = worker_index
+        self.control_queue = control_queue
+        self.stats_queue = stats_queue
+
+        # The rings are replaced (never modified) on a rebalancing, so the network thread always reads consistent rings
+        self.ring = ConsistentHashRing(member_indexes, virtual_nodes)
+        self.previous_ring = None
+        self.previous_ring_deadline = 0.0
+
+        self.pending_messages = queue.Queue()
+        self.received_count = 0
+        self.skipped_count = 0
+        self.handled_count = 0
+        self.error_count = 0
+
+        self.mqtt_client = mqtt.Client(f"{client_id_prefix}-{worker_index}")
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_message = self.on_message
+
+        self._handler_thread = threading.Thread(target=self._handler_loop, daemon=True)
+
+    def on_connect(self, client, userdata, flags, rc):
+        connection_logger.info("Worker %s: connected with result code %s", self.worker_index, rc)
+        for topic_filter in (device_info_topic, data_topic):
+            client.subscribe(topic_filter)
+
+    def owns(self, device_id):
+        """ True if the worker handles the messages of a device (owner on the ring, or on the previous ring during a rebalancing) """
+
+        if self.ring.get_node(device_id) == self.worker_index:
+            return True
+        previous_ring = self.previous_ring
+        return previous_ring is not None and time.monotonic() < self.previous_ring_deadline and \
+            previous_ring.get_node(device_id) == self.worker_index
+
+    def on_message(self, client, userdata, message):
+        self.received_count += 1
+
+        # Device keyed messages are handled by the owner of the device, the others by every worker
+        device_id = device_id_from_topic(message.topic)
+        if device_id is None or self.owns(device_id):
+            self.pending_messages.put(message)
+        else:
+            self.skipped_count += 1
+
+    def _handler_loop(self):
+        """ Run the handlers of the messages in the order of the local queue """
+
+        while True:
+            message = self.pending_messages.get()
+            if message is None:
+                break
+            try:
+                topic_dispatcher.dispatch(message)
+                self.handled_count += 1
+            except Exception as e:
+                self.error_count += 1
+                connection_logger.error("Worker %s: error processing message: %s", self.worker_index, e)
+
+    def _report(self, interval):
+        self.stats_queue.put({
+            "worker": self.worker_index,
+            "interval": interval,
+            "received": self.received_count,
+            "skipped": self.skipped_count,
+            "handled": self.handled_count,
+            "errors": self.error_count,
+            "pending": self.pending_messages.qsize()
+        })
+
+    def run(self):
+        """ Connect to the broker and process the control messages of the runner until a stop request """
+
+        self._handler_thread.start()
+        self.mqtt_client.connect(broker_ip, broker_port)
+        self.mqtt_client.loop_start()
+
+        last_report = time.monotonic()
+        while True:
+            try:
+                command = self.control_queue.get(timeout=max(0.0, report_interval_sec - (time.monotonic() - last_report)))
+            except queue.Empty:
+                command = None
+
+            if command is not None:
+                if command[0] == "ring":
+                    self.previous_ring_deadline = time.monotonic() + rebalance_grace_sec
+                    self.previous_ring = self.ring
+                    self.ring = ConsistentHashRing(command[1], virtual_nodes)
+                    connection_logger.info("Worker %s: ring updated, members: %s", self.worker_index, command[1])
+                elif command[0] == "stop":
+                    break
+
+            now = time.monotonic()
+            if now - last_report >= report_interval_sec:
+                self._report(now - last_report)
+                last_report = now
+
+        self._shutdown(last_report)
+
+    def _shutdown(self, last_report):
+        """ Graceful stop: keep handling the devices until the remaining workers own them, then handle the pending messages """
+
+        # The remaining workers received the new ring before the stop request: the devices of the leaving worker are
+        # handled by both for rebalance_grace_sec, so no message is lost while the ring propagates
+        time.sleep(rebalance_grace_sec)
+        self.mqtt_client.disconnect()
+        self.mqtt_client.loop_stop()
+
+        self.pending_messages.put(None)
+        self._handler_thread.join()
+
+        self._report(time.monotonic() - last_report)
+        connection_logger.info("Worker %s: stopped after %s handled messages", self.worker_index, self.handled_count)
+
+
+def run_worker(worker_index, member_indexes, control_queue, stats_queue):
+    """ Entry point of a worker process """
+
+    # The runner stops the workers through the control queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ConsumerWorker(worker_index, member_indexes, control_queue, stats_queue).run()
+
+    # The worker process exits without the atexit handlers: write the queued records before the exit
+    shutdown_logging()
+
+
+class SharedConsumerRunner:
+    """ This class spawns and rebalances the worker processes and collects their throughput reports.
+    The control queues are created upfront for max_worker_count slots, since multiprocessing queues
+    can only be shared with the child processes at creation time """
+
+    def __init__(self, worker_count, max_worker_count=16):
+        """
+        Constructor for SharedConsumerRunner class
+        :param worker_count: Initial number of worker processes
+        :param max_worker_count: Max number of worker processes
+        """
+
+        self.initial_worker_count = worker_count
+        self.max_worker_count = max_worker_count
+
+        self.control_queues = [multiprocessing.Queue() for _ in range(max_worker_count)]
+        self.stats_queue = multiprocessing.Queue()
+
+        # Worker index -> Process
+        self.workers = {}
+
+        # Worker index -> previous report (to compute the rates)
+        self._last_reports = {}
+
+    def members(self):
+        return sorted(self.workers)
+
+    def start(self):
+        members = list(range(self.initial_worker_count))
+        for worker_index in members:
+            self._spawn(worker_index, members)
+
+    def _spawn(self, worker_index, members):
+        process = multiprocessing.Process(target=run_worker, name=f"consumer-worker-{worker_index}",
+                                          args=(worker_index, members, self.control_queues[worker_index], self.stats_queue))
+        process.start()
+        self.workers[worker_index] = process
+
+    def _broadcast_ring(self, members, exclude=None):
+        for worker_index in self.workers:
+            if worker_index != exclude:
+                self.control_queues[worker_index].put(("ring", members))
+
+    def add_worker(self):
+        """ Spawn a new worker and move to it its share of the devices """
+
+        free_slots = [index for index in range(self.max_worker_count) if index not in self.workers]
+        if not free_slots:
+            connection_logger.warning("Max worker count reached (%s)", self.max_worker_count)
+            return
+        worker_index = free_slots[0]
+        members = sorted(self.members() + [worker_index])
+        self._spawn(worker_index, members)
+        self._broadcast_ring(members, exclude=worker_index)
+        connection_logger.info("Worker %s added, members: %s", worker_index, members)
+
+    def remove_worker(self, worker_index=None):
+        """ Stop a worker (the last one by default) after moving its devices to the remaining workers """
+
+        if len(self.workers) <= 1:
+            connection_logger.warning("At least one worker is required")
+            return
+        if worker_index is None:
+            worker_index = max(self.workers)
+
+        # The remaining workers take over the devices of the leaving worker before it stops
+        members = [index for index in self.members() if index != worker_index]
+        self._broadcast_ring(members, exclude=worker_index)
+        self.control_queues[worker_index].put(("stop",))
+        self.workers.pop(worker_index).join()
+        self._last_reports.pop(worker_index, None)
+        connection_logger.info("Worker %s removed, members: %s", worker_index, members)
+
+    def stop(self):
+        """ Stop all the workers """
+
+        for worker_index in self.workers:
+            self.control_queues[worker_index].put(("stop",))
+        for process in self.workers.values():
+            process.join()
+        self.workers.clear()
+        self.log_reports()
+
+    def log_reports(self, timeout=0.0):
+        """ Log the throughput reports received from the workers """
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                report = self.stats_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+
+            previous = self._last_reports.get(report["worker"])
+            self._last_reports[report["worker"]] = report
+            interval = report["interval"] or 1.0
+
+            def rate(name):
+                return (report[name] - (previous[name] if previous else 0)) / interval
+
+            metrics_logger.info("Worker %s: received %.1f msg/s, handled %.1f msg/s, skipped %.1f msg/s, pending %s, errors %s, "
+                                "total handled %s", report["worker"], rate("received"), rate("handled"), rate("skipped"),
+                                report["pending"], report["errors"], report["handled"])
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging (the worker processes restart their own writer after the fork)
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    runner = SharedConsumerRunner(worker_count, max_worker_count)
+    runner.start()
+    connection_logger.info("Started %s workers partitioning the devices of %s and %s", worker_count, device_info_topic, data_topic)
+
+    # Scale requests are recorded by the signal handlers and applied by the main loop
+    scale_requests = queue.SimpleQueue()
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: scale_requests.put(1))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: scale_requests.put(-1))
+
+    try:
+        while True:
+            runner.log_reports(timeout=0.5)
+            while not scale_requests.empty():
+                if scale_requests.get() > 0:
+                    runner.add_worker()
+                else:
+                    runner.remove_worker()
+    except KeyboardInterrupt:
+        connection_logger.info("Stopping the workers ...")
+    finally:
+        runner.stop()
@@ -5,10 +5,12 @@ from model.temperature_sensor import TemperatureSensor
 import paho.mqtt.client as mqtt
 import time
 
+from utils.logger import configure_logging, get_logger, CONNECTION, TELEMETRY
+
 
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, flags, rc):
-    print("Connected with result code " + str(rc))
+    connection_logger.info("Connected with result code %s", rc)
 
 #def on_publish(mqttc, obj, mid):
     #print("mid: " + str(mid))
@@ -24,49 +26,64 @@ broker_port = 1883
 default_topic = "sensor/temperature"
 message_limit = 1000
 
-# Create a new MQTT Client
-mqtt_client = mqtt.Client(client_id)
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 1
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
 
-# Attach Paho OnMessage Callback Method
-mqtt_client.on_connect = on_connect
+    # Attach Paho OnMessage Callback Method
+    mqtt_client.on_connect = on_connect
 
-# Attach Paho OnPublish Callback Method
-#mqtt_client.on_publish = on_publish
+    # Attach Paho OnPublish Callback Method
+    #mqtt_client.on_publish = on_publish
 
-# Connect to the target MQTT Broker
-print("Connecting to "+ broker_ip + " port: " + str(broker_port))
-mqtt_client.connect(broker_ip, broker_port)
+    # Connect to the target MQTT Broker
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+    mqtt_client.connect(broker_ip, broker_port)
 
-# Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
-mqtt_client.loop_start()
+    # Start the MQTT Client with the loop_start method to process the callbacks in a separate thread
+    mqtt_client.loop_start()
 
-# Create Demo Temperature Sensor
-temperature_sensor = TemperatureSensor()
+    # Create Demo Temperature Sensor
+    temperature_sensor = TemperatureSensor()
 
-# MQTT Paho Publish method with all the available parameters
-# mqtt_client.publish(topic, payload=None, qos=0, retain=False)
+    # MQTT Paho Publish method with all the available parameters
+    # mqtt_client.publish(topic, payload=None, qos=0, retain=False)
 
-# Publish messages with the temperature value
-for message_id in range(message_limit):
+    # Publish messages with the temperature value
+    for message_id in range(message_limit):
 
-    # Measure the temperature
-    temperature_sensor.measure_temperature()
+        # Measure the temperature
+        temperature_sensor.measure_temperature()
 
-    # Create the payload string with the temperature value
-    payload_string = temperature_sensor.temperature_value
+        # Create the payload string with the temperature value
+        payload_string = temperature_sensor.temperature_value
 
-    # Publish the message to the default topic
-    mqtt_client.publish(default_topic, payload_string)
+        # Publish the message to the default topic
+        mqtt_client.publish(default_topic, payload_string)
 
-    # Publish the message to the default topic and get the result in the infot variable
-    #infot = mqtt_client.publish(default_topic, payload_string)
-    #infot.wait_for_publish()
+        # Publish the message to the default topic and get the result in the infot variable
+        #infot = mqtt_client.publish(default_topic, payload_string)
+        #infot.wait_for_publish()
 
-    # Print the message sent
-    print(f"Message Sent: {message_id} Topic: {default_topic} Payload: {payload_string}")
+        # Log the message sent
+        telemetry_logger.info("Message Sent: %s Topic: %s Payload: %s", message_id, default_topic, payload_string)
 
-    # Wait for 1 second before sending the next message
-    time.sleep(1)
+        # Wait for 1 second before sending the next message
+        time.sleep(1)
 
-# Stop the MQTT Client with the loop_stop method in order to stop the separate thread
-mqtt_client.loop_stop()
+    # Stop the MQTT Client with the loop_stop method in order to stop the separate thread
+    mqtt_client.loop_stop()
@@ -0,0 +1,109 @@
+# For this example we rely on the Paho MQTT Library for Python
+# You can install it through the following command: pip install paho-mqtt
+# Capture of the device traffic of a broker into a traffic log (replayed offline by process/traffic_replay.py).
+# Like the admin consumer it subscribes with an account allowed to read all the device topics (set the username to
+# None for an anonymous broker); the messages are written with their topic, QoS, retain flag, payload and the monotonic
+# time of their reception
+import time
+
+import paho.mqtt.client as mqtt
+
+from utils.logger import configure_logging, get_logger, CONNECTION, INFO, METRICS, TELEMETRY
+from utils.traffic_log import TrafficLogWriter
+
+
+# The callback for when the client receives a CONNACK response from the server.
+def on_connect(client, userdata, flags, rc):
+    connection_logger.info("Connected with result code %s", rc)
+    mqtt_client.subscribe(capture_topic, capture_qos)
+    connection_logger.info("Subscribed to: %s", capture_topic)
+
+
+# Define a callback method to receive asynchronous messages
+def on_message(client, userdata, message):
+
+    # The messages are written by the network thread in their order of reception
+    traffic_log_writer.write(time.monotonic_ns() - capture_start_ns, message.topic, message.payload, message.qos, message.retain)
+    telemetry_logger.info("Message Captured: Topic: %s Size: %s", message.topic, len(message.payload))
+
+    if traffic_log_writer.message_count >= message_limit:
+        mqtt_client.disconnect()
+
+
+# Configuration variables
+client_id = "clientId0001-Capture"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+username = None
+password = None
+capture_topic = "device/#"
+capture_qos = 1
+capture_path = "device_traffic.cap"
+message_limit = 1000000
+
+# Capture duration (None to capture until message_limit or the interruption of the script)
+capture_duration_sec = None
+
+# Messages between two entries of the time index of the log (seek of the replays)
+capture_index_interval = 1000
+metrics_report_interval_sec = 10
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 100
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+metrics_logger = get_logger(METRICS)
+telemetry_logger = get_logger(TELEMETRY)
+
+# Global Variables for the MQTT Client, the Traffic Log and the start time of the capture
+mqtt_client = None
+traffic_log_writer = None
+capture_start_ns = 0
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    # Create the traffic log, the timestamps are relative to the start of the capture
+    traffic_log_writer = TrafficLogWriter(capture_path, index_interval=capture_index_interval)
+    capture_start_ns = time.monotonic_ns()
+
+    # Create a new MQTT Client
+    mqtt_client = mqtt.Client(client_id)
+
+    # Attack Paho OnMessage Callback Method
+    mqtt_client.on_message = on_message
+    mqtt_client.on_connect = on_connect
+
+    # Set Account Username & Password
+    if username is not None:
+        mqtt_client.username_pw_set(username, password)
+
+    # Connect to the target MQTT Broker
+    connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+    mqtt_client.connect(broker_ip, broker_port)
+
+    # The network thread receives the messages while the main thread reports the capture metrics
+    mqtt_client.loop_start()
+    deadline = time.monotonic() + capture_duration_sec if capture_duration_sec else None
+    try:
+        while mqtt_client.is_connected() or traffic_log_writer.message_count < message_limit:
+            time.sleep(min(metrics_report_interval_sec, max(0.0, deadline - time.monotonic())) if deadline else metrics_report_interval_sec)
+            metrics_logger.info("Capture Metrics: %s", traffic_log_writer.metrics())
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mqtt_client.disconnect()
+        mqtt_client.loop_stop()
+
+        # The time index is written when the log is closed
+        traffic_log_writer.close()
+        info_logger.info("Capture Closed: %s %s", capture_path, traffic_log_writer.metrics())
@@ -0,0 +1,155 @@
+# For this example we rely on the Paho MQTT Library for Python
+# You can install it through the following command: pip install paho-mqtt
+# Replay of a traffic log captured by process/traffic_capture.py: the messages are published again in their capture
+# order on a single connection (the per-topic order is preserved) at the capture speed, N times faster or as fast as
+# possible. Each message is scheduled at its capture offset divided by the speed from the start of the replay (the
+# delays do not accumulate), so two replays of a log send the same messages in the same order with the same timing.
+# The replay can start its own local broker (bench/mini_broker.py) for the controller under test
+import time
+
+import paho.mqtt.client as mqtt
+
+from bench.mini_broker import BrokerStandIn
+from utils.logger import configure_logging, get_logger, CONNECTION, INFO, METRICS, TELEMETRY
+from utils.traffic_log import TrafficLogReader
+
+
+# The callback for when the client receives a CONNACK response from the server.
+def on_connect(client, userdata, flags, rc):
+    connection_logger.info("Connected with result code %s", rc)
+
+
+# Configuration variables
+client_id = "clientId0001-Replay"
+broker_ip = "127.0.0.1"
+broker_port = 1883
+username = None
+password = None
+replay_path = "device_traffic.cap"
+
+# Speed of the replay: 1.0 is the capture speed, 10.0 is ten times faster, 0 publishes the messages as fast as possible
+replay_speed = 1.0
+
+# Offset of the capture where the replay starts (seek through the time index of the log)
+replay_start_sec = 0.0
+
+# Only the messages matching the topic filter are replayed
+replay_topic_filter = "#"
+
+# If False the messages are published without their retain flag (the replay does not leave retained messages)
+replay_retain = True
+
+# Start a local broker stand-in on broker_ip:broker_port (mosquitto if installed, otherwise the in-process broker) and
+# wait replay_start_delay_sec for the scripts under test to connect before the replay
+start_local_broker = False
+replay_start_delay_sec = 5.0
+metrics_report_interval_sec = 10
+
+# Logging options of configure_logging() (see utils/logger.py)
+telemetry_log_sample_rate = 100
+log_json_lines = False
+# End of the configuration variables
+
+# Loggers of the script categories
+connection_logger = get_logger(CONNECTION)
+info_logger = get_logger(INFO)
+metrics_logger = get_logger(METRICS)
+telemetry_logger = get_logger(TELEMETRY)
+
+
+def replay_messages(mqtt_client, traffic_log_reader):
+    """
+    Publish the messages of the traffic log following their capture timing
+    :return: Dictionary of the replay metrics
+    """
+
+    replayed_count = 0
+    max_lag_sec = 0.0
+    last_message_info = None
+    first_timestamp_ns = None
+    replay_start = time.monotonic()
+    next_report_time = replay_start + metrics_report_interval_sec
+
+    for message in traffic_log_reader.messages(replay_start_sec):
+        if replay_topic_filter != "#" and not mqtt.topic_matches_sub(replay_topic_filter, message.topic):
+            continue
+
+        # Absolute schedule from the start of the replay: a late message is sent immediately and the lag is not carried
+        if first_timestamp_ns is None:
+            first_timestamp_ns = message.timestamp_ns
+        if replay_speed:
+            target_time = replay_start + (message.timestamp_ns - first_timestamp_ns) / 1e9 / replay_speed
+            delay = target_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag_sec = max(max_lag_sec, -delay)
+
+        message_info = mqtt_client.publish(message.topic, message.payload, message.qos, message.retain and replay_retain)
+        if message.qos:
+            last_message_info = message_info
+        replayed_count += 1
+        telemetry_logger.info("Message Replayed: %s Topic: %s Size: %s", replayed_count, message.topic, len(message.payload))
+
+        if time.monotonic() >= next_report_time:
+            metrics_logger.info("Replay Metrics: Replayed: %s Max Lag: %.3f", replayed_count, max_lag_sec)
+            next_report_time += metrics_report_interval_sec
+
+    # The QoS > 0 messages are sent in order: the last one acknowledged means all of them have been delivered
+    if last_message_info is not None:
+        last_message_info.wait_for_publish()
+
+    duration_sec = time.monotonic() - replay_start
+    return {
+        "replayed": replayed_count,
+        "duration_sec": duration_sec,
+        "messages_per_sec": replayed_count / duration_sec if duration_sec > 0 else 0.0,
+        "max_lag_sec": max_lag_sec
+    }
+
+
+# Main Script
+if __name__ == "__main__":
+
+    # Configure the asynchronous logging
+    configure_logging(json_lines=log_json_lines, sample_rates={TELEMETRY: telemetry_log_sample_rate})
+
+    traffic_log_reader = TrafficLogReader(replay_path)
+    info_logger.info("Traffic Log: %s Messages: %s Duration: %s sec",
+                     replay_path, traffic_log_reader.message_count,
+                     traffic_log_reader.duration_ns / 1e9 if traffic_log_reader.duration_ns is not None else None)
+
+    broker_stand_in = None
+    if start_local_broker:
+        broker_stand_in = BrokerStandIn(host=broker_ip, port=broker_port)
+        broker_stand_in.start()
+        connection_logger.info("Local Broker Started (%s) on %s port: %s", broker_stand_in.kind, broker_ip, broker_port)
+
+    # Create a new MQTT Client (unlimited queue, the messages are never dropped by the client when replaying at max speed)
+    mqtt_client = mqtt.Client(client_id)
+    mqtt_client.on_connect = on_connect
+    mqtt_client.max_queued_messages_set(0)
+
+    # Set Account Username & Password
+    if username is not None:
+        mqtt_client.username_pw_set(username, password)
+
+    try:
+        # Connect to the target MQTT Broker
+        connection_logger.info("Connecting to %s port: %s", broker_ip, broker_port)
+        mqtt_client.connect(broker_ip, broker_port)
+        mqtt_client.loop_start()
+
+        if start_local_broker and replay_start_delay_sec:
+            info_logger.info("Replay Starting in %s sec", replay_start_delay_sec)
+            time.sleep(replay_start_delay_sec)
+
+        info_logger.info("Replay Started: Speed: %s Start: %s sec Filter: %s", replay_speed or "max", replay_start_sec, replay_topic_filter)
+        metrics_logger.info("Replay Completed: %s", replay_messages(mqtt_client, traffic_log_reader))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mqtt_client.disconnect()
+        mqtt_client.loop_stop()
+        if broker_stand_in is not None:
+            broker_stand_in.stop()
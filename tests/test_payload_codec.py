@@ -0,0 +1,120 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from dto.action_descriptor import ActionDescriptor
+from dto.device_descriptor import DeviceDescriptor
+from dto.event_descriptor import EventDescriptor
+from dto.message_descriptor import MessageDescriptor
+from dto.payload_codec import (BinaryCodec, CborCodec, JSON_CODEC, MsgPackCodec, available_codecs, codec_for_content_type,
+                               codec_for_message, codec_for_topic, codec_topic, dto_to_dict, get_codec)
+
+# One sample of each DTO and of each value kind (well known and custom types, float, int, enum and custom strings, None)
+SAMPLES = [
+    MessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 36.6),
+    MessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 37),
+    MessageDescriptor(1700000000, "SWITCH", "ON"),
+    MessageDescriptor(1700000000, "HUMIDITY_SENSOR", 55.5),
+    MessageDescriptor(1700000000, "STATUS", "degraded"),
+    MessageDescriptor(1700000000, "FLAG", True),
+    EventDescriptor(1700000000, "OVER_HEATING", 41.2),
+    EventDescriptor(1700000000, "DOOR_OPEN", None),
+    ActionDescriptor("SWITCH", "OFF"),
+    ActionDescriptor("SWITCH", "ON", 1700000000123),
+    DeviceDescriptor("device001", "PYTHON-ACME_CORPORATION", "0.1-beta")
+]
+
+# Codecs under test: the optional ones are skipped when their library is not installed
+CODEC_NAMES = ["json", "binary",
+               pytest.param("msgpack", marks=pytest.mark.skipif("msgpack" not in available_codecs(), reason="msgpack not installed")),
+               pytest.param("cbor", marks=pytest.mark.skipif("cbor" not in available_codecs(), reason="cbor2 not installed"))]
+
+
+@pytest.mark.parametrize("codec_name", CODEC_NAMES)
+@pytest.mark.parametrize("sample", SAMPLES, ids=lambda sample: f"{type(sample).__name__}-{sample[1]}-{sample[-1]}")
+def test_round_trip(codec_name, sample):
+    codec = get_codec(codec_name)
+    decoded = codec.decode(codec.encode(sample), type(sample))
+    assert type(decoded) is type(sample)
+    assert dto_to_dict(decoded) == dto_to_dict(sample)
+
+
+@pytest.mark.parametrize("sample", SAMPLES, ids=lambda sample: f"{type(sample).__name__}-{sample[1]}-{sample[-1]}")
+def test_json_codec_matches_to_json(sample):
+    assert JSON_CODEC.encode(sample) == sample.to_json()
+    assert dto_to_dict(JSON_CODEC.decode(sample.to_json().encode("utf-8"), type(sample))) == dto_to_dict(sample)
+
+
+def test_binary_float_message_is_compact():
+    assert len(get_codec("binary").encode(MessageDescriptor(1700000000, "TEMPERATURE_SENSOR", 36.6))) == 19
+
+
+def test_binary_rejects_other_dto_kind():
+    codec = get_codec("binary")
+    with pytest.raises(ValueError):
+        codec.decode(codec.encode(ActionDescriptor("SWITCH", "OFF")), MessageDescriptor)
+
+
+@pytest.mark.parametrize("codec_name", CODEC_NAMES)
+def test_topic_suffix_negotiation(codec_name):
+    codec = get_codec(codec_name)
+    topic = codec_topic("device/device001/telemetry/temperature", codec)
+    assert codec_for_topic(topic) == (codec, "device/device001/telemetry/temperature")
+
+
+def test_plain_topic_negotiates_json():
+    assert codec_topic("device/device001/event", JSON_CODEC) == "device/device001/event"
+    assert codec_for_topic("device/device001/event") == (JSON_CODEC, "device/device001/event")
+    assert codec_for_topic("bin") == (JSON_CODEC, "bin")
+
+
+def test_content_type_has_priority_over_topic_suffix():
+    binary_codec = get_codec("binary")
+    message = SimpleNamespace(topic="device/device001/telemetry/temperature/bin",
+                              properties=SimpleNamespace(ContentType=binary_codec.content_type))
+    assert codec_for_message(message) == (binary_codec, "device/device001/telemetry/temperature")
+
+    message = SimpleNamespace(topic="device/device001/telemetry/temperature/bin",
+                              properties=SimpleNamespace(ContentType=JSON_CODEC.content_type))
+    assert codec_for_message(message) == (JSON_CODEC, "device/device001/telemetry/temperature/bin")
+
+    message = SimpleNamespace(topic="device/device001/telemetry/temperature/bin", properties=None)
+    assert codec_for_message(message) == (binary_codec, "device/device001/telemetry/temperature")
+
+
+def test_unknown_content_type_negotiates_json():
+    assert codec_for_content_type("application/x-unknown") is JSON_CODEC
+    assert codec_for_content_type(None) is JSON_CODEC
+
+
+@pytest.mark.parametrize("codec_class, module_name", [(MsgPackCodec, "msgpack"), (CborCodec, "cbor2")])
+def test_optional_codec_requires_its_library(monkeypatch, codec_class, module_name):
+    # A None entry in sys.modules makes the import fail as if the library was not installed
+    monkeypatch.setitem(sys.modules, module_name, None)
+    with pytest.raises(ImportError):
+        codec_class()
+
+
+@pytest.mark.parametrize("codec_name, module_name", [("msgpack", "msgpack"), ("cbor", "cbor2")])
+def test_optional_codec_registered_only_when_installed(codec_name, module_name):
+    try:
+        __import__(module_name)
+        installed = True
+    except ImportError:
+        installed = False
+
+    assert (codec_name in available_codecs()) == installed
+    if not installed:
+        with pytest.raises(ValueError):
+            get_codec(codec_name)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec("xml")
+
+
+def test_binary_codec_instances_are_interchangeable():
+    sample = MessageDescriptor(1700000000, "SWITCH", "OFF")
+    assert BinaryCodec().decode(get_codec("binary").encode(sample), MessageDescriptor) == sample
@@ -0,0 +1,139 @@
+import time
+
+import pytest
+
+from utils.rule_engine import Rule, RuleEngine, _ThresholdGroup, parse_duration, parse_rules
+
+ALIASES = {"temperature": "TEMPERATURE_SENSOR"}
+TOPIC = "device/{}/telemetry/temperature"
+
+
+def fired_names(engine, device_id, value, timestamp=0, topic=None):
+    fired = engine.evaluate(device_id, topic or TOPIC.format(device_id), "TEMPERATURE_SENSOR", ((timestamp, value),))
+    return sorted(rule.name for rule, _ in fired)
+
+
+def test_parse_rule():
+    rules, groups = parse_rules("group lab = device001, device002  # lab devices\n"
+                                "hot: avg(temperature, 30s) > 37.5 for device in group lab on device/+/telemetry/# "
+                                "=> SWITCH OFF, schedule ON after 10s", ALIASES)
+
+    assert groups == {"lab": ["device001", "device002"]}
+    rule = rules[0]
+    assert (rule.name, rule.value_type, rule.function, rule.window_sec, rule.operator, rule.threshold) == \
+           ("hot", "TEMPERATURE_SENSOR", "avg", 30.0, ">", 37.5)
+    assert (rule.group, rule.device_id, rule.topic_filter) == ("lab", None, "device/+/telemetry/#")
+    assert (rule.action_type, rule.action_value) == ("SWITCH", "OFF")
+    assert (rule.schedule_type, rule.schedule_value, rule.schedule_delay_sec) == ("SWITCH", "ON", 10.0)
+
+
+def test_parse_defaults():
+    rules, _ = parse_rules("\n# comment\nlast(temperature) <= -5 for device device007 => SWITCH ON\n")
+
+    rule = rules[0]
+    assert rule.name == "rule-3"
+    assert (rule.function, rule.window_sec, rule.threshold, rule.device_id) == ("last", None, -5.0, "device007")
+    assert rule.schedule_value is None and rule.schedule_delay_sec is None
+
+
+@pytest.mark.parametrize("text", [
+    "avg(temperature) > 1 => SWITCH OFF",
+    "last(temperature, 5s) > 1 => SWITCH OFF",
+    "median(temperature, 5s) > 1 => SWITCH OFF",
+    "avg(temperature, 5s) == 1 => SWITCH OFF",
+    "avg(temperature, 5s) > 1 on device/#/x => SWITCH OFF",
+    "avg(temperature, 5s) > 1 for device in group missing => SWITCH OFF",
+    "avg(temperature, 5s) > 1"
+])
+def test_parse_invalid(text):
+    with pytest.raises(ValueError):
+        parse_rules(text)
+
+
+def test_parse_duration():
+    assert parse_duration("500ms") == 0.5
+    assert parse_duration("30") == 30.0
+    assert parse_duration("5m") == 300.0
+    assert parse_duration("1h") == 3600.0
+    with pytest.raises(ValueError):
+        parse_duration("5d")
+
+
+@pytest.mark.parametrize("operator, value, expected", [
+    (">", 20, [10]),
+    (">", 10, []),
+    (">=", 20, [10, 20]),
+    (">=", 9.9, []),
+    ("<", 20, [30]),
+    ("<", 30, []),
+    ("<=", 20, [20, 30]),
+    ("<=", 30.1, [])
+])
+def test_threshold_group_bisect(operator, value, expected):
+    rules = [Rule(f"r{threshold}", "", "T", "last", None, operator, threshold) for threshold in (30, 10, 20)]
+    group = _ThresholdGroup("last", None, operator, rules, 1)
+    assert [rule.threshold for rule in group.fired(value)] == expected
+
+
+def test_device_and_group_scopes():
+    engine = RuleEngine("group lab = device001, device002\n"
+                        "all: last(temperature) > 10 => SWITCH OFF\n"
+                        "lab: last(temperature) > 20 for device in group lab => SWITCH OFF\n"
+                        "one: last(temperature) > 30 for device device002 => SWITCH OFF\n"
+                        "filtered: last(temperature) > 40 on device/device003/# => SWITCH OFF", ALIASES)
+
+    assert fired_names(engine, "device001", 50) == ["all", "lab"]
+    assert fired_names(engine, "device002", 50) == ["all", "lab", "one"]
+    assert fired_names(engine, "device003", 50) == ["all", "filtered"]
+    assert fired_names(engine, "device004", 50) == ["all"]
+    assert fired_names(engine, "device002", 25) == ["all", "lab"]
+    assert engine.evaluate("device001", TOPIC.format("device001"), "HUMIDITY_SENSOR", ((0, 50),)) == []
+
+
+def test_windowed_rules_need_min_samples():
+    engine = RuleEngine("avg(temperature, 10s) > 20 => SWITCH OFF", ALIASES, min_samples=3)
+
+    assert fired_names(engine, "device001", 30, timestamp=0) == []
+    assert fired_names(engine, "device001", 30, timestamp=1) == []
+    assert fired_names(engine, "device001", 30, timestamp=2) == ["rule-1"]
+
+    # The samples older than the window are evicted
+    assert fired_names(engine, "device001", 0, timestamp=20) == []
+
+
+def test_devices_beyond_the_cache_share_the_compiled_rules():
+    engine = RuleEngine("group lab = device0, device1\n"
+                        "last(temperature) > 10 => SWITCH OFF\n"
+                        "last(temperature) > 20 for device in group lab => SWITCH OFF", ALIASES, cache_size=2)
+
+    for device_index in range(100):
+        assert len(fired_names(engine, f"device{device_index}", 50)) == (2 if device_index < 2 else 1)
+    assert engine.cache_misses == 0
+
+
+def wait_until(condition, timeout_sec=5.0):
+    deadline = time.monotonic() + timeout_sec
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_invalid_reload_keeps_previous_rules(tmp_path):
+    rules_path = tmp_path / "rules.txt"
+    rules_path.write_text("hot: last(temperature) > 10 => SWITCH OFF\n")
+    engine = RuleEngine(value_type_aliases=ALIASES)
+    engine.start(str(rules_path), 0.01)
+    try:
+        assert fired_names(engine, "device001", 50) == ["hot"]
+
+        # The reload thread logs the error and keeps the rules until the file is fixed
+        rules_path.write_text("hot: last(temperature) >> 10 => SWITCH OFF\n")
+        assert wait_until(lambda: engine.reload_error_count == 1)
+        assert [rule.name for rule in engine.rules()] == ["hot"]
+        assert fired_names(engine, "device001", 50) == ["hot"]
+
+        rules_path.write_text("cold: last(temperature) < 0 => SWITCH ON\n")
+        assert wait_until(lambda: engine.reload_count == 2)
+        assert fired_names(engine, "device001", -5) == ["cold"]
+    finally:
+        engine.stop()
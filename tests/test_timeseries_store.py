@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+
+from utils.timeseries_store import TimeSeriesStore
+
+
+def segment_count(store, device_id, value_type):
+    return len(store._segment_indexes(store._series_path(device_id, value_type)))
+
+
+def test_reordered_records_are_sorted_in_the_buffer(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    for index in range(3000):
+        store.append("device001", "T", index + 1 if index % 2 == 0 else index - 1, float(index))
+
+    timestamps, values = store.query("device001", "T")
+    assert segment_count(store, "device001", "T") == 1
+    assert np.all(timestamps[1:] >= timestamps[:-1])
+    assert sorted(values.tolist()) == [float(index) for index in range(3000)]
+
+
+def test_record_older_than_the_written_ones_starts_a_segment(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    for timestamp in (10, 20, 30):
+        store.append("device001", "T", timestamp, float(timestamp))
+    store.flush()
+
+    # Newer than the written records: same segment
+    store.append("device001", "T", 40, 40.0)
+    store.flush()
+    assert segment_count(store, "device001", "T") == 1
+
+    store.append("device001", "T", 25, 25.0)
+    timestamps, _ = store.query("device001", "T")
+    assert segment_count(store, "device001", "T") == 2
+    assert timestamps.tolist() == [10, 20, 25, 30, 40]
+    assert store.query("device001", "T", start=20, end=40)[0].tolist() == [20, 25, 30]
+
+
+def test_sealed_maps_are_bounded(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), segment_size=10, max_sealed_maps=3)
+    for timestamp in range(100):
+        store.append("device001", "T", timestamp, float(timestamp))
+
+    descriptor_count = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+    assert len(store.query("device001", "T")[0]) == 100
+    assert len(store._sealed_maps) == 3
+    if descriptor_count is not None:
+        # The maps of the evicted segments are closed after the query
+        assert len(os.listdir("/proc/self/fd")) <= descriptor_count + 2 * 3
@@ -0,0 +1,41 @@
+import threading
+
+from utils.topic_dispatcher import TopicDispatcher
+
+
+def test_first_registered_filter_wins():
+    dispatcher = TopicDispatcher()
+    dispatcher.add_handler("device/+/telemetry/aggregate", "aggregate")
+    dispatcher.add_handler("device/+/telemetry/#", "telemetry")
+    assert dispatcher.resolve("device/device001/telemetry/aggregate") == ("aggregate", "telemetry")
+    assert dispatcher.resolve("device/device001/telemetry/temperature") == ("telemetry",)
+    assert dispatcher.resolve("$SYS/device/x") == ()
+
+
+def test_concurrent_resolve_with_evictions():
+    # A cache smaller than the topic set evicts on most resolutions while the threads move the cached topics
+    dispatcher = TopicDispatcher(cache_size=16)
+    dispatcher.add_handler("device/+/info", "info")
+    dispatcher.add_handler("device/+/sensor/#", "data")
+    errors = []
+
+    def resolve_topics(seed):
+        try:
+            for index in range(20000):
+                device = (index * 7 + seed) % 64
+                if index % 2:
+                    assert dispatcher.resolve(f"device/d{device}/sensor/temperature") == ("data",)
+                else:
+                    assert dispatcher.resolve(f"device/d{device}/info") == ("info",)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=resolve_topics, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert dispatcher.cache_hits + dispatcher.cache_misses == 80000
+    assert len(dispatcher._cache) <= 16
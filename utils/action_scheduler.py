@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import threading
+import time
+
+from utils.logger import get_logger, ACTION
+
+logger = get_logger(ACTION)
+
+
+class _ScheduledAction:
+    """ Action waiting in the scheduler heap """
+
+    __slots__ = ("due_time", "sequence", "key", "callback", "args", "cancelled")
+
+    def __init__(self, due_time, sequence, key, callback, args):
+        self.due_time = due_time
+        self.sequence = sequence
+        self.key = key
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.due_time, self.sequence) < (other.due_time, other.sequence)
+
+
+class ActionScheduler:
+    """ This class executes delayed actions on a single thread using a heap ordered by due time,
+    instead of starting a threading.Timer (one thread) for each action.
+    Actions can be scheduled with a coalescing key (e.g. the device id): a newer action with the
+    same key replaces the pending one, so a device has at most one pending action """
+
+    def __init__(self, name="ActionScheduler"):
+        """
+        Constructor for ActionScheduler class
+        :param name: Name of the scheduler thread
+        """
+
+        self.name = name
+
+        self._heap = []
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+        # Cancelled entries still in the heap (removed lazily)
+        self._cancelled_in_heap = 0
+
+        # Metrics of the scheduler
+        self.scheduled_count = 0
+        self.fired_count = 0
+        self.replaced_count = 0
+        self.cancelled_count = 0
+        self.total_firing_lag = 0.0
+        self.max_firing_lag = 0.0
+
+    def start(self):
+        """ Start the scheduler thread """
+
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the scheduler thread discarding the pending actions """
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, delay_sec, callback, *args, key=None):
+        """
+        Schedule an action
+        :param delay_sec: Seconds to wait before executing the action
+        :param callback: Function to execute
+        :param args: Arguments of the function
+        :param key: Optional coalescing key, a pending action with the same key is replaced
+        :return: The scheduled action
+        """
+
+        with self._condition:
+            action = _ScheduledAction(time.monotonic() + delay_sec, next(self._sequence), key, callback, args)
+
+            if key is not None:
+                previous = self._pending.get(key)
+                if previous is not None:
+                    previous.cancelled = True
+                    self._cancelled_in_heap += 1
+                    self.replaced_count += 1
+                self._pending[key] = action
+
+            heapq.heappush(self._heap, action)
+            self.scheduled_count += 1
+            self._compact()
+
+            # Wake up the scheduler thread only if the new action is the next one to fire
+            if self._heap[0] is action:
+                self._condition.notify()
+
+            return action
+
+    def cancel(self, key):
+        """
+        Cancel the pending action with the given key
+        :param key: Coalescing key used to schedule the action
+        :return: True if a pending action has been cancelled
+        """
+
+        with self._condition:
+            action = self._pending.pop(key, None)
+            if action is None:
+                return False
+            action.cancelled = True
+            self._cancelled_in_heap += 1
+            self.cancelled_count += 1
+            self._compact()
+            return True
+
+    def pending_count(self):
+        """ Number of actions waiting to be executed """
+
+        with self._condition:
+            return len(self._heap) - self._cancelled_in_heap
+
+    def metrics(self):
+        """ Snapshot of the scheduler metrics as a dictionary """
+
+        with self._condition:
+            return {
+                "pending": len(self._heap) - self._cancelled_in_heap,
+                "scheduled": self.scheduled_count,
+                "fired": self.fired_count,
+                "replaced": self.replaced_count,
+                "cancelled": self.cancelled_count,
+                "avg_firing_lag_ms": (self.total_firing_lag / self.fired_count * 1000.0) if self.fired_count else 0.0,
+                "max_firing_lag_ms": self.max_firing_lag * 1000.0
+            }
+
+    def _compact(self):
+        """ Rebuild the heap when most of its entries have been cancelled (must hold the lock) """
+
+        if self._cancelled_in_heap > 64 and self._cancelled_in_heap * 2 > len(self._heap):
+            self._heap = [action for action in self._heap if not action.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_in_heap = 0
+
+    def _run(self):
+        """ Wait for the next due action and execute it """
+
+        while True:
+            with self._condition:
+                action = None
+                while self._running:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    head = self._heap[0]
+                    if head.cancelled:
+                        heapq.heappop(self._heap)
+                        self._cancelled_in_heap -= 1
+                        continue
+
+                    delay = head.due_time - time.monotonic()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                        continue
+
+                    action = heapq.heappop(self._heap)
+                    if action.key is not None and self._pending.get(action.key) is action:
+                        del self._pending[action.key]
+                    break
+
+                if action is None:
+                    return
+
+                lag = time.monotonic() - action.due_time
+                self.fired_count += 1
+                self.total_firing_lag += lag
+                if lag > self.max_firing_lag:
+                    self.max_firing_lag = lag
+
+            # Execute the action outside the lock so it can schedule new actions
+            try:
+                action.callback(*action.args)
+            except Exception as e:
+                logger.error("Error executing scheduled action: %s", e)
@@ -0,0 +1,171 @@
+import asyncio
+
+import paho.mqtt.client as mqtt
+
+from utils.asyncio_mqtt_helper import AsyncioMqttHelper
+from utils.topic_dispatcher import TopicDispatcher
+
+
+class AsyncMqttClient:
+    """ This class is an asyncio front end for the MQTT Paho Client. The Paho socket is driven by the
+    running event loop (see AsyncioMqttHelper) and the Paho callbacks are turned into awaitables:
+    connect waits for the CONNACK, publish with QoS >= 1 waits for the broker acknowledgement and
+    subscribe returns an async iterator of the messages matching the topic filter """
+
+    def __init__(self, client_id, broker_ip, broker_port=1883, username=None, password=None, keepalive=60):
+        """
+        Constructor for AsyncMqttClient class
+        :param client_id: Unique MQTT Client Id
+        :param broker_ip: Address of the MQTT Broker
+        :param broker_port: Port of the MQTT Broker
+        :param username: Optional account username
+        :param password: Optional account password
+        :param keepalive: MQTT keepalive in seconds
+        """
+
+        self.broker_ip = broker_ip
+        self.broker_port = broker_port
+        self.keepalive = keepalive
+
+        self.mqtt_client = mqtt.Client(client_id)
+        if username is not None:
+            self.mqtt_client.username_pw_set(username, password)
+
+        self.mqtt_client.on_connect = self._on_connect
+        self.mqtt_client.on_disconnect = self._on_disconnect
+        self.mqtt_client.on_publish = self._on_publish
+        self.mqtt_client.on_subscribe = self._on_subscribe
+        self.mqtt_client.on_message = self._on_message
+
+        self._loop = None
+        self._helper = None
+        self._connect_future = None
+        self._disconnect_future = None
+
+        # Futures waiting for the broker acknowledgement indexed by message id
+        self._pending_publishes = {}
+        self._pending_subscribes = {}
+
+        # Active subscriptions: topic filter -> number of async iterators using it
+        self._subscription_counters = {}
+        self._dispatcher = TopicDispatcher()
+
+    async def connect(self):
+        """ Connect to the MQTT Broker and wait for the CONNACK """
+
+        self._loop = asyncio.get_running_loop()
+        self._helper = AsyncioMqttHelper(self._loop)
+        self._helper.attach(self.mqtt_client)
+
+        self._connect_future = self._loop.create_future()
+        self.mqtt_client.connect(self.broker_ip, self.broker_port, self.keepalive)
+        await self._connect_future
+
+    async def disconnect(self):
+        """ Disconnect from the MQTT Broker """
+
+        self._disconnect_future = self._loop.create_future()
+        self.mqtt_client.disconnect()
+        await self._disconnect_future
+        self._helper.close()
+
+    async def publish(self, topic, payload=None, qos=0, retain=False):
+        """
+        Publish a message. With QoS >= 1 the coroutine completes when the broker acknowledges the message
+        :param topic: Target topic
+        :param payload: Message payload
+        :param qos: MQTT QoS
+        :param retain: MQTT Retained flag
+        :return: Message id of the published message
+        """
+
+        message_info = self.mqtt_client.publish(topic, payload, qos, retain)
+        if message_info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            raise ConnectionError(f"Error publishing on {topic}: {mqtt.error_string(message_info.rc)}")
+
+        # With QoS 0 there is no acknowledgement from the broker
+        if qos > 0:
+            future = self._loop.create_future()
+            self._pending_publishes[message_info.mid] = future
+            await future
+
+        return message_info.mid
+
+    async def subscribe(self, topic_filter, qos=0):
+        """
+        Subscribe to a topic filter and iterate over the received messages
+        Usage: async for message in client.subscribe("device/+/info"): ...
+        :param topic_filter: MQTT topic filter
+        :param qos: Requested MQTT QoS
+        """
+
+        queue = asyncio.Queue()
+        self._dispatcher.add_handler(topic_filter, queue.put_nowait)
+
+        try:
+            # Subscribe on the broker only for the first iterator of the filter
+            subscription_counter = self._subscription_counters.get(topic_filter, 0)
+            self._subscription_counters[topic_filter] = subscription_counter + 1
+            if subscription_counter == 0:
+                result, mid = self.mqtt_client.subscribe(topic_filter, qos)
+                if result != mqtt.MQTT_ERR_SUCCESS:
+                    raise ConnectionError(f"Error subscribing to {topic_filter}: {mqtt.error_string(result)}")
+                future = self._loop.create_future()
+                self._pending_subscribes[mid] = future
+                await future
+
+            while True:
+                yield await queue.get()
+        finally:
+            self._dispatcher.remove_handler(topic_filter, queue.put_nowait)
+            self._subscription_counters[topic_filter] -= 1
+            if self._subscription_counters[topic_filter] == 0:
+                del self._subscription_counters[topic_filter]
+                if self.mqtt_client.is_connected():
+                    self.mqtt_client.unsubscribe(topic_filter)
+
+    def call_later(self, delay_sec, callback, *args):
+        """ Schedule a callback on the event loop (no dedicated thread for each timer) """
+        return self._loop.call_later(delay_sec, callback, *args)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        """ Complete the connect future with the CONNACK result """
+
+        if self._connect_future is None or self._connect_future.done():
+            return
+        if rc == 0:
+            self._connect_future.set_result(rc)
+        else:
+            self._connect_future.set_exception(ConnectionError(f"Connection failed with result code {rc}"))
+
+    def _on_disconnect(self, client, userdata, rc):
+        """ Complete the disconnect future and fail the pending acknowledgements """
+
+        if self._disconnect_future is not None and not self._disconnect_future.done():
+            self._disconnect_future.set_result(rc)
+
+        for future in list(self._pending_publishes.values()) + list(self._pending_subscribes.values()):
+            if not future.done():
+                future.set_exception(ConnectionError(f"Disconnected with result code {rc}"))
+        self._pending_publishes.clear()
+        self._pending_subscribes.clear()
+
+    def _on_publish(self, client, userdata, mid):
+        """ Complete the future of an acknowledged QoS >= 1 message """
+
+        future = self._pending_publishes.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(mid)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        """ Complete the future of an acknowledged subscription """
+
+        future = self._pending_subscribes.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(granted_qos)
+
+    def _on_message(self, client, userdata, message):
+        """ Deliver the message to the queues of all the matching subscriptions """
+
+        for handler in self._dispatcher.resolve(message.topic):
+            handler(message)
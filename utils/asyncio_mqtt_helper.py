@@ -0,0 +1,75 @@
+import asyncio
+
+import paho.mqtt.client as mqtt
+
+
+class AsyncioMqttHelper:
+    """ This class drives one or more MQTT Paho Clients from an asyncio event loop instead of using
+    the loop_forever/loop_start threads. The socket of each client is registered on the event loop through
+    add_reader/add_writer, and a single housekeeping task calls loop_misc (keepalive and retries) for all
+    the attached clients, so N clients do not require N threads or N timer tasks """
+
+    def __init__(self, loop, misc_interval=1.0):
+        """
+        Constructor for AsyncioMqttHelper class
+        :param loop: asyncio event loop driving the clients
+        :param misc_interval: Seconds between two loop_misc calls on the attached clients
+        """
+
+        self.loop = loop
+        self.misc_interval = misc_interval
+
+        # Clients with an open socket registered on the event loop
+        self._clients = set()
+        self._misc_task = None
+
+    def attach(self, client):
+        """
+        Attach a client to the event loop. It must be called before client.connect()
+        :param client: MQTT Paho Client
+        """
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _on_socket_open(self, client, userdata, sock):
+        """ Register the socket of the client for read events """
+
+        self.loop.add_reader(sock, client.loop_read)
+        self._clients.add(client)
+
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        """ Remove the socket of the client from the event loop """
+
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self._clients.discard(client)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        """ Register the socket for write events when Paho has outgoing data """
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """ Remove the write registration when the outgoing data has been sent """
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        """ Periodically run the Paho housekeeping for all the attached clients """
+
+        while self._clients:
+            for client in list(self._clients):
+                if client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                    self._clients.discard(client)
+            await asyncio.sleep(self.misc_interval)
+
+    def close(self):
+        """ Stop the housekeeping task """
+
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
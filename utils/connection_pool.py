@@ -0,0 +1,307 @@
+import threading
+
+import paho.mqtt.client as mqtt
+
+from utils.consistent_hash import ConsistentHashRing, stable_hash
+from utils.logger import get_logger, CONNECTION
+
+logger = get_logger(CONNECTION)
+
+
+class _PooledConnection:
+    """ MQTT connection of the pool with its health and its inflight window accounting """
+
+    __slots__ = ("index", "client", "connected", "inflight_mids", "reserved_count", "early_acks", "published_count",
+                 "window_full_count", "device_ids")
+
+    def __init__(self, index, client):
+        self.index = index
+        self.client = client
+        self.connected = False
+
+        # Message ids of the QoS > 0 messages published and not yet acknowledged by the broker
+        self.inflight_mids = set()
+
+        # Window slots of the publishes in progress and the acknowledgements received before their message id was recorded
+        self.reserved_count = 0
+        self.early_acks = set()
+        self.published_count = 0
+        self.window_full_count = 0
+
+        # Logical devices currently assigned to the connection
+        self.device_ids = set()
+
+
+class PooledDeviceClient:
+    """ Client of a logical device multiplexed on a MqttConnectionPool, exposing the publish/subscribe subset of the
+    Paho Client used by the smart objects (the identity of the device is in its topics, not in a MQTT session) """
+
+    __slots__ = ("pool", "device_id")
+
+    def __init__(self, pool, device_id):
+        """
+        Constructor for PooledDeviceClient class
+        :param pool: MqttConnectionPool carrying the messages of the device
+        :param device_id: Identifier of the logical device
+        """
+
+        self.pool = pool
+        self.device_id = device_id
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        return self.pool.publish(self.device_id, topic, payload, qos, retain)
+
+    def subscribe(self, topic_filter, callback, qos=0):
+        self.pool.subscribe(self.device_id, topic_filter, callback, qos)
+
+    def is_connected(self):
+        return self.pool.device_connection(self.device_id).connected
+
+
+class MqttConnectionPool:
+    """ Small pool of broker connections shared by many logical devices (gateway mode): hundreds of devices use
+    pool_size sockets instead of one socket and one session each. The devices are spread over the connected
+    connections with a consistent hashing ring, so the messages of a device always use the same connection
+    (keeping their order) and a failover only moves the devices of the dropped connection to the healthy ones.
+    Each device subscription follows the device to its new connection, and the QoS > 0 publishes of each connection
+    are limited by an inflight window (a full window rejects the publish instead of queueing it in the Paho client) """
+
+    def __init__(self, client_id_prefix, pool_size=4, max_inflight=20, client_factory=None):
+        """
+        Constructor for MqttConnectionPool class
+        :param client_id_prefix: Prefix of the client ids of the connections (<prefix>-<index>)
+        :param pool_size: Number of broker connections
+        :param max_inflight: Max QoS > 0 messages waiting for the acknowledgement of the broker on each connection
+        :param client_factory: Optional callable creating the Paho Client of a client id (e.g. attached to an AsyncioMqttHelper)
+        """
+
+        self.max_inflight = max_inflight
+        client_factory = client_factory or mqtt.Client
+
+        self._connections = []
+        for index in range(pool_size):
+            client = client_factory(f"{client_id_prefix}-{index}")
+            client.user_data_set(index)
+            client.max_inflight_messages_set(max_inflight)
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            client.on_publish = self._on_publish
+            self._connections.append(_PooledConnection(index, client))
+
+        # Ring of the indexes of the connected connections
+        self._ring = ConsistentHashRing()
+
+        # device_id -> _PooledConnection currently carrying the device
+        self._assignments = {}
+
+        # device_id -> list of (topic_filter, callback, qos)
+        self._subscriptions = {}
+
+        self._lock = threading.RLock()
+        self._closing = False
+
+        # Lock of the inflight windows, never held while calling the Paho clients: the acknowledgements are received by
+        # the network thread holding the message mutex of its client, which Client.publish() also takes
+        self._inflight_lock = threading.Lock()
+
+        # Metrics of the pool
+        self.failover_count = 0
+        self.moved_device_count = 0
+
+    def connect(self, host, port=1883, keepalive=60, loop_start=True):
+        """
+        Connect all the connections of the pool (a connection failing now is connected later by reconnect())
+        :param loop_start: If True each connection is driven by the Paho network thread (automatic reconnection),
+        False if the clients are driven by an external loop (e.g. an AsyncioMqttHelper)
+        """
+
+        self._closing = False
+        for connection in self._connections:
+            try:
+                connection.client.connect(host, port, keepalive)
+            except Exception as e:
+                logger.error("Pool connection %s failed: %s", connection.index, e)
+            if loop_start:
+                connection.client.loop_start()
+
+    def reconnect(self):
+        """ Reconnect the disconnected connections (only needed without the Paho network thread) """
+
+        for connection in self._connections:
+            if not connection.connected:
+                try:
+                    connection.client.reconnect()
+                except Exception as e:
+                    logger.error("Pool connection %s reconnection failed: %s", connection.index, e)
+
+    def disconnect(self):
+        """ Disconnect all the connections of the pool """
+
+        # The devices are not moved while the pool is closing
+        self._closing = True
+        for connection in self._connections:
+            connection.client.disconnect()
+            connection.client.loop_stop()
+
+    def device_client(self, device_id):
+        """ PooledDeviceClient of a logical device, used in place of a dedicated Paho Client """
+
+        with self._lock:
+            self._assign(device_id)
+        return PooledDeviceClient(self, device_id)
+
+    def device_connection(self, device_id):
+        """ Connection currently carrying a logical device """
+
+        connection = self._assignments.get(device_id)
+        if connection is None:
+            with self._lock:
+                connection = self._assign(device_id)
+        return connection
+
+    def _owner(self, device_id):
+        index = self._ring.get_node(device_id)
+        return self._connections[index] if index is not None else None
+
+    def _assign(self, device_id):
+        """ Assign a device to its connection (any connection while none is connected, the device moves on the first connection) """
+
+        connection = self._assignments.get(device_id)
+        if connection is None:
+            connection = self._owner(device_id) or self._connections[stable_hash(device_id) % len(self._connections)]
+            self._assignments[device_id] = connection
+            connection.device_ids.add(device_id)
+        return connection
+
+    def publish(self, device_id, topic, payload=None, qos=0, retain=False):
+        """
+        Publish a message of a logical device on its connection
+        :return: Paho MQTTMessageInfo (rc MQTT_ERR_QUEUE_SIZE if the inflight window of the connection is full)
+        """
+
+        connection = self._assignments.get(device_id) or self.device_connection(device_id)
+        if not qos:
+            connection.published_count += 1
+            return connection.client.publish(topic, payload, qos, retain)
+
+        # A slot of the window is reserved before the publish and the message id recorded after it, the acknowledgement
+        # received in between is kept in early_acks
+        with self._inflight_lock:
+            if len(connection.inflight_mids) + connection.reserved_count >= self.max_inflight:
+                connection.window_full_count += 1
+                message_info = mqtt.MQTTMessageInfo(0)
+                message_info.rc = mqtt.MQTT_ERR_QUEUE_SIZE
+                return message_info
+            connection.reserved_count += 1
+
+        message_info = None
+        try:
+            message_info = connection.client.publish(topic, payload, qos, retain)
+            return message_info
+        finally:
+            with self._inflight_lock:
+                connection.reserved_count -= 1
+                if message_info is not None and message_info.rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                    connection.published_count += 1
+                    if message_info.mid in connection.early_acks:
+                        connection.early_acks.discard(message_info.mid)
+                    else:
+                        connection.inflight_mids.add(message_info.mid)
+
+                # Without publish in progress the remaining early acks are those of QoS 0 messages
+                if not connection.reserved_count:
+                    connection.early_acks.clear()
+
+    def subscribe(self, device_id, topic_filter, callback, qos=0):
+        """
+        Subscribe a logical device to a topic filter: the callback (Paho on_message signature) receives the matching
+        messages on the connection currently carrying the device
+        """
+
+        with self._lock:
+            self._subscriptions.setdefault(device_id, []).append((topic_filter, callback, qos))
+            connection = self._assign(device_id)
+            connection.client.message_callback_add(topic_filter, callback)
+            if connection.connected:
+                connection.client.subscribe(topic_filter, qos)
+
+    def _on_publish(self, client, userdata, mid):
+        connection = self._connections[userdata]
+        with self._inflight_lock:
+            if mid in connection.inflight_mids:
+                connection.inflight_mids.discard(mid)
+            elif connection.reserved_count:
+                connection.early_acks.add(mid)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        connection = self._connections[userdata]
+        if rc != 0:
+            logger.error("Pool connection %s refused with result code %s", connection.index, rc)
+            return
+
+        logger.info("Pool connection %s connected", connection.index)
+        with self._lock:
+            connection.connected = True
+            self._ring.add_node(connection.index)
+
+            # The clean session of the connection starts without subscriptions
+            for device_id in connection.device_ids:
+                for topic_filter, _, qos in self._subscriptions.get(device_id, ()):
+                    client.subscribe(topic_filter, qos)
+            self._rebalance()
+
+    def _on_disconnect(self, client, userdata, rc):
+        connection = self._connections[userdata]
+        with self._lock:
+            if not connection.connected:
+                return
+            connection.connected = False
+            self._ring.remove_node(connection.index)
+            if self._closing:
+                return
+            if rc != 0:
+                self.failover_count += 1
+                logger.warning("Pool connection %s lost (rc %s): moving %s devices", connection.index, rc, len(connection.device_ids))
+            self._rebalance()
+
+    def _rebalance(self):
+        """ Move the devices whose owner in the ring changed to their new connection, with their subscriptions """
+
+        for device_id, connection in list(self._assignments.items()):
+            owner = self._owner(device_id)
+            if owner is None or owner is connection:
+                continue
+
+            for topic_filter, callback, qos in self._subscriptions.get(device_id, ()):
+                connection.client.message_callback_remove(topic_filter)
+                if connection.connected:
+                    connection.client.unsubscribe(topic_filter)
+                owner.client.message_callback_add(topic_filter, callback)
+                owner.client.subscribe(topic_filter, qos)
+
+            connection.device_ids.discard(device_id)
+            owner.device_ids.add(device_id)
+            self._assignments[device_id] = owner
+            self.moved_device_count += 1
+
+    def connected_count(self):
+        """ Number of connected connections """
+        return sum(1 for connection in self._connections if connection.connected)
+
+    def metrics(self):
+        """ Snapshot of the pool metrics as a dictionary """
+
+        return {
+            "connections": len(self._connections),
+            "connected": self.connected_count(),
+            "devices": len(self._assignments),
+            "failovers": self.failover_count,
+            "moved_devices": self.moved_device_count,
+            "per_connection": [{
+                "connected": connection.connected,
+                "devices": len(connection.device_ids),
+                "inflight": len(connection.inflight_mids),
+                "published": connection.published_count,
+                "window_full": connection.window_full_count
+            } for connection in self._connections]
+        }
@@ -0,0 +1,76 @@
+import bisect
+import hashlib
+
+
+def stable_hash(key):
+    """ 64 bit hash of a string, stable across processes and runs (the builtin hash() of str is salted per process) """
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """ Consistent hashing ring mapping keys (e.g. device ids) to nodes (e.g. worker indexes).
+    Each node is placed on the ring with several virtual nodes, so adding or removing a node only moves
+    about 1/N of the keys and the keys are evenly spread across the nodes """
+
+    def __init__(self, nodes=(), virtual_nodes=64):
+        """
+        Constructor for ConsistentHashRing class
+        :param nodes: Initial nodes of the ring
+        :param virtual_nodes: Number of points of each node on the ring
+        """
+
+        self.virtual_nodes = virtual_nodes
+        self._nodes = set()
+        self._hashes = []
+        self._owners = []
+
+        # Key -> node cache (cleared when the ring changes)
+        self._cache = {}
+
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        """ Add a node to the ring """
+
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for replica in range(self.virtual_nodes):
+            point = stable_hash(f"{node}#{replica}")
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._owners.insert(index, node)
+        self._cache.clear()
+
+    def remove_node(self, node):
+        """ Remove a node from the ring """
+
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        points = [(point, owner) for point, owner in zip(self._hashes, self._owners) if owner != node]
+        self._hashes = [point for point, _ in points]
+        self._owners = [owner for _, owner in points]
+        self._cache.clear()
+
+    def nodes(self):
+        return sorted(self._nodes)
+
+    def get_node(self, key):
+        """ Node owning a key (None if the ring is empty) """
+
+        node = self._cache.get(key)
+        if node is not None:
+            return node
+        if not self._hashes:
+            return None
+
+        # First point clockwise from the hash of the key
+        index = bisect.bisect(self._hashes, stable_hash(key))
+        if index == len(self._hashes):
+            index = 0
+        node = self._owners[index]
+
+        self._cache[key] = node
+        return node
@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dto.device_descriptor import DeviceDescriptor
+from dto.json_serializer import encode_json
+from utils.logger import get_logger, INFO
+
+logger = get_logger(INFO)
+
+
+class DeviceRegistry:
+    """ In memory cache of the DeviceDescriptor of each known device, populated from the retained device/+/info messages.
+    The devices are indexed by device_id, producer and software_version. The last seen timestamps are kept in an
+    OrderedDict from the least to the most recently seen device, so a TTL eviction only visits the expired devices.
+    An optional JSON snapshot warms up a restarted consumer before the broker delivers the retained messages again """
+
+    def __init__(self, ttl_sec=None, snapshot_path=None):
+        """
+        Constructor for DeviceRegistry class
+        :param ttl_sec: Seconds without messages after which a device is evicted (None to keep the devices forever)
+        :param snapshot_path: JSON file used by save_snapshot() and load_snapshot() (None to disable the snapshots)
+        """
+
+        self.ttl_sec = ttl_sec
+        self.snapshot_path = snapshot_path
+
+        # device_id -> DeviceDescriptor
+        self._devices = {}
+
+        # producer -> set of device ids, software_version -> set of device ids
+        self._by_producer = {}
+        self._by_software_version = {}
+
+        # device_id -> last seen time (time.time()), ordered from the least to the most recently seen device
+        self._last_seen = OrderedDict()
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Metrics of the registry
+        self.updated_count = 0
+        self.evicted_count = 0
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
+
+    def update(self, device_descriptor, seen_at=None):
+        """
+        Add or update the descriptor of a device
+        :param device_descriptor: DeviceDescriptor received on the device info topic
+        :param seen_at: Time of the message (time.time() by default)
+        :return: True if the device is new or its descriptor changed
+        """
+
+        device_id = device_descriptor.device_id
+        with self._lock:
+            previous = self._devices.get(device_id)
+            if previous != device_descriptor:
+                if previous is not None:
+                    self._unindex(previous)
+                self._devices[device_id] = device_descriptor
+                self._by_producer.setdefault(device_descriptor.producer, set()).add(device_id)
+                self._by_software_version.setdefault(device_descriptor.software_version, set()).add(device_id)
+                self.updated_count += 1
+            self._touch(device_id, seen_at)
+
+        return previous != device_descriptor
+
+    def touch(self, device_id, seen_at=None):
+        """
+        Update the last seen time of a known device (e.g. on each telemetry message)
+        :return: True if the device is known
+        """
+
+        with self._lock:
+            if device_id not in self._devices:
+                return False
+            self._touch(device_id, seen_at)
+        return True
+
+    def _touch(self, device_id, seen_at):
+        self._last_seen[device_id] = time.time() if seen_at is None else seen_at
+        self._last_seen.move_to_end(device_id)
+
+    def _unindex(self, device_descriptor):
+        for index, key in ((self._by_producer, device_descriptor.producer),
+                           (self._by_software_version, device_descriptor.software_version)):
+            device_ids = index.get(key)
+            if device_ids is not None:
+                device_ids.discard(device_descriptor.device_id)
+                if not device_ids:
+                    del index[key]
+
+    def remove(self, device_id):
+        """ Remove a device (e.g. on an empty retained info message). Return the removed descriptor or None """
+
+        with self._lock:
+            device_descriptor = self._devices.pop(device_id, None)
+            if device_descriptor is not None:
+                self._unindex(device_descriptor)
+                self._last_seen.pop(device_id, None)
+        return device_descriptor
+
+    def get(self, device_id):
+        """ DeviceDescriptor of a device (None if unknown) """
+        return self._devices.get(device_id)
+
+    def last_seen(self, device_id):
+        """ Last seen time of a device (None if unknown) """
+        return self._last_seen.get(device_id)
+
+    def device_ids(self):
+        return list(self._devices)
+
+    def by_producer(self, producer):
+        """ DeviceDescriptors of the devices of a producer """
+
+        with self._lock:
+            return [self._devices[device_id] for device_id in self._by_producer.get(producer, ())]
+
+    def by_software_version(self, software_version):
+        """ DeviceDescriptors of the devices running a software version """
+
+        with self._lock:
+            return [self._devices[device_id] for device_id in self._by_software_version.get(software_version, ())]
+
+    def evict_expired(self, now=None):
+        """
+        Remove the devices not seen for more than ttl_sec
+        :return: List of the evicted device ids
+        """
+
+        if self.ttl_sec is None:
+            return []
+
+        oldest_allowed = (time.time() if now is None else now) - self.ttl_sec
+        evicted = []
+        with self._lock:
+            while self._last_seen:
+                device_id, seen_at = next(iter(self._last_seen.items()))
+                if seen_at > oldest_allowed:
+                    break
+                self._last_seen.popitem(last=False)
+                self._unindex(self._devices.pop(device_id))
+                evicted.append(device_id)
+            self.evicted_count += len(evicted)
+
+        return evicted
+
+    def save_snapshot(self, path=None):
+        """ Write the devices and their last seen times to the snapshot file (atomically replaced) """
+
+        path = path or self.snapshot_path
+        if not path:
+            return
+
+        with self._lock:
+            devices = [{"device_id": device_id, "producer": device_descriptor.producer,
+                        "software_version": device_descriptor.software_version, "last_seen": self._last_seen.get(device_id)}
+                       for device_id, device_descriptor in self._devices.items()]
+
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as snapshot_file:
+            snapshot_file.write(encode_json({"devices": devices}))
+        os.replace(temporary_path, path)
+
+    def load_snapshot(self, path=None):
+        """
+        Load the devices of the snapshot file before the connection (the devices already known are not replaced)
+        :return: Number of loaded devices
+        """
+
+        path = path or self.snapshot_path
+        if not path or not os.path.exists(path):
+            return 0
+
+        with open(path) as snapshot_file:
+            devices = json.load(snapshot_file)["devices"]
+
+        # Insert the devices from the least to the most recently seen one to keep the eviction order
+        loaded_count = 0
+        for device in sorted(devices, key=lambda entry: entry["last_seen"] or 0.0):
+            if device["device_id"] in self._devices:
+                continue
+            self.update(DeviceDescriptor(device["device_id"], device["producer"], device["software_version"]), device["last_seen"])
+            loaded_count += 1
+
+        return loaded_count
+
+    def start(self, interval_sec):
+        """ Start a thread evicting the expired devices and saving the snapshot every interval_sec """
+
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._maintenance_loop, args=(interval_sec,), name="DeviceRegistry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the maintenance thread and save a last snapshot """
+
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.save_snapshot()
+
+    def _maintenance_loop(self, interval_sec):
+        while not self._stop_event.wait(interval_sec):
+            try:
+                evicted = self.evict_expired()
+                if evicted:
+                    logger.info("Device Registry: evicted %s stale devices: %s", len(evicted), evicted)
+                self.save_snapshot()
+            except Exception as e:
+                logger.error("Device Registry maintenance error: %s", e)
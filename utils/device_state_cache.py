@@ -0,0 +1,127 @@
+import threading
+import time
+
+
+class _PropertyState:
+    """ Desired and reported value of a property of a device (e.g. the SWITCH of device001) """
+
+    __slots__ = ("desired", "reported", "reported_at", "sequence", "sent_at")
+
+    def __init__(self):
+        self.desired = None
+        self.reported = None
+        self.reported_at = None
+        self.sequence = None
+        self.sent_at = None
+
+
+class DeviceStateCache:
+    """ Per device cache of the desired state (requested by the rules of the controller) and of the reported state
+    (received from the device telemetry) of each property. An action is published only when the desired state
+    differs from the reported state: the same request repeated by a sustained alarm is suppressed, and an action not
+    applied by the device is sent again only after resend_interval_sec.
+    Each published action gets a sequence number increasing for each device, so the devices can drop the stale or
+    replayed actions. The sequence starts from the current time in milliseconds, so it keeps increasing after a
+    restart of the controller """
+
+    def __init__(self, resend_interval_sec=5.0):
+        """
+        Constructor for DeviceStateCache class
+        :param resend_interval_sec: Seconds before sending again an action not yet reported by the device
+        """
+
+        self.resend_interval_sec = resend_interval_sec
+
+        # (device_id, property_name) -> _PropertyState
+        self._states = {}
+
+        # device_id -> last sequence number
+        self._sequences = {}
+
+        self._lock = threading.Lock()
+
+        # Metrics of the cache
+        self.requested_count = 0
+        self.published_count = 0
+        self.suppressed_count = 0
+
+    def _state(self, device_id, property_name):
+        key = (device_id, property_name)
+        state = self._states.get(key)
+        if state is None:
+            state = _PropertyState()
+            self._states[key] = state
+        return state
+
+    def report(self, device_id, property_name, value, reported_at=None):
+        """ Update the reported value of a property (e.g. from the device/<device_id>/telemetry/switch messages) """
+
+        with self._lock:
+            state = self._state(device_id, property_name)
+            state.reported = value
+            state.reported_at = time.time() if reported_at is None else reported_at
+
+    def request(self, device_id, property_name, value):
+        """
+        Set the desired value of a property
+        :return: Sequence number of the action to publish, None if no action is required
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self.requested_count += 1
+            state = self._state(device_id, property_name)
+
+            # An action is in flight until the device reports its value or until the resend interval expires
+            in_flight = state.sent_at is not None and state.desired != state.reported and \
+                now - state.sent_at < self.resend_interval_sec
+
+            # Nothing to do if the same action is in flight or if the device already reports the value
+            # (unless an opposite action in flight is going to change it)
+            if (state.desired == value and in_flight) or (state.reported == value and not in_flight):
+                state.desired = value
+                self.suppressed_count += 1
+                return None
+
+            sequence = max(self._sequences.get(device_id, 0) + 1, int(time.time() * 1000))
+            self._sequences[device_id] = sequence
+            state.desired = value
+            state.sequence = sequence
+            state.sent_at = now
+            self.published_count += 1
+            return sequence
+
+    def desired(self, device_id, property_name):
+        """ Desired value of a property (None if never requested) """
+
+        state = self._states.get((device_id, property_name))
+        return state.desired if state is not None else None
+
+    def reported(self, device_id, property_name):
+        """ Reported value of a property (None if never reported) """
+
+        state = self._states.get((device_id, property_name))
+        return state.reported if state is not None else None
+
+    def in_sync(self, device_id, property_name):
+        """ True if the device reports the desired value (or if no value has been requested) """
+
+        state = self._states.get((device_id, property_name))
+        return state is None or state.desired is None or state.desired == state.reported
+
+    def remove_device(self, device_id):
+        """ Remove all the states of a device """
+
+        with self._lock:
+            for key in [key for key in self._states if key[0] == device_id]:
+                del self._states[key]
+
+    def metrics(self):
+        """ Snapshot of the cache metrics as a dictionary """
+
+        return {
+            "devices": len({key[0] for key in self._states}),
+            "requested": self.requested_count,
+            "published": self.published_count,
+            "suppressed": self.suppressed_count
+        }
@@ -0,0 +1,306 @@
+# Asynchronous logging of the scripts. The scripts get the logger of their categories at import time with get_logger(),
+# and their main block calls configure_logging() with two configuration variables of each script:
+# - telemetry_log_sample_rate: 1 in N telemetry records is logged (actions, events, warnings and errors are always logged)
+# - log_json_lines: write a JSON object for each record instead of the text format
+# Nothing is started before configure_logging(): importing a script or a module does not create the writer thread nor
+# change the handlers, and until then the records go to the standard logging (warnings and errors on stderr)
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+# Parent logger of all the categories (e.g. iot.telemetry, iot.action)
+LOGGER_PREFIX = "iot"
+
+# Categories used by the producer and consumer scripts
+CONNECTION = "connection"
+TELEMETRY = "telemetry"
+INFO = "info"
+EVENT = "event"
+ACTION = "action"
+METRICS = "metrics"
+
+# Text format used when configure_logging() is called without log_format (e.g. set by the runner to prefix the
+# records of each instance)
+default_log_format = "%(message)s"
+
+# Asynchronous writer of the current configuration (None until the first configuration)
+_queue_handler = None
+_listener = None
+_configured_loggers = []
+_lock = threading.RLock()
+
+
+class CategoryLogger(logging.Logger):
+    """ Logger of a category sampling the records below WARNING before they are created: a sampled out
+    message costs a counter increment instead of the creation of a LogRecord.
+    The file and line of the caller are found only when caller_info is set (a stack walk for each record) """
+
+    sample_rate = 1
+    caller_info = False
+    _sample_counter = None
+
+    def set_sample_rate(self, sample_rate):
+        self.sample_rate = sample_rate
+        self._sample_counter = itertools.count() if sample_rate > 1 else None
+
+    def _sampled(self):
+        counter = self._sample_counter
+        return counter is None or next(counter) % self.sample_rate == 0
+
+    def debug(self, msg, *args, **kwargs):
+        if self.isEnabledFor(logging.DEBUG) and self._sampled():
+            self._log(logging.DEBUG, msg, args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self.isEnabledFor(logging.INFO) and self._sampled():
+            self._log(logging.INFO, msg, args, **kwargs)
+
+    def findCaller(self, stack_info=False, stacklevel=1):
+        if not (CategoryLogger.caller_info or stack_info):
+            return "(unknown file)", 0, "(unknown function)", None
+
+        # First frame outside the logging modules (the standard lookup does not skip the debug() and info() of this class)
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_filename in _LOGGING_FILES:
+            frame = frame.f_back
+        while frame is not None and stacklevel > 1:
+            frame = frame.f_back
+            stacklevel -= 1
+        if frame is None:
+            return "(unknown file)", 0, "(unknown function)", None
+
+        stack = "Stack (most recent call last):\n" + "".join(traceback.format_stack(frame)).rstrip("\n") if stack_info else None
+        return frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name, stack
+
+
+# Source files of the logging frames skipped by the caller lookup
+_LOGGING_FILES = (logging.Logger.findCaller.__code__.co_filename, CategoryLogger.findCaller.__code__.co_filename)
+
+
+class SamplingFilter(logging.Filter):
+    """ Keep 1 record in N of a standard logger. Warnings and errors are never sampled """
+
+    def __init__(self, sample_rate):
+        """
+        Constructor for SamplingFilter class
+        :param sample_rate: N (1 to keep all the records)
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self._counter) % self.sample_rate == 0
+
+
+class RateLimitFilter(logging.Filter):
+    """ Token bucket limiting the records per second of a category. Warnings and errors are never limited,
+    and the first record after a suppression reports the number of suppressed records """
+
+    def __init__(self, max_per_sec, burst=None):
+        """
+        Constructor for RateLimitFilter class
+        :param max_per_sec: Max records per second on average
+        :param burst: Max records in a burst (max_per_sec by default)
+        """
+        super().__init__()
+        self.max_per_sec = max_per_sec
+        self.burst = burst or max_per_sec
+        self._tokens = float(self.burst)
+        self._last_time = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_time) * self.max_per_sec)
+            self._last_time = now
+            if self._tokens < 1.0:
+                self._suppressed += 1
+                return False
+            self._tokens -= 1.0
+            suppressed, self._suppressed = self._suppressed, 0
+
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """ Format each record as a JSON object on a single line. The extra fields passed as
+    logger.info(..., extra={"fields": {...}}) are added to the object """
+
+    def format(self, record):
+        category = record.name[len(LOGGER_PREFIX) + 1:] if record.name.startswith(LOGGER_PREFIX + ".") else record.name
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "category": category,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler moving the formatting and the I/O of the records to the writer thread.
+    Unlike the standard QueueHandler the message is not formatted on the caller thread (the %-style arguments
+    are formatted lazily by the writer, so they must not be modified after the call), and the records are
+    dropped instead of blocking when the queue is full """
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped_count = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_count += 1
+
+
+def configure_logging(level="INFO", json_lines=False, stream=None, filename=None, log_format=None,
+                      sample_rates=None, rate_limits=None, category_levels=None, queue_size=10000, caller_info=False):
+    """
+    Configure the asynchronous logging of all the categories (a previous configuration is replaced)
+    :param level: Default level of all the categories
+    :param json_lines: Write a JSON object for each record instead of the log_format text
+    :param stream: Output stream (sys.stdout by default)
+    :param filename: Output file (instead of the stream)
+    :param log_format: Format of the text records (default_log_format by default)
+    :param sample_rates: Category -> N to log 1 record in N (e.g. {"telemetry": 100})
+    :param rate_limits: Category -> max records per second (e.g. {"telemetry": 50})
+    :param category_levels: Category -> level switch (e.g. {"telemetry": "WARNING"} to disable the telemetry records)
+    :param queue_size: Max number of records waiting for the writer thread
+    :param caller_info: Find the file and line of each call (%(pathname)s, %(lineno)d, ...), a stack walk for each record
+    """
+
+    global _queue_handler, _listener
+
+    with _lock:
+        shutdown_logging()
+
+        # No caller information unless the format requires it (only for the category loggers, the standard ones are untouched)
+        CategoryLogger.caller_info = caller_info
+
+        if filename:
+            output_handler = logging.FileHandler(filename)
+        else:
+            output_handler = logging.StreamHandler(stream or sys.stdout)
+        output_handler.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(log_format or default_log_format))
+
+        _queue_handler = AsyncQueueHandler(queue.Queue(queue_size))
+        root_logger = logging.getLogger(LOGGER_PREFIX)
+        for handler in list(root_logger.handlers):
+            root_logger.removeHandler(handler)
+        root_logger.addHandler(_queue_handler)
+        root_logger.setLevel(level)
+        root_logger.propagate = False
+
+        # Reset the filters and the levels of the previous configuration
+        for category_logger in _configured_loggers:
+            for category_filter in list(category_logger.filters):
+                category_logger.removeFilter(category_filter)
+            category_logger.setLevel(logging.NOTSET)
+            if isinstance(category_logger, CategoryLogger):
+                category_logger.set_sample_rate(1)
+        _configured_loggers.clear()
+
+        for category, sample_rate in (sample_rates or {}).items():
+            if sample_rate > 1:
+                category_logger = _configure_logger(category)
+                if isinstance(category_logger, CategoryLogger):
+                    category_logger.set_sample_rate(sample_rate)
+                else:
+                    category_logger.addFilter(SamplingFilter(sample_rate))
+        for category, max_per_sec in (rate_limits or {}).items():
+            if max_per_sec:
+                _configure_logger(category).addFilter(RateLimitFilter(max_per_sec))
+        for category, category_level in (category_levels or {}).items():
+            _configure_logger(category).setLevel(category_level)
+
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, output_handler)
+        _listener.start()
+
+
+def _configure_logger(category):
+    category_logger = get_logger(category)
+    if category_logger not in _configured_loggers:
+        _configured_loggers.append(category_logger)
+    return category_logger
+
+
+def shutdown_logging():
+    """ Write the queued records and stop the writer thread """
+
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def _restart_after_fork():
+    """ The writer thread does not survive a fork: the child process gets its own queue and writer """
+
+    global _listener, _lock
+
+    _lock = threading.RLock()
+    if _listener is not None:
+        _queue_handler.queue = queue.Queue(_queue_handler.queue.maxsize)
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, *_listener.handlers)
+        _listener.start()
+
+
+def get_logger(category):
+    """
+    Logger of a category. The messages should use the lazy %-style formatting, e.g.
+    get_logger("telemetry").info("Message Sent: Topic: %s Payload: %s", topic, payload)
+    :param category: Category of the records (e.g. "telemetry", "action", "event")
+    """
+
+    # The CategoryLogger class is used only for the loggers of the categories
+    with _lock:
+        logger_class = logging.getLoggerClass()
+        logging.setLoggerClass(CategoryLogger)
+        try:
+            return logging.getLogger(f"{LOGGER_PREFIX}.{category}")
+        finally:
+            logging.setLoggerClass(logger_class)
+
+
+def logging_metrics():
+    """ Snapshot of the writer queue metrics as a dictionary """
+
+    if _queue_handler is None:
+        return {"queue_depth": 0, "dropped": 0}
+    return {"queue_depth": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped_count}
+
+
+atexit.register(shutdown_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
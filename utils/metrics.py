@@ -0,0 +1,502 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paho.mqtt.client as mqtt
+
+from utils.logger import get_logger, METRICS
+
+logger = get_logger(METRICS)
+
+# Content type of the OpenMetrics text exposition format
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Upper bounds (seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Topic classes of the messages: the topic filter matched by a topic is its label (bounded cardinality), "other" if none matches
+DEFAULT_TOPIC_CLASSES = ("device/+/info", "device/+/telemetry/#", "device/+/sensor/#", "device/+/event/#", "device/+/action/#")
+OTHER_TOPIC_CLASS = "other"
+
+
+def _escape(label_value):
+    return str(label_value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        if value in (float("inf"), float("-inf")):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(int(value))
+
+
+class _ShardedMetric:
+    """ Metric whose values are sharded per thread: each thread updates its own dictionary without any lock
+    (the GIL makes the single dictionary operations atomic) and the shards are merged only by the scrape """
+
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _new_shard(self):
+        shard = {}
+        self._local.shard = shard
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def _merged_shards(self):
+        """ Label values -> list of the shard values (the dictionary copies are atomic, so no update is lost) """
+
+        merged = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for label_values, value in list(shard.items()):
+                merged.setdefault(label_values, []).append(value)
+        return merged
+
+
+class Counter(_ShardedMetric):
+    """ Monotonic counter (e.g. messages, bytes, errors), exposed with the _total suffix """
+
+    metric_type = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._functions = []
+
+    def add_function(self, function):
+        """ Add the totals returned by a function (label values tuple -> number) at each scrape, for the hot paths
+        keeping their own counts (e.g. the per topic counts of MqttClientMetrics) """
+        self._functions.append(function)
+
+    def inc(self, label_values=(), value=1):
+        """ Increment the counter of a label values tuple (same order of the label names) """
+
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[label_values] = shard.get(label_values, 0) + value
+
+    def values(self):
+        """ Label values -> total of all the threads """
+
+        totals = {label_values: sum(values) for label_values, values in self._merged_shards().items()}
+        for function in self._functions:
+            for label_values, value in function().items():
+                totals[label_values] = totals.get(label_values, 0) + value
+        return totals
+
+    def samples(self):
+        for label_values, value in sorted(self.values().items()):
+            yield f"{self.name}_total{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+
+
+class Histogram(_ShardedMetric):
+    """ Histogram with fixed buckets (e.g. latencies): each shard keeps the bucket counts and the sum of the observations """
+
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def observe(self, value, label_values=()):
+        """ Add an observation to the histogram of a label values tuple """
+
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        state = shard.get(label_values)
+        if state is None:
+            # Bucket counts, +Inf bucket count, sum
+            state = [0] * (len(self.upper_bounds) + 1) + [0.0]
+            shard[label_values] = state
+        state[bisect.bisect_left(self.upper_bounds, value)] += 1
+        state[-1] += value
+
+    def values(self):
+        """ Label values -> (non cumulative bucket counts, sum) of all the threads """
+
+        merged = {}
+        for label_values, states in self._merged_shards().items():
+            counts = [sum(state[index] for state in states) for index in range(len(self.upper_bounds) + 1)]
+            merged[label_values] = (counts, sum(state[-1] for state in states))
+        return merged
+
+    def samples(self):
+        for label_values, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.upper_bounds + (float("inf"),), counts):
+                cumulative += count
+                le_label = 'le="+Inf"' if upper_bound == float("inf") else f'le="{float(upper_bound)!r}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, label_values, le_label)} {cumulative}"
+            yield f"{self.name}_count{_format_labels(self.label_names, label_values)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, label_values)} {_format_value(float(total))}"
+
+
+class Gauge:
+    """ Gauge read from functions at each scrape (e.g. a queue depth), each function returns a number or a
+    dictionary label values tuple -> number """
+
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, function, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._functions = [function]
+
+    def add_function(self, function):
+        """ Add the values of another function (e.g. another instrumented client) """
+        self._functions.append(function)
+
+    def samples(self):
+        merged = {}
+        for function in self._functions:
+            values = function()
+            merged.update(values if isinstance(values, dict) else {(): values})
+        for label_values, value in sorted(merged.items()):
+            if value is not None:
+                yield f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """ Registry of the metrics of a process, rendered in the OpenMetrics text format.
+    Registering a metric with the name of an existing one returns the existing metric, so the instrumented clients
+    of a process share the same metric families (with different label values) """
+
+    def __init__(self):
+        """ Constructor for MetricsRegistry class """
+
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric {name} already registered as a {metric.metric_type}")
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help_text, label_names, buckets)
+
+    def gauge(self, name, help_text, function, label_names=()):
+        """ Register a gauge, or add the function to the existing gauge with the same name """
+
+        with self._lock:
+            metric = self._metrics.get(name)
+            if isinstance(metric, Gauge):
+                metric.add_function(function)
+                return metric
+        return self._register(Gauge, name, help_text, function, label_names)
+
+    def add_collector(self, prefix, metrics_function):
+        """
+        Expose the numeric entries of a metrics() dictionary (e.g. WorkDispatcher.metrics) as gauges <prefix>_<key>
+        :param prefix: Prefix of the gauge names
+        :param metrics_function: Function returning the metrics dictionary (called at each scrape)
+        """
+
+        for key, value in metrics_function().items():
+            if isinstance(value, (int, float)):
+                self.gauge(f"{prefix}_{key}", f"{key} of {prefix}",
+                           lambda key=key: metrics_function().get(key))
+
+    def render(self):
+        """ Text of all the metrics in the OpenMetrics format """
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                logger.error("Error collecting metric %s: %s", metric.name, e)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+# Default registry of the process
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0", registry=REGISTRY):
+    """
+    Serve the metrics of a registry on http://<host>:<port>/metrics from a daemon thread
+    :return: ThreadingHTTPServer (call shutdown() to stop it)
+    """
+
+    handler_class = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    logger.info("Metrics endpoint: http://%s:%s/metrics", host, port)
+    return server
+
+
+class MqttClientMetrics:
+    """ Instrumentation of a MQTT Paho Client: messages and bytes published and received per topic class,
+    QoS > 0 messages in flight, publish to acknowledgement latency, on_message handler latency, parse errors,
+    connections and reconnections. The hooks wrap the client publish method and its on_connect, on_disconnect,
+    on_publish and on_message callbacks.
+    The hot path only increments the [messages, bytes] list of the raw topic in a dictionary of the current thread:
+    the topics are grouped in topic classes by the scrape, and the handler latency is timed for 1 message in
+    handler_latency_sample_rate (the _count of the histogram is the number of timed messages) """
+
+    # Max acknowledgements received before the publish call returned (mid -> time) kept for the latency
+    _MAX_EARLY_ACKS = 1024
+
+    def __init__(self, client_name, registry=REGISTRY, topic_classes=DEFAULT_TOPIC_CLASSES, handler_latency_sample_rate=10):
+        """
+        Constructor for MqttClientMetrics class
+        :param client_name: Value of the "client" label of the metrics (e.g. the client id)
+        :param registry: MetricsRegistry of the metrics
+        :param topic_classes: Topic filters used as "topic_class" label, in matching order
+        :param handler_latency_sample_rate: 1 in N received messages has its handler timed
+        """
+
+        self.client_name = client_name
+        self.topic_classes = tuple(topic_classes)
+        self.handler_latency_sample_rate = max(1, handler_latency_sample_rate)
+
+        # Per thread topic -> [messages, bytes] dictionaries of the published and received messages
+        self._local = threading.local()
+        self._published_shards = []
+        self._received_shards = []
+        self._lock = threading.Lock()
+
+        # Topic -> topic class cache (the topics of the devices are a bounded set)
+        self._topic_class_cache = {}
+
+        # mid -> (publish time, topic) of the QoS > 0 messages in flight, the acknowledgements received while a QoS > 0
+        # publish call is in progress (before its mid is recorded) and the number of these calls
+        self._pending = {}
+        self._early_acks = {}
+        self._publishing_count = 0
+        self._ack_lock = threading.Lock()
+        self._connected_once = False
+
+        labels = ("client", "topic_class")
+        registry.counter("mqtt_messages_published", "MQTT messages published", labels).add_function(
+            lambda: self._class_totals(self._published_shards, 0))
+        registry.counter("mqtt_published_bytes", "Payload bytes published", labels).add_function(
+            lambda: self._class_totals(self._published_shards, 1))
+        registry.counter("mqtt_messages_received", "MQTT messages received", labels).add_function(
+            lambda: self._class_totals(self._received_shards, 0))
+        registry.counter("mqtt_received_bytes", "Payload bytes received", labels).add_function(
+            lambda: self._class_totals(self._received_shards, 1))
+        registry.gauge("mqtt_inflight_messages", "QoS > 0 messages waiting for the acknowledgement",
+                       lambda: {(client_name,): len(self._pending)}, ("client",))
+
+        self.parse_errors = registry.counter("mqtt_parse_errors", "Received messages whose handler failed (e.g. invalid payloads)", labels)
+        self.connections = registry.counter("mqtt_connections", "CONNACK received by result code", ("client", "result"))
+        self.reconnections = registry.counter("mqtt_reconnections", "Successful connections after the first one", ("client",))
+        self.disconnections = registry.counter("mqtt_disconnections", "Unexpected disconnections", ("client",))
+        self.ack_latency = registry.histogram("mqtt_publish_ack_latency_seconds", "Latency from the publish call to the QoS > 0 acknowledgement", labels)
+        self.handler_latency = registry.histogram("mqtt_handler_latency_seconds", "Duration of the sampled on_message handlers", labels)
+
+    def topic_class(self, topic):
+        """ Topic filter of the topic classes matched by a topic (OTHER_TOPIC_CLASS if none matches) """
+
+        topic_class = self._topic_class_cache.get(topic)
+        if topic_class is None:
+            topic_class = next((topic_filter for topic_filter in self.topic_classes if mqtt.topic_matches_sub(topic_filter, topic)),
+                               OTHER_TOPIC_CLASS)
+            self._topic_class_cache[topic] = topic_class
+        return topic_class
+
+    def _labels(self, topic):
+        return self.client_name, self.topic_class(topic)
+
+    def _shards(self):
+        """ (published, received) topic dictionaries of the current thread """
+
+        try:
+            return self._local.shards
+        except AttributeError:
+            shards = ({}, {})
+            self._local.shards = shards
+            with self._lock:
+                self._published_shards.append(shards[0])
+                self._received_shards.append(shards[1])
+            return shards
+
+    def _class_totals(self, shards, index):
+        """ Totals of the messages (index 0) or bytes (index 1) of the thread shards grouped by topic class """
+
+        totals = {}
+        with self._lock:
+            shards = list(shards)
+        for shard in shards:
+            for topic, stats in list(shard.items()):
+                label_values = self._labels(topic)
+                totals[label_values] = totals.get(label_values, 0) + stats[index]
+        return totals
+
+    def parse_error(self, topic):
+        """ Count a received message whose handler failed (called by the except blocks of the message handlers) """
+        self.parse_errors.inc(self._labels(topic))
+
+    def instrument(self, client):
+        """
+        Attach the metrics hooks to a client. It must be called after setting the client callbacks (they are wrapped)
+        :param client: MQTT Paho Client
+        :return: The instrumented client
+        """
+
+        client_publish = client.publish
+        user_on_connect = client.on_connect
+        user_on_disconnect = client.on_disconnect
+        user_on_publish = client.on_publish
+        user_on_message = client.on_message
+        client_name = self.client_name
+        sample_rate = self.handler_latency_sample_rate
+        pending = self._pending
+        early_acks = self._early_acks
+        ack_lock = self._ack_lock
+        perf_counter = time.perf_counter
+        local = self._local
+
+        def publish(topic, payload=None, qos=0, retain=False, properties=None):
+            publish_time = perf_counter()
+            if not qos:
+                message_info = client_publish(topic, payload, qos, retain, properties)
+            else:
+                # The acknowledgement can be processed by the network thread before publish() returns: it is kept in
+                # early_acks while the call is in progress (the lock is not held by the call, Paho acknowledges under
+                # its message mutex)
+                with ack_lock:
+                    self._publishing_count += 1
+                message_info = None
+                try:
+                    message_info = client_publish(topic, payload, qos, retain, properties)
+                finally:
+                    ack_time = None
+                    with ack_lock:
+                        self._publishing_count -= 1
+                        if message_info is not None and message_info.rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                            ack_time = early_acks.pop(message_info.mid, None)
+                            if ack_time is None:
+                                pending[message_info.mid] = (publish_time, topic)
+                        if not self._publishing_count:
+                            early_acks.clear()
+                    if ack_time is not None:
+                        self.ack_latency.observe(max(0.0, ack_time - publish_time), self._labels(topic))
+            if message_info.rc == mqtt.MQTT_ERR_SUCCESS or (qos and message_info.rc == mqtt.MQTT_ERR_NO_CONN):
+                try:
+                    published = local.shards[0]
+                except AttributeError:
+                    published = self._shards()[0]
+                stats = published.get(topic)
+                if stats is None:
+                    stats = published[topic] = [0, 0]
+                stats[0] += 1
+                if payload is not None:
+                    stats[1] += len(payload)
+            return message_info
+
+        def on_publish(client, userdata, mid):
+            ack_time = perf_counter()
+            with ack_lock:
+                entry = pending.pop(mid, None)
+
+                # Without QoS > 0 publish call in progress the mid is the one of a QoS 0 message
+                if entry is None and self._publishing_count and len(early_acks) < self._MAX_EARLY_ACKS:
+                    early_acks[mid] = ack_time
+            if entry is not None:
+                self.ack_latency.observe(ack_time - entry[0], self._labels(entry[1]))
+            if user_on_publish is not None:
+                user_on_publish(client, userdata, mid)
+
+        def on_message(client, userdata, message):
+            try:
+                received = local.shards[1]
+            except AttributeError:
+                received = self._shards()[1]
+            topic = message.topic
+            stats = received.get(topic)
+            if stats is None:
+                stats = received[topic] = [0, 0]
+            stats[0] += 1
+            stats[1] += len(message.payload)
+            if user_on_message is not None:
+                if stats[0] % sample_rate:
+                    user_on_message(client, userdata, message)
+                else:
+                    start_time = perf_counter()
+                    user_on_message(client, userdata, message)
+                    self.handler_latency.observe(perf_counter() - start_time, self._labels(topic))
+
+        def on_connect(client, userdata, flags, rc, *args):
+            self.connections.inc((client_name, str(rc)))
+            if rc == 0:
+                if self._connected_once:
+                    self.reconnections.inc((client_name,))
+                self._connected_once = True
+            if user_on_connect is not None:
+                user_on_connect(client, userdata, flags, rc, *args)
+
+        def on_disconnect(client, userdata, rc, *args):
+            if rc != 0:
+                self.disconnections.inc((client_name,))
+            if user_on_disconnect is not None:
+                user_on_disconnect(client, userdata, rc, *args)
+
+        client.publish = publish
+        client.on_publish = on_publish
+        client.on_message = on_message
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        return client
@@ -0,0 +1,213 @@
+import threading
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.subscribeoptions import SubscribeOptions
+
+from dto.payload_codec import JSON_CODEC, codec_for_topic
+from utils.logger import get_logger, CONNECTION
+
+logger = get_logger(CONNECTION)
+
+
+def create_client(client_id, mqtt_v5=False):
+    """
+    Create a Paho Client of the MQTT 3.1.1 protocol (default) or of the MQTT v5 protocol
+    (the MQTT v5 clients have no clean_session flag, the session starts clean by default)
+    """
+
+    if mqtt_v5:
+        return mqtt.Client(client_id, protocol=mqtt.MQTTv5)
+    return mqtt.Client(client_id)
+
+
+class Mqtt5Session:
+    """ MQTT v5 features of a Paho Client, attached without changing the publish calls and the callbacks of the scripts:
+    - Topic aliases: the first QoS 0 message of a topic registers an alias, the next ones are sent with an empty topic
+      (the aliases are limited by the Topic Alias Maximum of the broker and reset on each connection)
+    - Message expiry: the broker drops the messages not delivered within the expiry interval of their topic filter
+    - Content type: the non JSON payloads carry the content type of their codec (JSON is the default of the consumers,
+      so the JSON messages carry no property), plus the optional user properties of the client
+    - Subscription identifiers: each subscription gets an identifier and the received messages are dispatched to the
+      handler of their subscription without matching the topic filters
+    The properties of each topic are built once and reused for all its messages """
+
+    # Max topics whose properties are kept in the cache
+    _MAX_TOPICS = 10000
+
+    def __init__(self, message_expiry=None, max_topic_aliases=100, user_properties=None):
+        """
+        Constructor for Mqtt5Session class
+        :param message_expiry: List of (topic_filter, expiry_sec) of the published messages (the first match wins)
+        :param max_topic_aliases: Max topic aliases used by the client (the broker limit applies too, 0 to disable them)
+        :param user_properties: Optional list of (name, value) user properties added to all the published messages
+        """
+
+        self.message_expiry = list(message_expiry or ())
+        self.max_topic_aliases = max_topic_aliases
+        self.user_properties = list(user_properties or ())
+
+        self.client = None
+
+        # topic -> Properties of its messages (None if the messages have no property)
+        self._properties = {}
+
+        # Topic aliases of the current connection: topic -> [Properties with the alias, registered on the broker]
+        self._aliases = {}
+        self._alias_maximum = 0
+        self._alias_lock = threading.Lock()
+
+        # Subscriptions: topic_filter -> identifier and identifier -> handler(message)
+        self._subscription_identifiers = {}
+        self._handlers = {}
+
+        # Metrics of the session
+        self.aliased_count = 0
+        self.dispatched_count = 0
+
+    def attach(self, client):
+        """
+        Attach the session to a MQTT v5 client: publish() adds the properties of the topics and the v5 on_connect and
+        on_disconnect callbacks are adapted to the MQTT 3.1.1 signatures of the scripts. It must be called after setting
+        the client callbacks (they are wrapped) and before instrumenting the client metrics
+        :param client: MQTT Paho Client created with create_client(client_id, mqtt_v5=True)
+        :return: The client
+        """
+
+        client_publish = client.publish
+        user_on_connect = client.on_connect
+        user_on_disconnect = client.on_disconnect
+        aliases = self._aliases
+
+        def publish(topic, payload=None, qos=0, retain=False, properties=None):
+            if properties is not None:
+                return client_publish(topic, payload, qos, retain, properties)
+
+            # The QoS > 0 messages are stored by Paho and sent again on a new connection: they always carry the topic
+            alias = aliases.get(topic) if not qos else None
+            if alias is None:
+                if qos or not self._alias_maximum:
+                    return client_publish(topic, payload, qos, retain, self._topic_properties(topic))
+                alias = self._allocate_alias(topic)
+                if alias is None:
+                    return client_publish(topic, payload, qos, retain, self._topic_properties(topic))
+
+            if alias[1]:
+                self.aliased_count += 1
+                return client_publish("", payload, qos, retain, alias[0])
+
+            # First message of the alias: the topic is sent once to register it on the broker
+            message_info = client_publish(topic, payload, qos, retain, alias[0])
+            if message_info.rc == mqtt.MQTT_ERR_SUCCESS:
+                alias[1] = True
+            return message_info
+
+        def on_connect(client, userdata, flags, rc, properties=None):
+            self._reset_aliases(getattr(properties, "TopicAliasMaximum", 0) if rc == 0 else 0)
+            if user_on_connect is not None:
+                user_on_connect(client, userdata, flags, rc)
+
+        def on_disconnect(client, userdata, rc, properties=None):
+            # The aliases are not valid on the next connection
+            self._reset_aliases(0)
+            if user_on_disconnect is not None:
+                user_on_disconnect(client, userdata, rc)
+
+        client.publish = publish
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        self.client = client
+        return client
+
+    def _reset_aliases(self, broker_alias_maximum):
+        with self._alias_lock:
+            self._aliases.clear()
+            self._alias_maximum = min(broker_alias_maximum or 0, self.max_topic_aliases)
+
+    def _allocate_alias(self, topic):
+        """ Allocate the next topic alias of the connection (None when all the aliases are used) """
+
+        with self._alias_lock:
+            alias = self._aliases.get(topic)
+            if alias is None and len(self._aliases) < self._alias_maximum:
+                properties = self._new_properties(topic)
+                properties.TopicAlias = len(self._aliases) + 1
+                alias = [properties, False]
+                self._aliases[topic] = alias
+            return alias
+
+    def _topic_properties(self, topic):
+        """ Properties of the messages of a topic without alias (built once) """
+
+        try:
+            return self._properties[topic]
+        except KeyError:
+            pass
+
+        properties = self._new_properties(topic)
+        if properties.isEmpty():
+            properties = None
+        if len(self._properties) >= self._MAX_TOPICS:
+            self._properties.clear()
+        self._properties[topic] = properties
+        return properties
+
+    def _new_properties(self, topic):
+        properties = Properties(PacketTypes.PUBLISH)
+        for topic_filter, expiry_sec in self.message_expiry:
+            if mqtt.topic_matches_sub(topic_filter, topic):
+                if expiry_sec:
+                    properties.MessageExpiryInterval = int(expiry_sec)
+                break
+        codec, _ = codec_for_topic(topic)
+        if codec is not JSON_CODEC:
+            properties.ContentType = codec.content_type
+        if self.user_properties:
+            properties.UserProperty = list(self.user_properties)
+        return properties
+
+    def subscribe(self, topic_filter, handler, qos=0, no_local=False):
+        """
+        Subscribe to a topic filter with a subscription identifier (the identifier of a topic filter does not change
+        on the next connections, so the subscription can be restored by on_connect)
+        :param handler: Callable receiving the messages of the subscription (handler(message))
+        :param no_local: If True the messages published by the client itself are not delivered to the subscription
+        """
+
+        identifier = self._subscription_identifiers.get(topic_filter)
+        if identifier is None:
+            identifier = len(self._subscription_identifiers) + 1
+            self._subscription_identifiers[topic_filter] = identifier
+        self._handlers[identifier] = handler
+
+        properties = Properties(PacketTypes.SUBSCRIBE)
+        properties.SubscriptionIdentifier = identifier
+        return self.client.subscribe(topic_filter, options=SubscribeOptions(qos=qos, noLocal=no_local), properties=properties)
+
+    def dispatch(self, message):
+        """
+        Dispatch a received message to the handler of its subscription identifier
+        :return: True if a handler has been found, False otherwise (e.g. a message without subscription identifier)
+        """
+
+        identifiers = getattr(getattr(message, "properties", None), "SubscriptionIdentifier", None)
+        if not identifiers:
+            return False
+        handler = self._handlers.get(identifiers[0])
+        if handler is None:
+            return False
+        self.dispatched_count += 1
+        handler(message)
+        return True
+
+    def metrics(self):
+        """ Snapshot of the session metrics as a dictionary """
+
+        return {
+            "topic_aliases": len(self._aliases),
+            "topic_alias_maximum": self._alias_maximum,
+            "aliased": self.aliased_count,
+            "subscriptions": len(self._subscription_identifiers),
+            "dispatched": self.dispatched_count
+        }
@@ -0,0 +1,253 @@
+import mmap
+import os
+import struct
+import threading
+
+# Header of the buffer file: magic, capacity of the data region, head offset, tail offset, record count, dropped count
+_HEADER = struct.Struct("<8sQQQQQ")
+_HEADER_SIZE = 64
+_MAGIC = b"IOTRING1"
+
+# Header of each record: total record size, qos, retain, topic size (followed by the topic and the payload)
+_RECORD = struct.Struct("<IBBH")
+
+# A zero record size marks the end of the data before the wrap around
+_WRAP_MARKER = struct.Struct("<I")
+
+# Overflow policies of a full buffer
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DOWNSAMPLE = "downsample"
+
+
+class OfflineBuffer:
+    """ Disk-backed FIFO ring buffer of MQTT messages (store-and-forward during the broker outages).
+    The records are written in a fixed size memory-mapped file, so the buffer survives a restart of the device,
+    its size never grows over max_size_bytes and the RAM usage is bounded by the page cache.
+    When the buffer is full the overflow policy either evicts the oldest records (drop_oldest), rejects the new ones
+    (drop_newest) or compacts the buffer keeping one record in two (downsample: the whole outage is kept with a lower
+    resolution each time the buffer fills up) """
+
+    def __init__(self, path, max_size_bytes=64 * 1024 * 1024, overflow_policy=DROP_OLDEST):
+        """
+        Constructor for OfflineBuffer class
+        :param path: Buffer file (reopened with its records after a restart)
+        :param max_size_bytes: Size of the buffer file
+        :param overflow_policy: "drop_oldest", "drop_newest" or "downsample"
+        """
+
+        if overflow_policy not in (DROP_OLDEST, DROP_NEWEST, DOWNSAMPLE):
+            raise ValueError(f"Unsupported overflow policy: {overflow_policy}")
+
+        self.path = path
+        self.overflow_policy = overflow_policy
+        self.capacity = max_size_bytes - _HEADER_SIZE
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._head = 0
+        self._tail = 0
+        self._count = 0
+
+        # Metrics of the buffer (the dropped count is persisted in the header)
+        self.dropped_count = 0
+        self.appended_count = 0
+        self.compaction_count = 0
+
+        self._open()
+
+    def _open(self):
+        """ Map the buffer file, keeping its records if it has been created with the same capacity """
+
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) == self.capacity + _HEADER_SIZE
+        self._file = open(self.path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(self.capacity + _HEADER_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), self.capacity + _HEADER_SIZE)
+
+        magic, capacity, head, tail, count, dropped = _HEADER.unpack_from(self._map, 0)
+        if magic == _MAGIC and capacity == self.capacity:
+            self._head, self._tail, self._count, self.dropped_count = head, tail, count, dropped
+        else:
+            self._head = self._tail = self._count = 0
+            self._write_header()
+
+    def _write_header(self):
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.capacity, self._head, self._tail, self._count, self.dropped_count)
+
+    def __len__(self):
+        return self._count
+
+    def _write_offset(self, record_size):
+        """ Offset where a record of record_size bytes can be written (None if the buffer is full) """
+
+        if self._count == 0:
+            self._head = self._tail = 0
+            return 0 if record_size <= self.capacity else None
+        if self._tail > self._head:
+            if self.capacity - self._tail >= record_size:
+                return self._tail
+            if self._head >= record_size:
+                return 0
+            return None
+
+        # Wrapped around: the free space is between the tail and the head
+        return self._tail if self._head - self._tail >= record_size else None
+
+    def append(self, topic, payload, qos=0, retain=False):
+        """
+        Store a message at the end of the buffer, applying the overflow policy if the buffer is full
+        :return: True if the message has been stored, False if it has been dropped
+        """
+
+        topic_bytes = topic.encode("utf-8")
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        record_size = _RECORD.size + len(topic_bytes) + len(payload)
+
+        with self._lock:
+            # A record larger than the whole buffer is dropped before the overflow policy discards the stored records
+            if record_size > self.capacity:
+                self.dropped_count += 1
+                self._write_header()
+                return False
+
+            offset = self._write_offset(record_size)
+            if offset is None and self.overflow_policy == DOWNSAMPLE and self._count > 1:
+                self._compact()
+                offset = self._write_offset(record_size)
+            if offset is None and self.overflow_policy != DROP_NEWEST:
+                while offset is None and self._count:
+                    self._discard()
+                    self.dropped_count += 1
+                    offset = self._write_offset(record_size)
+            if offset is None:
+                self.dropped_count += 1
+                self._write_header()
+                return False
+
+            # Mark the end of the data before wrapping around to the beginning of the region
+            if offset == 0 and self._count and self.capacity - self._tail >= _WRAP_MARKER.size:
+                _WRAP_MARKER.pack_into(self._map, _HEADER_SIZE + self._tail, 0)
+
+            position = _HEADER_SIZE + offset
+            _RECORD.pack_into(self._map, position, record_size, qos, 1 if retain else 0, len(topic_bytes))
+            position += _RECORD.size
+            self._map[position:position + len(topic_bytes)] = topic_bytes
+            position += len(topic_bytes)
+            self._map[position:position + len(payload)] = payload
+
+            self._tail = offset + record_size
+            self._count += 1
+            self.appended_count += 1
+            self._write_header()
+
+        return True
+
+    def _head_offset(self):
+        """ Offset of the oldest record, following the wrap around marker """
+
+        if self.capacity - self._head < _RECORD.size or \
+                _WRAP_MARKER.unpack_from(self._map, _HEADER_SIZE + self._head)[0] == 0:
+            self._head = 0
+        return self._head
+
+    def _read(self, offset):
+        position = _HEADER_SIZE + offset
+        record_size, qos, retain, topic_size = _RECORD.unpack_from(self._map, position)
+        position += _RECORD.size
+        topic = self._map[position:position + topic_size].decode("utf-8")
+        payload = self._map[position + topic_size:_HEADER_SIZE + offset + record_size]
+        return record_size, (topic, payload, qos, bool(retain))
+
+    def _discard(self):
+        record_size, _ = self._read(self._head_offset())
+        self._head += record_size
+        self._count -= 1
+        if self._count == 0:
+            self._head = self._tail = 0
+
+    def peek(self):
+        """ Oldest message as a (topic, payload, qos, retain) tuple without removing it (None if the buffer is empty) """
+
+        with self._lock:
+            if not self._count:
+                return None
+            return self._read(self._head_offset())[1]
+
+    def pop(self):
+        """ Remove the oldest message (e.g. after its successful publishing) """
+
+        with self._lock:
+            if self._count:
+                self._discard()
+                self._write_header()
+
+    def _compact(self):
+        """ Keep one record in two, rewriting the kept records from the beginning of a new buffer file """
+
+        compacted_path = f"{self.path}.compact"
+        with open(compacted_path, "w+b") as compacted_file:
+            compacted_file.truncate(self.capacity + _HEADER_SIZE)
+            compacted_map = mmap.mmap(compacted_file.fileno(), self.capacity + _HEADER_SIZE)
+
+            tail = 0
+            kept_count = 0
+            for index in range(self._count):
+                offset = self._head_offset()
+                record_size = _RECORD.unpack_from(self._map, _HEADER_SIZE + offset)[0]
+                if index % 2 == 0:
+                    compacted_map[_HEADER_SIZE + tail:_HEADER_SIZE + tail + record_size] = \
+                        self._map[_HEADER_SIZE + offset:_HEADER_SIZE + offset + record_size]
+                    tail += record_size
+                    kept_count += 1
+                self._head = offset + record_size
+
+            self.dropped_count += self._count - kept_count
+            _HEADER.pack_into(compacted_map, 0, _MAGIC, self.capacity, 0, tail, kept_count, self.dropped_count)
+            compacted_map.close()
+
+        self._map.close()
+        self._file.close()
+        os.replace(compacted_path, self.path)
+        self._open()
+        self.compaction_count += 1
+
+    def size_bytes(self):
+        """ Bytes used by the records """
+
+        with self._lock:
+            if not self._count:
+                return 0
+            if self._tail > self._head:
+                return self._tail - self._head
+            return self.capacity - self._head + self._tail
+
+    def metrics(self):
+        """ Snapshot of the buffer metrics as a dictionary """
+
+        return {
+            "buffered": self._count,
+            "used_bytes": self.size_bytes(),
+            "capacity_bytes": self.capacity,
+            "appended": self.appended_count,
+            "dropped": self.dropped_count,
+            "compactions": self.compaction_count
+        }
+
+    def sync(self):
+        """ Write the dirty pages of the buffer to the disk """
+
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        """ Write the buffer to the disk and close the file """
+
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                self._file.close()
+                self._map = None
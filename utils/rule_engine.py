@@ -0,0 +1,507 @@
+import bisect
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from paho.mqtt.client import topic_matches_sub
+
+from utils.logger import get_logger, ACTION
+from utils.window_aggregator import SlidingWindow
+
+logger = get_logger(ACTION)
+
+# Rule syntax (one rule or group per line, a '#' at the start of the line or after a space starts a comment):
+#   [<name>:] <function>(<value type>[, <window>]) <operator> <threshold> [for device <device_id> | for device in group <group>]
+#       [on <topic filter>] => <ACTION> <VALUE>[, schedule [<ACTION>] <VALUE> after <delay>]
+#   group <group> = <device_id>, <device_id>, ...
+# e.g. overheating: avg(temperature, 30s) > 37 for device in group lab => SWITCH OFF, schedule ON after 10s
+# Functions: avg (or mean), min, max and count of the samples of the sliding window of the device, last (latest sample)
+# Operators: >, >=, <, <=. Windows and delays: 500ms, 30s, 5m, 1h (seconds without unit)
+_RULE_PATTERN = re.compile(
+    r"^(?:(?P<name>[\w.-]+)\s*:\s*)?"
+    r"(?P<function>\w+)\s*\(\s*(?P<value_type>[\w.-]+)\s*(?:,\s*(?P<window>[\d.]+\s*(?:ms|s|m|h)?)\s*)?\)\s*"
+    r"(?P<operator>>=|<=|>|<)\s*(?P<threshold>[-+]?[\d.]+(?:[eE][-+]?\d+)?)"
+    r"(?:\s+for\s+device\s+(?:in\s+group\s+(?P<group>[\w.-]+)|(?P<device_id>[\w.-]+)))?"
+    r"(?:\s+on\s+(?P<topic_filter>\S+))?"
+    r"\s*=>\s*(?P<action_type>\w+)\s+(?P<action_value>\w+)"
+    r"(?:\s*,\s*schedule\s+(?:(?P<schedule_type>\w+)\s+)?(?P<schedule_value>\w+)\s+after\s+(?P<schedule_delay>[\d.]+\s*(?:ms|s|m|h)?))?\s*$")
+
+_GROUP_PATTERN = re.compile(r"^group\s+(?P<group>[\w.-]+)\s*=\s*(?P<devices>.*)$")
+
+_COMMENT_PATTERN = re.compile(r"(?:^|\s)#.*$")
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Measure of the sliding window used by each function (the windowed functions require min_samples samples, except count)
+_WINDOW_MEASURES = {
+    "avg": SlidingWindow.mean,
+    "mean": SlidingWindow.mean,
+    "min": SlidingWindow.min,
+    "max": SlidingWindow.max,
+    "count": SlidingWindow.count
+}
+
+
+def parse_duration(text):
+    """ Seconds of a duration like 500ms, 30s, 5m or 1h (seconds without unit) """
+
+    match = re.fullmatch(r"([\d.]+)\s*(ms|s|m|h)?", text.strip())
+    if match is None:
+        raise ValueError(f"Invalid duration: {text}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2) or "s"]
+
+
+class Rule:
+    """ Compiled rule: the condition compares a measure of the samples of a device with a threshold, and the action is
+    applied by the controller when the condition holds """
+
+    __slots__ = ("name", "source", "value_type", "function", "window_sec", "operator", "threshold", "device_id", "group",
+                 "topic_filter", "action_type", "action_value", "schedule_type", "schedule_value", "schedule_delay_sec")
+
+    def __init__(self, name, source, value_type, function, window_sec, operator, threshold, device_id=None, group=None,
+                 topic_filter=None, action_type=None, action_value=None, schedule_type=None, schedule_value=None,
+                 schedule_delay_sec=None):
+        """
+        Constructor for Rule class
+        :param name: Name of the rule (logged when it fires)
+        :param source: Source line of the rule
+        :param value_type: Value type of the telemetry (e.g. TEMPERATURE_SENSOR)
+        :param function: avg, mean, min, max, count or last
+        :param window_sec: Duration of the sliding window (None for last)
+        :param operator: >, >=, < or <=
+        :param threshold: Threshold of the condition
+        :param device_id: Device of the rule (None for all the devices)
+        :param group: Group of devices of the rule (None for all the devices)
+        :param topic_filter: Topic filter of the telemetry (None for all the topics)
+        :param action_type: Action published when the rule fires (e.g. SWITCH)
+        :param action_value: Value of the action (e.g. OFF)
+        :param schedule_type: Action scheduled after the rule fired (None if no action is scheduled)
+        :param schedule_value: Value of the scheduled action
+        :param schedule_delay_sec: Delay of the scheduled action
+        """
+
+        self.name = name
+        self.source = source
+        self.value_type = value_type
+        self.function = function
+        self.window_sec = window_sec
+        self.operator = operator
+        self.threshold = threshold
+        self.device_id = device_id
+        self.group = group
+        self.topic_filter = topic_filter
+        self.action_type = action_type
+        self.action_value = action_value
+        self.schedule_type = schedule_type
+        self.schedule_value = schedule_value
+        self.schedule_delay_sec = schedule_delay_sec
+
+    def __repr__(self):
+        return f"Rule({self.source})"
+
+
+def _compile_measure(function, window_sec, min_samples):
+    """ Closure measuring the (windows, last value) of a device for a function, None when there are not enough samples """
+
+    if function == "last":
+        return lambda windows, last_value: last_value
+
+    window_measure = _WINDOW_MEASURES[function]
+    if function == "count":
+        return lambda windows, last_value: window_measure(windows[window_sec])
+
+    def measure(windows, last_value):
+        window = windows[window_sec]
+        return window_measure(window) if window.count() >= min_samples else None
+    return measure
+
+
+class _ThresholdGroup:
+    """ Rules of a (function, window, operator) sorted by threshold: the measure is computed once and the rules whose
+    condition holds are found with a binary search, whatever the number of thresholds """
+
+    __slots__ = ("measure", "thresholds", "rules", "fired")
+
+    def __init__(self, function, window_sec, operator, rules, min_samples):
+        """
+        Constructor for _ThresholdGroup class
+        :param rules: Rules of the group
+        """
+
+        rules = sorted(rules, key=lambda rule: rule.threshold)
+        self.measure = _compile_measure(function, window_sec, min_samples)
+        self.thresholds = [rule.threshold for rule in rules]
+        self.rules = rules
+
+        # The rules firing for a value are a prefix (> and >=) or a suffix (< and <=) of the sorted rules
+        thresholds = self.thresholds
+        if operator == ">":
+            self.fired = lambda value: rules[:bisect.bisect_left(thresholds, value)]
+        elif operator == ">=":
+            self.fired = lambda value: rules[:bisect.bisect_right(thresholds, value)]
+        elif operator == "<":
+            self.fired = lambda value: rules[bisect.bisect_right(thresholds, value):]
+        else:
+            self.fired = lambda value: rules[bisect.bisect_left(thresholds, value):]
+
+
+def _compile_groups(rules, min_samples):
+    """
+    Group rules by (function, window, operator) into _ThresholdGroup
+    :return: Tuple (window durations to update, tuple of _ThresholdGroup)
+    """
+
+    grouped = {}
+    for rule in rules:
+        grouped.setdefault((rule.function, rule.window_sec, rule.operator), []).append(rule)
+
+    window_durations = tuple({window_sec for _, window_sec, _ in grouped if window_sec is not None})
+    return window_durations, tuple(_ThresholdGroup(function, window_sec, operator, rules, min_samples)
+                                   for (function, window_sec, operator), rules in grouped.items())
+
+
+class _RuleSet:
+    """ Immutable set of compiled rules indexed by value type and device scope (replaced as a whole on reload).
+    The rules of all the devices and of the groups without topic filter are compiled once for each value type and
+    combination of groups, so only the devices with their own rules or the topics matched by a filter need a compilation """
+
+    def __init__(self, rules, device_groups, min_samples):
+        """
+        Constructor for _RuleSet class
+        :param rules: List of compiled Rule
+        :param device_groups: Group name -> list of device ids
+        :param min_samples: Min samples of a sliding window to evaluate the windowed functions
+        """
+
+        self.rules = rules
+        self.min_samples = min_samples
+
+        # device_id -> groups of the device
+        self.groups_of_device = {}
+        for group, device_ids in device_groups.items():
+            for device_id in device_ids:
+                self.groups_of_device.setdefault(device_id, []).append(group)
+        self.groups_of_device = {device_id: tuple(groups) for device_id, groups in self.groups_of_device.items()}
+
+        # value_type -> (rules of all the devices, group -> rules, device_id -> rules, topic filter -> rules of all the
+        # devices or of the groups); the device rules may have a topic filter too
+        self.by_value_type = {}
+        for rule in rules:
+            all_rules, group_rules, device_rules, filtered_rules = self.by_value_type.setdefault(rule.value_type, ([], {}, {}, {}))
+            if rule.device_id is not None:
+                device_rules.setdefault(rule.device_id, []).append(rule)
+            elif rule.topic_filter is not None:
+                filtered_rules.setdefault(rule.topic_filter, []).append(rule)
+            elif rule.group is not None:
+                group_rules.setdefault(rule.group, []).append(rule)
+            else:
+                all_rules.append(rule)
+
+        # (value_type, groups of a device) -> compilation of the rules of all the devices and of these groups
+        self.shared = {}
+        group_combinations = {()} | set(self.groups_of_device.values())
+        for value_type, (all_rules, group_rules, _, _) in self.by_value_type.items():
+            for groups in group_combinations:
+                rules_of_groups = list(all_rules)
+                for group in groups:
+                    rules_of_groups.extend(group_rules.get(group, ()))
+                self.shared[(value_type, groups)] = _compile_groups(rules_of_groups, min_samples)
+
+        # Durations of the sliding windows used by the rules
+        self.window_durations = {rule.window_sec for rule in rules if rule.window_sec is not None}
+
+    def shared_compilation(self, value_type, device_id):
+        """ Precompiled rules of a device without rules of its own and without filtered rules of its value type (else None) """
+
+        indexed = self.by_value_type.get(value_type)
+        if indexed is None:
+            return (), ()
+        if indexed[3] or device_id in indexed[2]:
+            return None
+        return self.shared[(value_type, self.groups_of_device.get(device_id, ()))]
+
+    def compile(self, topic, value_type, device_id):
+        """
+        Compile the rules applying to a message of a device on a topic: the precompiled rules of all the devices and
+        of the groups of the device, plus the rules of the device and the filtered rules matching the topic
+        :return: Tuple (window durations to update, tuple of _ThresholdGroup)
+        """
+
+        indexed = self.by_value_type.get(value_type)
+        if indexed is None:
+            return (), ()
+        _, _, device_rules, filtered_rules = indexed
+        groups_of_device = self.groups_of_device.get(device_id, ())
+        shared_durations, shared_groups = self.shared[(value_type, groups_of_device)]
+
+        # Each topic filter is matched once for all its rules
+        candidates = [rule for rule in device_rules.get(device_id, ()) if rule.topic_filter is None or topic_matches_sub(rule.topic_filter, topic)]
+        for topic_filter, rules in filtered_rules.items():
+            if topic_matches_sub(topic_filter, topic):
+                candidates.extend(rule for rule in rules if rule.group is None or rule.group in groups_of_device)
+        if not candidates:
+            return shared_durations, shared_groups
+
+        window_durations, groups = _compile_groups(candidates, self.min_samples)
+        return tuple(set(shared_durations) | set(window_durations)), shared_groups + groups
+
+
+def parse_rules(text, value_type_aliases=None):
+    """
+    Compile the rules and the device groups of a rules text
+    :param value_type_aliases: Optional dictionary of value type aliases (e.g. {"temperature": "TEMPERATURE_SENSOR"})
+    :return: Tuple (list of Rule, dictionary group -> list of device ids)
+    """
+
+    value_type_aliases = value_type_aliases or {}
+    rules = []
+    device_groups = {}
+    for line_number, line in enumerate(text.splitlines(), 1):
+        # The '#' of the topic filters (e.g. device/+/telemetry/#) does not start a comment
+        line = _COMMENT_PATTERN.sub("", line).strip()
+        if not line:
+            continue
+
+        group_match = _GROUP_PATTERN.match(line)
+        if group_match is not None:
+            device_groups[group_match.group("group")] = [device_id.strip() for device_id in group_match.group("devices").split(",") if device_id.strip()]
+            continue
+
+        match = _RULE_PATTERN.match(line)
+        if match is None:
+            raise ValueError(f"Invalid rule at line {line_number}: {line}")
+
+        function = match.group("function").lower()
+        if function != "last" and function not in _WINDOW_MEASURES:
+            raise ValueError(f"Unknown function at line {line_number}: {function}")
+        window = match.group("window")
+        if (window is None) != (function == "last"):
+            raise ValueError(f"Invalid window at line {line_number}: {line}")
+        if match.group("topic_filter") is not None and "#" in match.group("topic_filter").split("/")[:-1]:
+            raise ValueError(f"Invalid topic filter at line {line_number}: {match.group('topic_filter')}")
+
+        value_type = match.group("value_type")
+        schedule_value = match.group("schedule_value")
+        rules.append(Rule(match.group("name") or f"rule-{line_number}", line,
+                          value_type_aliases.get(value_type, value_type), function,
+                          parse_duration(window) if window is not None else None,
+                          match.group("operator"), float(match.group("threshold")),
+                          device_id=match.group("device_id"), group=match.group("group"),
+                          topic_filter=match.group("topic_filter"),
+                          action_type=match.group("action_type"), action_value=match.group("action_value"),
+                          schedule_type=(match.group("schedule_type") or match.group("action_type")) if schedule_value else None,
+                          schedule_value=schedule_value,
+                          schedule_delay_sec=parse_duration(match.group("schedule_delay")) if schedule_value else None))
+
+    for rule in rules:
+        if rule.group is not None and rule.group not in device_groups:
+            raise ValueError(f"Unknown group of rule {rule.name}: {rule.group}")
+    return rules, device_groups
+
+
+class RuleEngine:
+    """ Declarative rules of the controller compiled into closures. The rules are indexed by value type and device scope
+    and compiled into groups sorted by threshold, so a message evaluates one measure for each group and a binary search
+    finds the fired rules (no scan of the rules). The rules of all the devices and of the groups are compiled once by
+    the rule set; the (topic, value type, device) with device rules or filtered rules are compiled on their first message
+    and kept in an LRU cache. Each device keeps one sliding window for each window duration used by the rules.
+    The rules can be reloaded while the messages are evaluated: a new rule set replaces the previous one as a whole,
+    and a rules file is reloaded by a background thread when it changes (an invalid file keeps the previous rules) """
+
+    def __init__(self, rules_text="", value_type_aliases=None, min_samples=1, sliding_window_capacity=1024, cache_size=4096):
+        """
+        Constructor for RuleEngine class
+        :param rules_text: Initial rules (see the rule syntax at the top of the module)
+        :param value_type_aliases: Optional dictionary of value type aliases (e.g. {"temperature": "TEMPERATURE_SENSOR"})
+        :param min_samples: Min samples of a sliding window to evaluate avg, mean, min and max
+        :param sliding_window_capacity: Max number of samples of each sliding window
+        :param cache_size: Max number of (topic, value type, device) compilations of the device and filtered rules kept in the LRU cache
+        """
+
+        self.value_type_aliases = dict(value_type_aliases or {})
+        self.min_samples = min_samples
+        self.sliding_window_capacity = sliding_window_capacity
+        self.cache_size = cache_size
+
+        self._ruleset = _RuleSet([], {}, min_samples)
+
+        # (topic, value_type, device_id) -> (window durations, threshold groups) of the current rule set
+        self._cache = OrderedDict()
+
+        # (device_id, value_type) -> window duration -> SlidingWindow
+        self._windows = {}
+        self._lock = threading.Lock()
+
+        # Hot reload of the rules file
+        self._path = None
+        self._file_signature = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Metrics of the engine
+        self.evaluated_count = 0
+        self.fired_count = 0
+        self.reload_count = 0
+        self.reload_error_count = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if rules_text:
+            self.load(rules_text)
+
+    def load(self, rules_text):
+        """
+        Compile the rules and replace the current rules (the current rules are kept if the text is invalid)
+        :return: Number of loaded rules
+        """
+
+        rules, device_groups = parse_rules(rules_text, self.value_type_aliases)
+        ruleset = _RuleSet(rules, device_groups, self.min_samples)
+        with self._lock:
+            self._ruleset = ruleset
+            self._cache.clear()
+
+            # The windows of the durations no longer used are released
+            for windows in list(self._windows.values()):
+                for window_sec in [window_sec for window_sec in list(windows) if window_sec not in ruleset.window_durations]:
+                    del windows[window_sec]
+        self.reload_count += 1
+        return len(rules)
+
+    def load_file(self, path):
+        """ Load the rules of a file (see load()) """
+
+        with open(path) as rules_file:
+            return self.load(rules_file.read())
+
+    def rules(self):
+        """ Current compiled rules """
+        return list(self._ruleset.rules)
+
+    def _compiled(self, topic, value_type, device_id):
+        # The devices without rules of their own share the precompiled rules of their groups (no cache entry)
+        ruleset = self._ruleset
+        compiled = ruleset.shared_compilation(value_type, device_id)
+        if compiled is not None:
+            return compiled
+
+        key = (topic, value_type, device_id)
+        with self._lock:
+            compiled = self._cache.get(key)
+            if compiled is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return compiled
+            self.cache_misses += 1
+
+        # The compilation runs outside the lock, it is cached only if the rules have not been reloaded meanwhile
+        compiled = ruleset.compile(topic, value_type, device_id)
+        with self._lock:
+            if self._ruleset is ruleset:
+                self._cache[key] = compiled
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return compiled
+
+    def evaluate(self, device_id, topic, value_type, samples):
+        """
+        Add the samples of a message to the sliding windows of the device and evaluate the rules applying to it
+        (the samples of a device must be evaluated by a single thread at a time, e.g. a shard of the WorkDispatcher)
+        :param device_id: Device of the message
+        :param topic: Topic of the message
+        :param value_type: Value type of the samples
+        :param samples: Iterable of (timestamp, value) samples of the message
+        :return: List of the (Rule, measured value) fired by the samples
+        """
+
+        window_durations, groups = self._compiled(topic, value_type, device_id)
+        if not groups:
+            return []
+        self.evaluated_count += 1
+
+        windows = self._windows.get((device_id, value_type))
+        if windows is None:
+            with self._lock:
+                windows = self._windows.setdefault((device_id, value_type), {})
+
+        # Windows of the durations used by the compiled rules (a reload may release the windows of the previous rules)
+        message_windows = {}
+        for window_sec in window_durations:
+            window = windows.get(window_sec)
+            if window is None:
+                window = windows[window_sec] = SlidingWindow(window_sec, self.sliding_window_capacity)
+            message_windows[window_sec] = window
+
+        last_value = None
+        for timestamp, value in samples:
+            last_value = value
+            for window in message_windows.values():
+                window.add(timestamp, value)
+
+        fired = []
+        for group in groups:
+            measured = group.measure(message_windows, last_value)
+            if measured is not None:
+                fired.extend((rule, measured) for rule in group.fired(measured))
+        self.fired_count += len(fired)
+        return fired
+
+    def remove_device(self, device_id):
+        """ Remove the sliding windows of a device """
+
+        with self._lock:
+            for key in [key for key in self._windows if key[0] == device_id]:
+                del self._windows[key]
+
+    def start(self, path, interval_sec):
+        """ Load a rules file and start a thread reloading it every interval_sec when it changes """
+
+        self._path = path
+        self._file_signature = self._signature()
+        self.load_file(path)
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._reload_loop, args=(interval_sec,), name="RuleEngine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the reload thread """
+
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _signature(self):
+        status = os.stat(self._path)
+        return status.st_mtime_ns, status.st_size
+
+    def _reload_loop(self, interval_sec):
+        while not self._stop_event.wait(interval_sec):
+            try:
+                signature = self._signature()
+                if signature == self._file_signature:
+                    continue
+                self._file_signature = signature
+                rule_count = self.load_file(self._path)
+                logger.info("Rule Engine: %s rules reloaded from %s", rule_count, self._path)
+            except Exception as e:
+                # The previous rules are kept until the file is fixed
+                self.reload_error_count += 1
+                logger.error("Rule Engine reload error: %s", e)
+
+    def metrics(self):
+        """ Snapshot of the engine metrics as a dictionary """
+
+        return {
+            "rules": len(self._ruleset.rules),
+            "evaluated": self.evaluated_count,
+            "fired": self.fired_count,
+            "reloads": self.reload_count,
+            "reload_errors": self.reload_error_count,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses
+        }
@@ -0,0 +1,300 @@
+class DeadbandFilter:
+    """ Report by exception of a numeric series: a sample is reported only when it moves out of the deadband around the
+    last reported value (absolute and/or percentage of the last reported value), or when the series has been silent
+    for max_silence_sec (heartbeat, so the consumers can tell a stable value from a dead device) """
+
+    __slots__ = ("absolute_deadband", "percent_deadband", "max_silence_sec", "_last_timestamp", "_last_value",
+                 "offered_count", "reported_count")
+
+    def __init__(self, absolute_deadband=0.0, percent_deadband=0.0, max_silence_sec=60.0):
+        """
+        Constructor for DeadbandFilter class
+        :param absolute_deadband: Min absolute change of the value to report it (0 to disable)
+        :param percent_deadband: Min change of the value in percentage of the last reported value (0 to disable)
+        :param max_silence_sec: Max seconds without reports (the sample is reported anyway)
+        """
+
+        self.absolute_deadband = absolute_deadband
+        self.percent_deadband = percent_deadband
+        self.max_silence_sec = max_silence_sec
+        self._last_timestamp = None
+        self._last_value = None
+
+        # Metrics of the filter
+        self.offered_count = 0
+        self.reported_count = 0
+
+    def offer(self, timestamp, value):
+        """
+        Offer a sample of the series
+        :return: List of the (timestamp, value) samples to report (empty or the offered sample)
+        """
+
+        self.offered_count += 1
+        last_value = self._last_value
+        if last_value is not None and timestamp - self._last_timestamp < self.max_silence_sec:
+            # The sample is dropped while it is within all the enabled deadbands (without deadband, while it does not change)
+            change = abs(value - last_value)
+            within = change == 0 or bool(self.absolute_deadband or self.percent_deadband)
+            if self.absolute_deadband:
+                within = within and change <= self.absolute_deadband
+            if self.percent_deadband:
+                within = within and change <= abs(last_value) * self.percent_deadband / 100.0
+            if within:
+                return []
+
+        self._last_timestamp = timestamp
+        self._last_value = value
+        self.reported_count += 1
+        return [(timestamp, value)]
+
+    def flush(self):
+        """ Samples held by the filter (none, the deadband reports the samples when they are offered) """
+        return []
+
+    def reset(self):
+        """ Restart the series (the next sample is always reported) """
+
+        self._last_timestamp = None
+        self._last_value = None
+
+    def metrics(self):
+        """ Snapshot of the filter metrics as a dictionary """
+        return _filter_metrics(self)
+
+
+class SwingingDoorFilter:
+    """ Swinging door compression of a numeric series (the archiving algorithm of the process historians): the series is
+    reported as the vertices of a piecewise linear function that stays within deviation of every offered sample.
+    The two "doors" pivot around the last reported sample +/- deviation and close as the samples arrive, a sample is
+    held as long as the doors are open, and the held sample is reported when the next sample would close them.
+    The held sample is reported at the middle of the doors (within deviation of its value), so the line from the
+    previous report stays within deviation of all the samples in between.
+    The reports are delayed by one sample and the consumers rebuild the series by linear interpolation """
+
+    __slots__ = ("deviation", "max_silence_sec", "_archived", "_held", "_upper_slope", "_lower_slope",
+                 "offered_count", "reported_count")
+
+    def __init__(self, deviation, max_silence_sec=60.0):
+        """
+        Constructor for SwingingDoorFilter class
+        :param deviation: Max absolute error of the linear interpolation of the reported samples
+        :param max_silence_sec: Max seconds without reports (the sample is reported anyway)
+        """
+
+        self.deviation = deviation
+        self.max_silence_sec = max_silence_sec
+
+        # Last reported sample (pivot of the doors) and last held sample
+        self._archived = None
+        self._held = None
+        self._upper_slope = None
+        self._lower_slope = None
+
+        # Metrics of the filter
+        self.offered_count = 0
+        self.reported_count = 0
+
+    def offer(self, timestamp, value):
+        """
+        Offer a sample of the series
+        :return: List of the (timestamp, value) samples to report (0, 1 or 2 samples)
+        """
+
+        self.offered_count += 1
+        if self._archived is None:
+            return self._report_and_pivot(timestamp, value)
+
+        reported = []
+        archived_timestamp, archived_value = self._archived
+        elapsed = timestamp - archived_timestamp
+        if elapsed > 0:
+            upper_slope = (value + self.deviation - archived_value) / elapsed
+            lower_slope = (value - self.deviation - archived_value) / elapsed
+            if self._upper_slope is not None:
+                upper_slope = min(upper_slope, self._upper_slope)
+                lower_slope = max(lower_slope, self._lower_slope)
+
+            if lower_slope > upper_slope:
+                # The doors are closed: the held sample ends the segment and becomes the new pivot
+                reported = self._report_held()
+                elapsed = timestamp - self._archived[0]
+                if elapsed <= 0:
+                    self._held = (timestamp, value)
+                    return reported
+                upper_slope = (value + self.deviation - self._archived[1]) / elapsed
+                lower_slope = (value - self.deviation - self._archived[1]) / elapsed
+
+            self._upper_slope = upper_slope
+            self._lower_slope = lower_slope
+
+        self._held = (timestamp, value)
+
+        # Heartbeat: the held sample is within the doors, so it can end the segment
+        if timestamp - self._archived[0] >= self.max_silence_sec:
+            reported.extend(self._report_held())
+        return reported
+
+    def _report_held(self):
+        timestamp, value = self._held
+        if self._upper_slope is not None:
+            archived_timestamp, archived_value = self._archived
+            value = archived_value + (self._upper_slope + self._lower_slope) / 2.0 * (timestamp - archived_timestamp)
+        return self._report_and_pivot(timestamp, value)
+
+    def _report_and_pivot(self, timestamp, value):
+        self._archived = (timestamp, value)
+        self._held = None
+        self._upper_slope = None
+        self._lower_slope = None
+        self.reported_count += 1
+        return [(timestamp, value)]
+
+    def flush(self):
+        """ Report the held sample (e.g. before pausing the series), the next sample starts a new segment """
+
+        if self._held is None:
+            return []
+        return self._report_held()
+
+    def reset(self):
+        """ Restart the series (the next sample is always reported) """
+
+        self._archived = None
+        self._held = None
+        self._upper_slope = None
+        self._lower_slope = None
+
+    def metrics(self):
+        """ Snapshot of the filter metrics as a dictionary """
+        return _filter_metrics(self)
+
+
+def _filter_metrics(telemetry_filter):
+    return {
+        "offered": telemetry_filter.offered_count,
+        "reported": telemetry_filter.reported_count,
+        "compression_ratio": telemetry_filter.offered_count / telemetry_filter.reported_count if telemetry_filter.reported_count else 0.0
+    }
+
+
+def create_telemetry_filter(mode, absolute_deadband=0.0, percent_deadband=0.0, deviation=0.0, max_silence_sec=60.0):
+    """
+    Create the report by exception filter of a telemetry series
+    :param mode: "deadband", "swinging_door" or None (every sample is reported)
+    :return: DeadbandFilter, SwingingDoorFilter or None
+    """
+
+    if not mode:
+        return None
+    if mode == "deadband":
+        return DeadbandFilter(absolute_deadband, percent_deadband, max_silence_sec)
+    if mode == "swinging_door":
+        return SwingingDoorFilter(deviation, max_silence_sec)
+    raise ValueError(f"Unknown telemetry compression: {mode}")
+
+
+class SeriesReconstructor:
+    """ Rebuilds the series of the compressed telemetry at the sampling interval of the devices: the samples between two
+    received samples are interpolated ("linear" for the swinging door compression, "step" holding the last value
+    for the deadband compression). The ratio of rebuilt to received samples is the compression ratio of the uplink """
+
+    def __init__(self, sampling_interval_sec=1.0, interpolation="linear", max_gap_sec=300.0):
+        """
+        Constructor for SeriesReconstructor class
+        :param sampling_interval_sec: Sampling interval of the devices
+        :param interpolation: "linear" or "step"
+        :param max_gap_sec: Gaps longer than this (e.g. a device offline) are not filled
+        """
+
+        if interpolation not in ("linear", "step"):
+            raise ValueError(f"Unknown interpolation: {interpolation}")
+
+        self.sampling_interval_sec = sampling_interval_sec
+        self.interpolation = interpolation
+        self.max_gap_sec = max_gap_sec
+
+        # Series key (e.g. (device_id, value_type)) -> last received (timestamp, value)
+        self._last_samples = {}
+
+        # Series key -> timestamp of the stop of the series (the samples up to it belong to the stopped series)
+        self._stop_timestamps = {}
+
+        # Series key -> [received samples, rebuilt samples]
+        self._counts = {}
+
+    def add(self, key, timestamp, value):
+        """
+        Add a received sample of a series
+        :return: List of the rebuilt (timestamp, value) samples after the previous received sample, ending with the received one
+        """
+
+        samples = [(timestamp, value)]
+
+        # A sample of the stopped series received after the stop (e.g. the sample held by the filter of the device, flushed
+        # after its stop report) is not interpolated and does not start the new series
+        stop_timestamp = self._stop_timestamps.get(key)
+        if stop_timestamp is not None:
+            if timestamp <= stop_timestamp:
+                self._count(key, samples)
+                return samples
+            del self._stop_timestamps[key]
+
+        last_sample = self._last_samples.get(key)
+        self._last_samples[key] = (timestamp, value)
+
+        if last_sample is not None:
+            last_timestamp, last_value = last_sample
+            gap = timestamp - last_timestamp
+            steps = int(round(gap / self.sampling_interval_sec))
+            if 1 < steps and gap <= self.max_gap_sec:
+                slope = (value - last_value) / gap if self.interpolation == "linear" else 0.0
+                samples = [(last_timestamp + step * gap / steps, last_value + slope * step * gap / steps) for step in range(1, steps)]
+                samples.append((timestamp, value))
+
+        self._count(key, samples)
+        return samples
+
+    def _count(self, key, samples):
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0, 0]
+        counts[0] += 1
+        counts[1] += len(samples)
+
+    def reset(self, key, timestamp=None):
+        """
+        Restart a series: the next sample is not interpolated (e.g. the device stopped its telemetry)
+        :param timestamp: Optional time of the stop: the samples up to it, received later, do not restart the series
+        """
+
+        self._last_samples.pop(key, None)
+        if timestamp is not None:
+            self._stop_timestamps[key] = timestamp
+
+    def remove(self, key):
+        """ Remove a series """
+
+        self._last_samples.pop(key, None)
+        self._stop_timestamps.pop(key, None)
+        self._counts.pop(key, None)
+
+    def compression_ratio(self, key=None):
+        """ Rebuilt samples / received samples of a series (of all the series if key is None) """
+
+        if key is not None:
+            received, rebuilt = self._counts.get(key, (0, 0))
+        else:
+            received = sum(counts[0] for counts in self._counts.values())
+            rebuilt = sum(counts[1] for counts in self._counts.values())
+        return rebuilt / received if received else 0.0
+
+    def metrics(self):
+        """ Snapshot of the reconstruction metrics as a dictionary """
+
+        return {
+            "series": len(self._counts),
+            "received": sum(counts[0] for counts in self._counts.values()),
+            "rebuilt": sum(counts[1] for counts in self._counts.values()),
+            "compression_ratio": self.compression_ratio()
+        }
@@ -0,0 +1,211 @@
+import queue
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from dto.payload_codec import JSON_CODEC
+from utils.logger import get_logger, TELEMETRY
+
+logger = get_logger(TELEMETRY)
+
+
+class TelemetryPublisher:
+    """ This class decouples the sampling of the sensors from the MQTT publishing.
+    The sampler enqueues the messages into a bounded queue without blocking and a dedicated sender thread
+    drains the queue in batches at a configurable rate. When the queue is full the new messages are dropped
+    and counted, so the sampler is never stalled by the publish path.
+    With an OfflineBuffer the messages drained while the client is disconnected are stored on disk instead of
+    piling up in the Paho client, and the backlog is replayed in order at replay_rate after the reconnection
+    (the new messages follow the backlog, so the consumers receive the telemetry in order) """
+
+    def __init__(self, mqtt_client, max_queue_size=1000, batch_size=50, publish_interval=0.1, codec=JSON_CODEC,
+                 offline_buffer=None, replay_rate=200):
+        """
+        Constructor for TelemetryPublisher class
+        :param mqtt_client: Connected MQTT Paho Client used to publish the messages
+        :param max_queue_size: Max number of messages waiting to be published
+        :param batch_size: Max number of messages published for each drain of the queue
+        :param publish_interval: Seconds between two consecutive drains of the queue
+        :param codec: Payload codec used to serialize the enqueued DTOs (see dto/payload_codec.py)
+        :param offline_buffer: Optional OfflineBuffer storing the messages while the client is disconnected
+        :param replay_rate: Max messages per second replayed from the offline buffer (higher than the sampling rate to catch up)
+        """
+
+        self.mqtt_client = mqtt_client
+        self.codec = codec
+        self.batch_size = batch_size
+        self.publish_interval = publish_interval
+        self.offline_buffer = offline_buffer
+        self.replay_batch_size = max(1, int(replay_rate * publish_interval))
+
+        # Bounded queue of (topic, message, qos, retain, enqueue_time) tuples
+        self._queue = queue.Queue(maxsize=max_queue_size)
+
+        self._running = threading.Event()
+        self._sender_thread = None
+
+        # Backpressure metrics
+        self.enqueued_count = 0
+        self.dropped_count = 0
+        self.published_count = 0
+        self.error_count = 0
+        self.batch_count = 0
+        self.buffered_count = 0
+        self.replayed_count = 0
+        self.total_publish_latency = 0.0
+        self.max_publish_latency = 0.0
+
+    def start(self):
+        """ Start the sender thread draining the queue """
+
+        if self._running.is_set():
+            return
+
+        self._running.set()
+        self._sender_thread = threading.Thread(target=self._sender_loop, name="TelemetryPublisher", daemon=True)
+        self._sender_thread.start()
+
+    def stop(self, flush=True):
+        """
+        Stop the sender thread
+        :param flush: If True the messages still in the queue are published before returning
+        """
+
+        self._running.clear()
+        if self._sender_thread is not None:
+            self._sender_thread.join()
+            self._sender_thread = None
+
+        if flush:
+            while self._publish_batch(self._queue.qsize()):
+                pass
+
+    def enqueue(self, topic, message, qos=0, retain=False):
+        """
+        Enqueue a message without blocking the caller
+        :param topic: Target topic of the message
+        :param message: DTO serialized with the publisher codec or an already serialized str/bytes payload
+        :param qos: MQTT QoS of the message
+        :param retain: MQTT Retained flag of the message
+        :return: True if the message has been enqueued, False if it has been dropped
+        """
+
+        try:
+            self._queue.put_nowait((topic, message, qos, retain, time.monotonic()))
+            self.enqueued_count += 1
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+
+    def queue_depth(self):
+        """ Number of messages waiting to be published """
+        return self._queue.qsize()
+
+    def metrics(self):
+        """ Snapshot of the backpressure metrics as a dictionary """
+
+        return {
+            "queue_depth": self._queue.qsize(),
+            "enqueued": self.enqueued_count,
+            "published": self.published_count,
+            "dropped": self.dropped_count,
+            "errors": self.error_count,
+            "batches": self.batch_count,
+            "buffered": self.buffered_count,
+            "replayed": self.replayed_count,
+            "offline_backlog": len(self.offline_buffer) if self.offline_buffer is not None else 0,
+            "avg_publish_latency_ms": (self.total_publish_latency / self.published_count * 1000.0) if self.published_count else 0.0,
+            "max_publish_latency_ms": self.max_publish_latency * 1000.0
+        }
+
+    def _sender_loop(self):
+        """ Drain the queue in batches every publish interval """
+
+        next_drain = time.monotonic()
+        while self._running.is_set():
+            self._publish_batch(self.batch_size)
+
+            # Keep a fixed drain rate independently of the time spent publishing
+            next_drain += self.publish_interval
+            delay = next_drain - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_drain = time.monotonic()
+
+    def _replay_batch(self):
+        """ Publish up to replay_batch_size messages of the offline backlog, oldest first """
+
+        replayed = 0
+        while replayed < self.replay_batch_size:
+            record = self.offline_buffer.peek()
+            if record is None:
+                break
+
+            # The record stays in the buffer until the client accepts it (a QoS > 0 message is queued by Paho while disconnected)
+            topic, payload, qos, retain = record
+            rc = self.mqtt_client.publish(topic, payload, qos, retain).rc
+            if rc != mqtt.MQTT_ERR_SUCCESS and not (qos and rc == mqtt.MQTT_ERR_NO_CONN):
+                break
+            self.offline_buffer.pop()
+            replayed += 1
+
+        self.replayed_count += replayed
+
+    def _publish_batch(self, batch_size):
+        """
+        Publish up to batch_size messages from the queue (stored in the offline buffer while disconnected)
+        :return: Number of published or buffered messages
+        """
+
+        offline_buffer = self.offline_buffer
+        connected = offline_buffer is None or self.mqtt_client.is_connected()
+        if connected and offline_buffer is not None and len(offline_buffer):
+            try:
+                self._replay_batch()
+            except Exception as e:
+                self.error_count += 1
+                logger.error("Error replaying Telemetry: %s", e)
+
+        published = buffered = 0
+        while published + buffered < batch_size:
+            try:
+                topic, message, qos, retain, enqueue_time = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                payload = message if isinstance(message, (str, bytes)) else self.codec.encode(message)
+
+                # Keep the order: the new messages wait behind the backlog until it has been replayed
+                if offline_buffer is not None and (not connected or len(offline_buffer)):
+                    offline_buffer.append(topic, payload, qos, retain)
+                    buffered += 1
+                    continue
+
+                # Store a QoS 0 message refused by a client disconnected after the check (the QoS > 0 messages are queued by Paho)
+                message_info = self.mqtt_client.publish(topic, payload, qos, retain)
+                if offline_buffer is not None and qos == 0 and message_info.rc == mqtt.MQTT_ERR_NO_CONN:
+                    offline_buffer.append(topic, payload, qos, retain)
+                    buffered += 1
+                    continue
+            except Exception as e:
+                self.error_count += 1
+                logger.error("Error publishing Telemetry: %s", e)
+                continue
+
+            latency = time.monotonic() - enqueue_time
+            self.total_publish_latency += latency
+            if latency > self.max_publish_latency:
+                self.max_publish_latency = latency
+
+            published += 1
+
+        if published:
+            self.published_count += published
+            self.batch_count += 1
+        self.buffered_count += buffered
+
+        return published + buffered
@@ -0,0 +1,329 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.logger import get_logger, TELEMETRY
+
+logger = get_logger(TELEMETRY)
+
+# Extensions of the two column files of a segment
+TIMESTAMPS_EXTENSION = ".ts"
+VALUES_EXTENSION = ".val"
+
+# Aggregations supported by TimeSeriesStore.downsample
+AGGREGATIONS = ("mean", "min", "max", "sum", "count", "first", "last")
+
+
+class _Series:
+    """ Write state of the series of a (device, value type) pair: the last segment of the series and the buffered
+    records not yet written. The records of a segment are always sorted by timestamp: the buffered records are sorted
+    when they are written, and only a record older than the last written one starts a new segment """
+
+    __slots__ = ("path", "segment_index", "segment_count", "written_timestamp", "timestamps", "values", "unsorted")
+
+    def __init__(self, path):
+        self.path = path
+        self.segment_index = 0
+        self.segment_count = 0
+        self.written_timestamp = None
+        self.timestamps = array("q")
+        self.values = array("d")
+        self.unsorted = False
+
+
+class TimeSeriesStore:
+    """ Local storage sink of the numeric telemetry. Each (device, value type) series is a directory of append-only
+    columnar segments: <root>/<device_id>/<value_type>/<segment>.ts (int64 timestamps) and <segment>.val (float64 values).
+    The appends are buffered in typed arrays and written with a single write of each column, and the reads memory-map
+    the segments: a time range query only touches the pages found by a binary search of the sorted timestamps,
+    so the queries and the downsampling never load a whole file """
+
+    def __init__(self, root_path, segment_size=1048576, flush_size=4096, max_sealed_maps=64):
+        """
+        Constructor for TimeSeriesStore class
+        :param root_path: Directory of the series
+        :param segment_size: Max number of records of a segment (8 bytes for each record in each column file)
+        :param flush_size: Number of buffered records of a series written at once
+        :param max_sealed_maps: Max number of full segments kept memory-mapped (each map holds a file descriptor)
+        """
+
+        self.root_path = root_path
+        self.segment_size = segment_size
+        self.flush_size = flush_size
+        self.max_sealed_maps = max_sealed_maps
+
+        # (device_id, value_type) -> _Series
+        self._series = {}
+
+        # LRU of the path of a full segment -> (timestamps, values) memory maps (the last segment of a series grows and is
+        # mapped by each query). The evicted maps are closed with their last reference (at the end of the queries using them)
+        self._sealed_maps = OrderedDict()
+
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Metrics of the store
+        self.appended_count = 0
+        self.written_count = 0
+
+        os.makedirs(root_path, exist_ok=True)
+
+    def append(self, device_id, value_type, timestamp, value):
+        """ Append a record to the series of a device (written when flush_size records are buffered) """
+
+        key = (device_id, value_type)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._open_series(device_id, value_type)
+
+            # A record older than the last written record starts a new segment, so the timestamps of each segment stay
+            # sorted (the buffered records are all newer, they end the current segment)
+            if series.written_timestamp is not None and timestamp < series.written_timestamp:
+                self._write(series)
+                series.segment_index += 1
+                series.segment_count = 0
+                series.written_timestamp = None
+
+            # The small reorderings inside the buffer are sorted by the write
+            if series.timestamps and timestamp < series.timestamps[-1]:
+                series.unsorted = True
+            series.timestamps.append(timestamp)
+            series.values.append(value)
+            self.appended_count += 1
+
+            if len(series.timestamps) >= self.flush_size:
+                self._write(series)
+
+    def append_descriptor(self, device_id, message_descriptor):
+        """
+        Append the record of a received MessageDescriptor
+        :return: True if the record has been appended, False for a non numeric value (e.g. the switch status)
+        """
+
+        value = message_descriptor.value
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return False
+        self.append(device_id, message_descriptor.value_type, int(message_descriptor.timestamp), value)
+        return True
+
+    def _series_path(self, device_id, value_type):
+        return os.path.join(self.root_path, device_id, value_type)
+
+    def _segment_path(self, series_path, segment_index):
+        return os.path.join(series_path, f"{segment_index:08d}")
+
+    def _segment_indexes(self, series_path):
+        if not os.path.isdir(series_path):
+            return []
+        return sorted(int(name[:-len(TIMESTAMPS_EXTENSION)]) for name in os.listdir(series_path) if name.endswith(TIMESTAMPS_EXTENSION))
+
+    def _open_series(self, device_id, value_type):
+        """ Create the write state of a series, resuming its last segment if the series already exists on disk """
+
+        series = _Series(self._series_path(device_id, value_type))
+        os.makedirs(series.path, exist_ok=True)
+
+        segment_indexes = self._segment_indexes(series.path)
+        if segment_indexes:
+            series.segment_index = segment_indexes[-1]
+            segment_path = self._segment_path(series.path, series.segment_index)
+
+            # The two columns of an interrupted write may have different lengths: keep the complete records only
+            count = min(os.path.getsize(segment_path + TIMESTAMPS_EXTENSION) // 8, os.path.getsize(segment_path + VALUES_EXTENSION) // 8)
+            for extension in (TIMESTAMPS_EXTENSION, VALUES_EXTENSION):
+                os.truncate(segment_path + extension, count * 8)
+
+            series.segment_count = count
+            if count:
+                series.written_timestamp = int(np.memmap(segment_path + TIMESTAMPS_EXTENSION, dtype=np.int64, mode="r")[-1])
+
+        self._series[(device_id, value_type)] = series
+        return series
+
+    def _write(self, series):
+        """ Write the buffered records of a series sorted by timestamp, rolling over to a new segment when the current one is full """
+
+        buffered_count = len(series.timestamps)
+        if not buffered_count:
+            return
+
+        if series.unsorted:
+            order = np.argsort(np.frombuffer(series.timestamps, dtype=np.int64), kind="stable")
+            timestamps = np.frombuffer(series.timestamps, dtype=np.int64)[order]
+            values = np.frombuffer(series.values, dtype=np.float64)[order]
+        else:
+            timestamps = memoryview(series.timestamps)
+            values = memoryview(series.values)
+
+        offset = 0
+        while offset < buffered_count:
+            if series.segment_count >= self.segment_size:
+                series.segment_index += 1
+                series.segment_count = 0
+
+            chunk_size = min(buffered_count - offset, self.segment_size - series.segment_count)
+            segment_path = self._segment_path(series.path, series.segment_index)
+            with open(segment_path + TIMESTAMPS_EXTENSION, "ab") as timestamps_file:
+                timestamps_file.write(timestamps[offset:offset + chunk_size])
+            with open(segment_path + VALUES_EXTENSION, "ab") as values_file:
+                values_file.write(values[offset:offset + chunk_size])
+
+            series.segment_count += chunk_size
+            offset += chunk_size
+
+        self.written_count += buffered_count
+        series.written_timestamp = int(timestamps[buffered_count - 1])
+        series.timestamps = array("q")
+        series.values = array("d")
+        series.unsorted = False
+
+    def flush(self):
+        """ Write the buffered records of all the series """
+
+        with self._lock:
+            for series in self._series.values():
+                if series.timestamps:
+                    self._write(series)
+
+    def series(self):
+        """ List of the (device_id, value_type) pairs stored on disk """
+
+        with self._lock:
+            self.flush()
+            return sorted((device_id, value_type)
+                          for device_id in os.listdir(self.root_path) if os.path.isdir(os.path.join(self.root_path, device_id))
+                          for value_type in os.listdir(os.path.join(self.root_path, device_id)))
+
+    def _segment_maps(self, device_id, value_type):
+        """ Memory maps (timestamps, values) of the non empty segments of a series, in segment order """
+
+        series_path = self._series_path(device_id, value_type)
+        with self._lock:
+            series = self._series.get((device_id, value_type))
+            if series is not None and series.timestamps:
+                self._write(series)
+
+            segment_maps = []
+            segment_indexes = self._segment_indexes(series_path)
+            for position, segment_index in enumerate(segment_indexes):
+                segment_path = self._segment_path(series_path, segment_index)
+                maps = self._sealed_maps.get(segment_path)
+                if maps is not None:
+                    self._sealed_maps.move_to_end(segment_path)
+                else:
+                    count = min(os.path.getsize(segment_path + TIMESTAMPS_EXTENSION), os.path.getsize(segment_path + VALUES_EXTENSION)) // 8
+                    if not count:
+                        continue
+                    maps = (np.memmap(segment_path + TIMESTAMPS_EXTENSION, dtype=np.int64, mode="r", shape=(count,)),
+                                          np.memmap(segment_path + VALUES_EXTENSION, dtype=np.float64, mode="r", shape=(count,)))
+
+                    # Only the last segment can still grow
+                    if position < len(segment_indexes) - 1:
+                        self._sealed_maps[segment_path] = maps
+                        if len(self._sealed_maps) > self.max_sealed_maps:
+                            self._sealed_maps.popitem(last=False)
+                segment_maps.append(maps)
+
+        return segment_maps
+
+    def query(self, device_id, value_type, start=None, end=None):
+        """
+        Records of a series in the time range [start, end)
+        :param start: First timestamp of the range (None for the first record)
+        :param end: End timestamp of the range, excluded (None for the last record)
+        :return: Tuple (timestamps int64 array, values float64 array) sorted by timestamp
+        """
+
+        timestamp_slices = []
+        value_slices = []
+        for timestamps, values in self._segment_maps(device_id, value_type):
+
+            # Skip the segments outside the range reading only their first and last timestamps
+            if (start is not None and timestamps[-1] < start) or (end is not None and timestamps[0] >= end):
+                continue
+
+            first = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+            last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="left"))
+            if first < last:
+                timestamp_slices.append(timestamps[first:last])
+                value_slices.append(values[first:last])
+
+        if not timestamp_slices:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        timestamps = np.concatenate(timestamp_slices)
+        values = np.concatenate(value_slices)
+
+        # Segments started by out of order records overlap the previous ones
+        if len(timestamp_slices) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            values = values[order]
+
+        return timestamps, values
+
+    def downsample(self, device_id, value_type, bucket_sec, start=None, end=None, aggregation="mean"):
+        """
+        Aggregate the records of a time range in fixed size buckets (e.g. the 1 minute mean of a temperature)
+        :param bucket_sec: Bucket duration (buckets aligned to multiples of bucket_sec)
+        :param aggregation: One of "mean", "min", "max", "sum", "count", "first", "last"
+        :return: Tuple (bucket start timestamps int64 array, aggregated values array), empty buckets are omitted
+        """
+
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation: {aggregation}")
+
+        timestamps, values = self.query(device_id, value_type, start, end)
+        if not len(timestamps):
+            return timestamps, values
+
+        buckets = timestamps - timestamps % bucket_sec
+        bucket_starts, first_indexes = np.unique(buckets, return_index=True)
+        counts = np.diff(np.append(first_indexes, len(buckets)))
+
+        if aggregation == "count":
+            aggregated = counts
+        elif aggregation == "first":
+            aggregated = values[first_indexes]
+        elif aggregation == "last":
+            aggregated = values[first_indexes + counts - 1]
+        elif aggregation == "min":
+            aggregated = np.minimum.reduceat(values, first_indexes)
+        elif aggregation == "max":
+            aggregated = np.maximum.reduceat(values, first_indexes)
+        else:
+            aggregated = np.add.reduceat(values, first_indexes)
+            if aggregation == "mean":
+                aggregated = aggregated / counts
+
+        return bucket_starts, aggregated
+
+    def start(self, flush_interval_sec):
+        """ Start a thread writing the buffered records every flush_interval_sec (bounded data loss and query staleness) """
+
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, args=(flush_interval_sec,), name="TimeSeriesStore", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the flush thread and write the buffered records """
+
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _flush_loop(self, flush_interval_sec):
+        while not self._stop_event.wait(flush_interval_sec):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Time-Series Store flush error: %s", e)
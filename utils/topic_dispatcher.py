@@ -0,0 +1,197 @@
+import threading
+from collections import OrderedDict
+
+
+class _TopicNode:
+    """ Single level of the topic filter trie """
+
+    __slots__ = ("children", "plus", "hash_handlers", "handlers")
+
+    def __init__(self):
+        """ Constructor for _TopicNode class """
+
+        # Children reached through a literal topic level (e.g. 'device', 'info')
+        self.children = {}
+
+        # Child reached through the single level wildcard '+'
+        self.plus = None
+
+        # Handlers registered with a filter ending with the multi level wildcard '#' at this level
+        self.hash_handlers = []
+
+        # Handlers registered with a filter ending exactly at this level
+        self.handlers = []
+
+
+class TopicDispatcher:
+    """ This class routes the incoming MQTT messages to the registered handlers.
+    All the topic filters (including '+' and '#' wildcards) are compiled into a trie with one node
+    for each topic level so that an incoming topic is resolved with a single walk.
+    The result of each resolution is stored in an LRU cache indexed by the concrete topic, guarded by a lock since the
+    messages are resolved concurrently by the handler threads (e.g. the shards of a WorkDispatcher) """
+
+    def __init__(self, cache_size=4096, default_handler=None):
+        """
+        Constructor for TopicDispatcher class
+        :param cache_size: Max number of concrete topics kept in the LRU cache
+        :param default_handler: Handler called when a message does not match any registered filter
+        """
+
+        self.cache_size = cache_size
+        self.default_handler = default_handler
+
+        # Root node of the topic filter trie
+        self._root = _TopicNode()
+
+        # Registration order of the filters used to keep the if/elif semantic (first registered wins)
+        self._registration_counter = 0
+
+        # LRU cache: concrete topic -> tuple of handlers ordered by registration
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # Incremented when the trie changes, so a resolution walked on the previous trie is not cached
+        self._generation = 0
+
+        # Statistics about the cache usage
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add_handler(self, topic_filter, handler):
+        """
+        Register a handler for a topic filter
+        :param topic_filter: MQTT topic filter (e.g. device/+/info or device/+/telemetry/#)
+        :param handler: Callable receiving the MQTT message
+        """
+
+        levels = topic_filter.split("/")
+
+        # The '#' wildcard is valid only as the last level of the filter
+        if "#" in levels[:-1]:
+            raise ValueError(f"Invalid topic filter: {topic_filter}")
+
+        node = self._root
+        for index, level in enumerate(levels):
+            if level == "#":
+                node.hash_handlers.append((self._registration_counter, handler))
+                break
+            if level == "+":
+                if node.plus is None:
+                    node.plus = _TopicNode()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _TopicNode())
+            if index == len(levels) - 1:
+                node.handlers.append((self._registration_counter, handler))
+
+        self._registration_counter += 1
+
+        # The compiled trie changed, previously cached resolutions are no longer valid
+        self._invalidate_cache()
+
+    def remove_handler(self, topic_filter, handler):
+        """
+        Remove a previously registered handler
+        :param topic_filter: MQTT topic filter used during the registration
+        :param handler: Handler to remove
+        """
+
+        node = self._root
+        levels = topic_filter.split("/")
+        for level in levels:
+            if level == "#":
+                node.hash_handlers = [h for h in node.hash_handlers if h[1] != handler]
+                break
+            node = node.plus if level == "+" else node.children.get(level)
+            if node is None:
+                return
+        else:
+            node.handlers = [h for h in node.handlers if h[1] != handler]
+
+        self._invalidate_cache()
+
+    def _invalidate_cache(self):
+        with self._cache_lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def resolve(self, topic):
+        """
+        Resolve the list of handlers matching a concrete topic
+        :param topic: Concrete topic of the received message
+        :return: Tuple of handlers ordered by registration
+        """
+
+        cache = self._cache
+        with self._cache_lock:
+            handlers = cache.get(topic)
+            if handlers is not None:
+                cache.move_to_end(topic)
+                self.cache_hits += 1
+                return handlers
+            self.cache_misses += 1
+            generation = self._generation
+
+        # The trie is walked outside the lock
+        handlers = self._walk(topic)
+
+        with self._cache_lock:
+            if generation == self._generation:
+                cache[topic] = handlers
+                if len(cache) > self.cache_size:
+                    cache.popitem(last=False)
+
+        return handlers
+
+    def _walk(self, topic):
+        """ Walk the trie once collecting all the handlers matching the topic """
+
+        levels = topic.split("/")
+        matches = []
+
+        # Nodes reached so far (more than one only when '+' branches are involved)
+        nodes = [self._root]
+        for index, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                # Topics starting with '$' (e.g. $SYS) are not matched by wildcards at the first level
+                wildcard_allowed = index > 0 or not level.startswith("$")
+                if wildcard_allowed:
+                    matches.extend(node.hash_handlers)
+                    if node.plus is not None:
+                        next_nodes.append(node.plus)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                break
+        else:
+            for node in nodes:
+                matches.extend(node.handlers)
+                # The '#' wildcard also matches the parent level (e.g. device/# matches device)
+                matches.extend(node.hash_handlers)
+
+        matches.sort(key=lambda registered: registered[0])
+        return tuple(handler for _, handler in matches)
+
+    def dispatch(self, message):
+        """
+        Dispatch a message to the first registered handler matching its topic
+        (the same semantic of an if/elif chain of topic_matches_sub checks)
+        :param message: MQTT message received from the broker
+        :return: True if a handler has been found, False otherwise
+        """
+
+        handlers = self.resolve(message.topic)
+        if handlers:
+            handlers[0](message)
+            return True
+
+        if self.default_handler is not None:
+            self.default_handler(message)
+        return False
+
+    def on_message(self, client, userdata, message):
+        """ Paho on_message callback that can be directly attached to the MQTT Client """
+        self.dispatch(message)
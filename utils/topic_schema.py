@@ -0,0 +1,133 @@
+import sys
+
+from dto.payload_codec import available_codecs, codec_topic, get_codec
+
+# Channels of the device topic hierarchy: <base>/<device_id>/<channel>
+INFO_CHANNEL = "info"
+TEMPERATURE_CHANNEL = "telemetry/temperature"
+SWITCH_CHANNEL = "telemetry/switch"
+AGGREGATE_CHANNEL = "telemetry/aggregate"
+SENSOR_CHANNEL = "sensor/temperature"
+EVENT_CHANNEL = "event"
+ACTION_CHANNEL = "action/switch"
+
+CHANNELS = (INFO_CHANNEL, TEMPERATURE_CHANNEL, SWITCH_CHANNEL, AGGREGATE_CHANNEL, SENSOR_CHANNEL, EVENT_CHANNEL, ACTION_CHANNEL)
+
+# The device info is always JSON, the payload codec suffix is appended to the topics of the other channels
+_PLAIN_CHANNELS = (INFO_CHANNEL,)
+
+
+class DeviceTopics:
+    """ Topics of a device, built once: device_topics[channel] is the interned topic string (for the Paho publish) """
+
+    __slots__ = ("device_id", "_topics")
+
+    def __init__(self, device_id, topics):
+        """
+        Constructor for DeviceTopics class
+        :param device_id: Identifier of the device
+        :param topics: Channel -> topic string
+        """
+
+        self.device_id = device_id
+        self._topics = {channel: sys.intern(topic) for channel, topic in topics.items()}
+
+    def __getitem__(self, channel):
+        return self._topics[channel]
+
+
+class TopicSchema:
+    """ Declaration of the device topic hierarchy <base>/<device_id>/<channel>, shared by the producers and the consumers.
+    The producers get the precomputed DeviceTopics of each device (no string formatting for each message) and the
+    consumers parse an incoming topic into (device_id, channel) with a single prefix check, a single find and a cached
+    dictionary lookup of the channel (codec suffixes included), without regex and without splitting all the levels """
+
+    # Max parsed topics kept in the cache (the topics of the devices are a bounded set)
+    _MAX_PARSED_TOPICS = 100000
+
+    def __init__(self, base_topic="device", channels=CHANNELS, codec=None):
+        """
+        Constructor for TopicSchema class
+        :param base_topic: First level of the hierarchy
+        :param channels: Channels of the devices (levels after the device id)
+        :param codec: Optional payload codec whose suffix is appended to the published topics (except the device info)
+        """
+
+        self.base_topic = base_topic
+        self.channels = tuple(channels)
+        self.codec = codec
+
+        self._prefix = f"{base_topic}/"
+        self._prefix_length = len(self._prefix)
+
+        # Channel levels (with any codec suffix) -> channel
+        self._channels_by_levels = {}
+        for channel in self.channels:
+            self._channels_by_levels[channel] = channel
+            for codec_name in available_codecs():
+                suffix = get_codec(codec_name).topic_suffix
+                if suffix is not None:
+                    self._channels_by_levels[f"{channel}/{suffix}"] = channel
+
+        self._devices = {}
+        self._parsed = {}
+
+    def topic(self, device_id, channel):
+        """ Topic of a channel of a device (with the codec suffix of the schema) """
+
+        topic = f"{self._prefix}{device_id}/{channel}"
+        if self.codec is None or channel in _PLAIN_CHANNELS:
+            return topic
+        return codec_topic(topic, self.codec)
+
+    def device(self, device_id):
+        """ DeviceTopics of a device (built on the first call) """
+
+        device_topics = self._devices.get(device_id)
+        if device_topics is None:
+            device_topics = DeviceTopics(device_id, {channel: self.topic(device_id, channel) for channel in self.channels})
+            self._devices[device_id] = device_topics
+        return device_topics
+
+    def subscription(self, channel, device_id="+"):
+        """ Topic filter of a channel (all the devices by default), matching the codec suffixes too """
+        return f"{self._prefix}{device_id}/{channel}/#"
+
+    def parse(self, topic):
+        """
+        Parse an incoming topic
+        :return: Tuple (device_id, channel), the channel is the remaining levels for the undeclared channels,
+        None if the topic is outside the hierarchy
+        """
+
+        parsed = self._parsed.get(topic)
+        if parsed is not None:
+            return parsed
+
+        if not topic.startswith(self._prefix):
+            return None
+        separator = topic.find("/", self._prefix_length)
+        if separator < 0:
+            return None
+        levels = topic[separator + 1:]
+        parsed = (topic[self._prefix_length:separator], self._channels_by_levels.get(levels, levels))
+
+        if len(self._parsed) >= self._MAX_PARSED_TOPICS:
+            self._parsed.clear()
+        self._parsed[topic] = parsed
+        return parsed
+
+    def device_id(self, topic):
+        """ Device id of an incoming topic (None if the topic is outside the hierarchy) """
+
+        parsed = self.parse(topic)
+        return parsed[0] if parsed is not None else None
+
+
+# Schema of the default "device" hierarchy with JSON payloads
+DEVICE_SCHEMA = TopicSchema()
+
+
+def parse_topic(topic):
+    """ (device_id, channel) of a topic of the default device hierarchy (None outside the hierarchy) """
+    return DEVICE_SCHEMA.parse(topic)
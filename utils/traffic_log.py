@@ -0,0 +1,218 @@
+import bisect
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+# Header of the log file: magic, format version, wall clock time of the capture start (the message timestamps are
+# monotonic nanoseconds since the capture start)
+_HEADER = struct.Struct("<8sHd")
+_MAGIC = b"IOTCAP01"
+_VERSION = 1
+
+# Record kinds: a topic is written once in a topic record, the message records refer to its index in the topic table
+_TOPIC_RECORD = 1
+_MESSAGE_RECORD = 2
+
+# Topic record: kind, topic size (followed by the UTF-8 topic)
+_TOPIC = struct.Struct("<BH")
+
+# Message record: kind, timestamp (ns since the capture start), topic index, flags (qos | retain << 2), payload size
+# (followed by the payload)
+_MESSAGE = struct.Struct("<BQHBI")
+
+# Time index written by close(): (timestamp, file offset, topic table size) every index_interval messages, followed by
+# the footer (index offset, index entries, message count, duration, magic)
+_INDEX_ENTRY = struct.Struct("<QQH")
+_FOOTER = struct.Struct("<QQQQ8s")
+_FOOTER_MAGIC = b"IOTIDX01"
+
+_MAX_TOPICS = 65535
+
+
+class CapturedMessage(namedtuple("CapturedMessage", ("timestamp_ns", "topic", "payload", "qos", "retain"))):
+    """ Message of a traffic log:
+    :param timestamp_ns: Monotonic nanoseconds since the start of the capture
+    :param topic: Topic of the message
+    :param payload: Payload bytes
+    :param qos: QoS of the received message
+    :param retain: Retain flag of the received message
+    """
+
+    __slots__ = ()
+
+
+class TrafficLogWriter:
+    """ Writes the captured MQTT messages into a compact append-only binary log: each topic is written once and the
+    messages refer to it by index, so a message costs 16 bytes plus its payload. The time index written when the log
+    is closed lets the reader start a replay at any time offset; a log without index (e.g. a crashed capture) is still
+    readable sequentially """
+
+    def __init__(self, path, index_interval=1000, start_time=None):
+        """
+        Constructor for TrafficLogWriter class
+        :param path: Log file (overwritten)
+        :param index_interval: Messages between two entries of the time index
+        :param start_time: Wall clock time of the capture start stored in the header (informative)
+        """
+
+        self.path = path
+        self.index_interval = index_interval
+
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, start_time if start_time is not None else time.time()))
+        self._topics = {}
+        self._index = []
+        self._last_timestamp_ns = 0
+
+        # Metrics of the writer
+        self.message_count = 0
+        self.payload_bytes = 0
+
+    def write(self, timestamp_ns, topic, payload, qos=0, retain=False):
+        """
+        Append a message to the log
+        :param timestamp_ns: Monotonic nanoseconds since the start of the capture (non decreasing)
+        """
+
+        topic_index = self._topics.get(topic)
+        if topic_index is None:
+            if len(self._topics) >= _MAX_TOPICS:
+                raise ValueError(f"Too many topics in the traffic log (max {_MAX_TOPICS})")
+            topic_index = len(self._topics)
+            self._topics[topic] = topic_index
+            encoded_topic = topic.encode("utf-8")
+            self._file.write(_TOPIC.pack(_TOPIC_RECORD, len(encoded_topic)))
+            self._file.write(encoded_topic)
+
+        if self.message_count % self.index_interval == 0:
+            self._index.append((timestamp_ns, self._file.tell(), len(self._topics)))
+
+        payload = payload or b""
+        self._file.write(_MESSAGE.pack(_MESSAGE_RECORD, timestamp_ns, topic_index, qos | (4 if retain else 0), len(payload)))
+        self._file.write(payload)
+        self._last_timestamp_ns = timestamp_ns
+        self.message_count += 1
+        self.payload_bytes += len(payload)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        """ Write the time index and the footer and close the log """
+
+        if self._file is None:
+            return
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(_INDEX_ENTRY.pack(*entry))
+        self._file.write(_FOOTER.pack(index_offset, len(self._index), self.message_count, self._last_timestamp_ns, _FOOTER_MAGIC))
+        self._file.close()
+        self._file = None
+
+    def metrics(self):
+        """ Snapshot of the writer metrics as a dictionary """
+
+        return {
+            "messages": self.message_count,
+            "topics": len(self._topics),
+            "payload_bytes": self.payload_bytes,
+            "duration_sec": self._last_timestamp_ns / 1e9
+        }
+
+
+class TrafficLogReader:
+    """ Reads a traffic log written by TrafficLogWriter: iterating the reader yields the CapturedMessage records in
+    capture order, messages(start_sec) starts at a time offset using the time index """
+
+    def __init__(self, path):
+        """
+        Constructor for TrafficLogReader class
+        :param path: Log file
+        """
+
+        self.path = path
+        with open(path, "rb") as log_file:
+            magic, version, self.start_time = _HEADER.unpack(log_file.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"Not a traffic log: {path}")
+
+            # The index and the footer are missing if the capture has not been closed
+            self._data_end = os.path.getsize(path)
+            self._index = []
+            self.message_count = None
+            self.duration_ns = None
+            if self._data_end >= _HEADER.size + _FOOTER.size:
+                log_file.seek(self._data_end - _FOOTER.size)
+                index_offset, index_entries, message_count, duration_ns, footer_magic = _FOOTER.unpack(log_file.read(_FOOTER.size))
+                if footer_magic == _FOOTER_MAGIC:
+                    log_file.seek(index_offset)
+                    index_data = log_file.read(index_entries * _INDEX_ENTRY.size)
+                    self._index = [_INDEX_ENTRY.unpack_from(index_data, offset) for offset in range(0, len(index_data), _INDEX_ENTRY.size)]
+                    self._data_end = index_offset
+                    self.message_count = message_count
+                    self.duration_ns = duration_ns
+
+    def __iter__(self):
+        return self.messages()
+
+    def messages(self, start_sec=0.0):
+        """
+        Messages of the log in capture order
+        :param start_sec: Skip the messages captured before this offset from the capture start
+        """
+
+        start_ns = int(start_sec * 1e9)
+
+        # The topic records before the indexed position are read to rebuild the topic table
+        position = bisect.bisect_right(self._index, (start_ns, float("inf"), 0)) - 1 if start_ns else -1
+        seek_offset, topic_count = (self._index[position][1], self._index[position][2]) if position >= 0 else (_HEADER.size, 0)
+
+        # The log is memory-mapped: the payloads are copied only for the yielded messages
+        with open(self.path, "rb") as log_file, mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = self._data_end
+            topics = []
+            offset = _HEADER.size
+            if topic_count:
+                while len(topics) < topic_count:
+                    offset = self._read_record(data, offset, end, topics, None)
+                offset = seek_offset
+
+            while offset < end:
+                message = []
+                offset = self._read_record(data, offset, end, topics, message)
+                if offset is None:
+                    # Last record truncated by a crashed capture
+                    return
+                if message and message[0].timestamp_ns >= start_ns:
+                    yield message[0]
+
+    @staticmethod
+    def _read_record(data, offset, end, topics, message):
+        """
+        Read the record at offset, appending its topic to the topic table or its CapturedMessage to message
+        :return: Offset of the next record, None if the record is truncated
+        """
+
+        kind = data[offset]
+        if kind == _TOPIC_RECORD:
+            if offset + _TOPIC.size > end:
+                return None
+            _, topic_size = _TOPIC.unpack_from(data, offset)
+            offset += _TOPIC.size
+            if offset + topic_size > end:
+                return None
+            topics.append(data[offset:offset + topic_size].decode("utf-8"))
+            return offset + topic_size
+        if kind == _MESSAGE_RECORD:
+            if offset + _MESSAGE.size > end:
+                return None
+            _, timestamp_ns, topic_index, flags, payload_size = _MESSAGE.unpack_from(data, offset)
+            offset += _MESSAGE.size
+            if offset + payload_size > end:
+                return None
+            if message is not None:
+                message.append(CapturedMessage(timestamp_ns, topics[topic_index], data[offset:offset + payload_size], flags & 3, bool(flags & 4)))
+            return offset + payload_size
+        raise ValueError(f"Corrupted traffic log record at offset {offset}")
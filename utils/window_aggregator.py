@@ -0,0 +1,271 @@
+from collections import deque
+
+
+class P2Quantile:
+    """ Streaming quantile estimator based on the P-Square algorithm (Jain & Chlamtac, 1985).
+    It keeps only five markers, so the memory is constant whatever the number of observations """
+
+    __slots__ = ("quantile", "_initial", "_heights", "_positions", "_desired", "_increments")
+
+    def __init__(self, quantile):
+        """
+        Constructor for P2Quantile class
+        :param quantile: Estimated quantile in the range (0, 1), e.g. 0.95
+        """
+
+        self.quantile = quantile
+        self._initial = []
+        self._heights = None
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0.0, 2.0 * quantile, 4.0 * quantile, 2.0 + 2.0 * quantile, 4.0]
+        self._increments = [0.0, quantile / 2.0, quantile, (1.0 + quantile) / 2.0, 1.0]
+
+    def add(self, value):
+        """ Add an observation """
+
+        heights = self._heights
+
+        # The first five observations initialize the markers
+        if heights is None:
+            self._initial.append(value)
+            if len(self._initial) == 5:
+                self._initial.sort()
+                self._heights = self._initial
+            return
+
+        positions = self._positions
+
+        # Find the cell of the new observation, extending the extreme markers if required
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+        for index in range(5):
+            self._desired[index] += self._increments[index]
+
+        # Adjust the heights of the three central markers
+        for index in (1, 2, 3):
+            delta = self._desired[index] - positions[index]
+            if (delta >= 1 and positions[index + 1] - positions[index] > 1) or \
+                    (delta <= -1 and positions[index - 1] - positions[index] < -1):
+                step = 1 if delta > 0 else -1
+                height = self._parabolic(index, step)
+                if not heights[index - 1] < height < heights[index + 1]:
+                    height = heights[index] + step * (heights[index + step] - heights[index]) / (positions[index + step] - positions[index])
+                heights[index] = height
+                positions[index] += step
+
+    def _parabolic(self, index, step):
+        """ Piecewise parabolic prediction of the marker height """
+
+        heights = self._heights
+        positions = self._positions
+        return heights[index] + step / (positions[index + 1] - positions[index - 1]) * (
+            (positions[index] - positions[index - 1] + step) * (heights[index + 1] - heights[index]) / (positions[index + 1] - positions[index])
+            + (positions[index + 1] - positions[index] - step) * (heights[index] - heights[index - 1]) / (positions[index] - positions[index - 1]))
+
+    def value(self):
+        """ Current estimation of the quantile (None without observations) """
+
+        if self._heights is not None:
+            return self._heights[2]
+        if not self._initial:
+            return None
+        ordered = sorted(self._initial)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+
+class TumblingWindow:
+    """ Fixed size, non overlapping time window (e.g. [0, 60), [60, 120), ...) with running
+    count, sum, min, max and P-Square quantiles: constant memory whatever the number of samples """
+
+    __slots__ = ("duration", "quantiles", "window_start", "count", "total", "min_value", "max_value", "_estimators")
+
+    def __init__(self, duration, quantiles=(0.5, 0.95)):
+        """
+        Constructor for TumblingWindow class
+        :param duration: Window duration in the same unit of the timestamps (seconds)
+        :param quantiles: Quantiles estimated for each window
+        """
+
+        self.duration = duration
+        self.quantiles = quantiles
+        self.window_start = None
+        self._reset(None)
+
+    def _reset(self, window_start):
+        self.window_start = window_start
+        self.count = 0
+        self.total = 0.0
+        self.min_value = None
+        self.max_value = None
+        self._estimators = [P2Quantile(quantile) for quantile in self.quantiles]
+
+    def add(self, timestamp, value):
+        """
+        Add a sample to the window
+        :return: Statistics of the previous window if the sample closed it, None otherwise
+        """
+
+        window_start = timestamp - timestamp % self.duration
+        closed_window = None
+        if window_start != self.window_start:
+            if self.count:
+                closed_window = self.statistics()
+            self._reset(window_start)
+
+        self.count += 1
+        self.total += value
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+        for estimator in self._estimators:
+            estimator.add(value)
+
+        return closed_window
+
+    def statistics(self):
+        """ Statistics of the current window as a dictionary """
+
+        return {
+            "window_start": self.window_start,
+            "window_end": self.window_start + self.duration,
+            "count": self.count,
+            "min": self.min_value,
+            "max": self.max_value,
+            "mean": self.total / self.count if self.count else None,
+            "quantiles": {estimator.quantile: estimator.value() for estimator in self._estimators}
+        }
+
+
+class SlidingWindow:
+    """ Time based sliding window (the last duration seconds) backed by a bounded ring buffer
+    with a running sum and monotonic queues for min and max: add, mean, min and max are O(1)
+    (amortized) and the memory is bounded by the capacity of the buffer """
+
+    __slots__ = ("duration", "capacity", "_samples", "_min_queue", "_max_queue", "_total", "_sequence")
+
+    def __init__(self, duration, capacity=1024):
+        """
+        Constructor for SlidingWindow class
+        :param duration: Window duration in the same unit of the timestamps (seconds)
+        :param capacity: Max number of samples kept in the window
+        """
+
+        self.duration = duration
+        self.capacity = capacity
+        self._samples = deque()
+        self._min_queue = deque()
+        self._max_queue = deque()
+        self._total = 0.0
+        self._sequence = 0
+
+    def add(self, timestamp, value):
+        """ Add a sample and evict the samples older than the window duration """
+
+        sequence = self._sequence
+        self._sequence += 1
+
+        self._samples.append((sequence, timestamp, value))
+        self._total += value
+
+        while self._min_queue and self._min_queue[-1][1] >= value:
+            self._min_queue.pop()
+        self._min_queue.append((sequence, value))
+        while self._max_queue and self._max_queue[-1][1] <= value:
+            self._max_queue.pop()
+        self._max_queue.append((sequence, value))
+
+        self._evict(timestamp - self.duration)
+
+    def _evict(self, oldest_timestamp):
+        samples = self._samples
+        while samples and (len(samples) > self.capacity or samples[0][1] <= oldest_timestamp):
+            sequence, _, value = samples.popleft()
+            self._total -= value
+            if self._min_queue[0][0] == sequence:
+                self._min_queue.popleft()
+            if self._max_queue[0][0] == sequence:
+                self._max_queue.popleft()
+
+    def count(self):
+        return len(self._samples)
+
+    def mean(self):
+        return self._total / len(self._samples) if self._samples else None
+
+    def min(self):
+        return self._min_queue[0][1] if self._min_queue else None
+
+    def max(self):
+        return self._max_queue[0][1] if self._max_queue else None
+
+    def percentile(self, quantile):
+        """ Exact percentile of the samples in the window (sorted on demand, bounded by the capacity) """
+
+        if not self._samples:
+            return None
+        ordered = sorted(sample[2] for sample in self._samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class DeviceWindowAggregator:
+    """ This class keeps a sliding window and a tumbling window for each (device, value type) pair
+    of the received numeric telemetry (only the tumbling window when the sliding windows are kept elsewhere, e.g. by the rule engine) """
+
+    def __init__(self, sliding_window_sec=30, sliding_window_capacity=1024, tumbling_window_sec=60, quantiles=(0.5, 0.95)):
+        """
+        Constructor for DeviceWindowAggregator class
+        :param sliding_window_sec: Duration of the sliding windows used by the rules (None for no sliding window)
+        :param sliding_window_capacity: Max number of samples of each sliding window
+        :param tumbling_window_sec: Duration of the tumbling windows used for the downsampled aggregates
+        :param quantiles: Quantiles estimated for each tumbling window
+        """
+
+        self.sliding_window_sec = sliding_window_sec
+        self.sliding_window_capacity = sliding_window_capacity
+        self.tumbling_window_sec = tumbling_window_sec
+        self.quantiles = quantiles
+
+        # (device_id, value_type) -> (SlidingWindow, TumblingWindow)
+        self._windows = {}
+
+    def add(self, device_id, value_type, timestamp, value):
+        """
+        Add a sample of a device
+        :return: Tuple (sliding window of the device or None, statistics of the closed tumbling window or None)
+        """
+
+        key = (device_id, value_type)
+        windows = self._windows.get(key)
+        if windows is None:
+            windows = (SlidingWindow(self.sliding_window_sec, self.sliding_window_capacity) if self.sliding_window_sec is not None else None,
+                       TumblingWindow(self.tumbling_window_sec, self.quantiles))
+            self._windows[key] = windows
+
+        sliding_window, tumbling_window = windows
+        if sliding_window is not None:
+            sliding_window.add(timestamp, value)
+        return sliding_window, tumbling_window.add(timestamp, value)
+
+    def sliding_window(self, device_id, value_type):
+        """ Sliding window of a device (None if no sample has been received) """
+
+        windows = self._windows.get((device_id, value_type))
+        return windows[0] if windows is not None else None
+
+    def remove_device(self, device_id):
+        """ Remove all the windows of a device """
+
+        for key in [key for key in self._windows if key[0] == device_id]:
+            del self._windows[key]
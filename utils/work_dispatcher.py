@@ -0,0 +1,249 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from utils.logger import get_logger, shutdown_logging, METRICS
+from utils.topic_schema import parse_topic
+
+logger = get_logger(METRICS)
+
+# Indexes of the statistics of each shard
+_HANDLED, _ERRORS, _HANDLER_TIME, _MAX_HANDLER_TIME, _WAIT_TIME, _MAX_WAIT_TIME = range(6)
+
+
+class WorkMessage(namedtuple("WorkMessage", ("topic", "payload", "qos", "retain", "properties"))):
+    """ Picklable copy of a received MQTT message passed to the handlers running in a process pool """
+
+    __slots__ = ()
+
+
+def device_key(topic):
+    """ Default ordering key: the device id of device/<device_id>/... topics, the full topic otherwise """
+
+    parsed = parse_topic(topic)
+    return parsed[0] if parsed is not None else topic
+
+
+def _run_shard(handler, work_queue, stats, flush_interval):
+    """ Execute the handler on the messages of a shard queue in order, until the None sentinel """
+
+    handled = errors = 0
+    handler_time = max_handler_time = wait_time = max_wait_time = 0.0
+    last_flush = time.monotonic()
+
+    def flush():
+        lock = stats.get_lock() if hasattr(stats, "get_lock") else None
+        if lock is not None:
+            lock.acquire()
+        try:
+            stats[_HANDLED] += handled
+            stats[_ERRORS] += errors
+            stats[_HANDLER_TIME] += handler_time
+            stats[_MAX_HANDLER_TIME] = max(stats[_MAX_HANDLER_TIME], max_handler_time)
+            stats[_WAIT_TIME] += wait_time
+            stats[_MAX_WAIT_TIME] = max(stats[_MAX_WAIT_TIME], max_wait_time)
+        finally:
+            if lock is not None:
+                lock.release()
+
+    while True:
+        work_item = work_queue.get()
+        if work_item is None:
+            break
+
+        enqueued_at, message = work_item
+        start_time = time.monotonic()
+        try:
+            handler(message)
+        except Exception as e:
+            errors += 1
+            logger.error("Error processing message: %s", e)
+        end_time = time.monotonic()
+
+        handled += 1
+        elapsed = end_time - start_time
+        handler_time += elapsed
+        max_handler_time = max(max_handler_time, elapsed)
+        waited = start_time - enqueued_at
+        wait_time += waited
+        max_wait_time = max(max_wait_time, waited)
+
+        # The statistics are published in batches to keep the shared counters out of the hot path
+        if end_time - last_flush >= flush_interval:
+            flush()
+            handled = errors = 0
+            handler_time = max_handler_time = wait_time = max_wait_time = 0.0
+            last_flush = end_time
+
+    flush()
+
+
+def _run_shard_process(handler, work_queue, stats, flush_interval):
+    """ Entry point of a shard process """
+
+    # The owner process stops the shards through the sentinel of the queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _run_shard(handler, work_queue, stats, flush_interval)
+
+    # The child process exits without the atexit handlers: write the queued records before the exit
+    shutdown_logging()
+
+
+class WorkDispatcher:
+    """ This class decouples the MQTT network thread from the execution of the handlers.
+    on_message only selects a shard from the ordering key of the message (the device id by default) and puts
+    the message in the bounded queue of the shard: each shard is executed by its own thread or process,
+    so the messages of a device are handled in order while the devices are handled in parallel.
+    When a shard queue is full the network thread waits up to put_timeout (backpressure towards the broker)
+    and then drops the message, so a slow handler never blocks the keep alive of the client for long """
+
+    def __init__(self, handler, shard_count=4, max_queue_size=1000, mode="thread", put_timeout=1.0,
+                 key_function=device_key, report_interval=None, name="WorkDispatcher"):
+        """
+        Constructor for WorkDispatcher class
+        :param handler: Function called with each message (e.g. TopicDispatcher.dispatch)
+        :param shard_count: Number of ordered shards (threads or processes)
+        :param max_queue_size: Max number of messages waiting in each shard queue
+        :param mode: "thread" (shared memory, handlers can use the globals of the script) or
+                     "process" (CPU bound handlers, the handlers run in child processes and cannot update the parent state)
+        :param put_timeout: Max seconds spent waiting for a full shard queue before dropping the message
+        :param key_function: Function returning the ordering key of a topic
+        :param report_interval: Seconds between two logged metrics reports (None to disable)
+        :param name: Name of the dispatcher in threads, processes and reports
+        """
+
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unsupported dispatch mode: {mode}")
+
+        self.handler = handler
+        self.shard_count = shard_count
+        self.max_queue_size = max_queue_size
+        self.mode = mode
+        self.put_timeout = put_timeout
+        self.key_function = key_function
+        self.report_interval = report_interval
+        self.name = name
+
+        if mode == "process":
+            self._queues = [multiprocessing.Queue(max_queue_size) for _ in range(shard_count)]
+            self._stats = [multiprocessing.Array("d", 6) for _ in range(shard_count)]
+        else:
+            self._queues = [queue.Queue(max_queue_size) for _ in range(shard_count)]
+            self._stats = [[0.0] * 6 for _ in range(shard_count)]
+
+        self._workers = []
+        self._running = threading.Event()
+
+        # Metrics of the submitting side (updated by the network thread)
+        self.submitted_count = [0] * shard_count
+        self.dropped_count = [0] * shard_count
+
+    def start(self):
+        """ Start the shard threads or processes """
+
+        if self._running.is_set():
+            return
+        self._running.set()
+
+        for index in range(self.shard_count):
+            if self.mode == "process":
+                worker = multiprocessing.Process(target=_run_shard_process, name=f"{self.name}-{index}",
+                                                 args=(self.handler, self._queues[index], self._stats[index], 0.2), daemon=True)
+            else:
+                worker = threading.Thread(target=_run_shard, name=f"{self.name}-{index}",
+                                          args=(self.handler, self._queues[index], self._stats[index], 0.0), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        if self.report_interval:
+            threading.Thread(target=self._report_loop, name=f"{self.name}-report", daemon=True).start()
+
+    def stop(self):
+        """ Stop the shards after the execution of the messages already queued """
+
+        if not self._running.is_set():
+            return
+        self._running.clear()
+
+        for work_queue in self._queues:
+            work_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def submit(self, message):
+        """
+        Queue a message in the shard of its ordering key
+        :return: True if the message has been queued, False if it has been dropped
+        """
+
+        shard = zlib.crc32(self.key_function(message.topic).encode("utf-8")) % self.shard_count
+
+        # The paho message is not picklable, the process pool receives a copy of its fields
+        if self.mode == "process":
+            message = WorkMessage(message.topic, message.payload, message.qos, message.retain, getattr(message, "properties", None))
+
+        try:
+            self._queues[shard].put((time.monotonic(), message), timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped_count[shard] += 1
+            return False
+
+        self.submitted_count[shard] += 1
+        return True
+
+    def on_message(self, client, userdata, message):
+        """ MQTT Paho on_message callback submitting the received messages """
+        self.submit(message)
+
+    def queue_depths(self):
+        """ Number of messages waiting in each shard queue (None if not supported by the platform) """
+
+        depths = []
+        for work_queue in self._queues:
+            try:
+                depths.append(work_queue.qsize())
+            except NotImplementedError:
+                depths.append(None)
+        return depths
+
+    def metrics(self):
+        """ Snapshot of the queue depth and handler latency metrics as a dictionary """
+
+        shards = []
+        for index, depth in enumerate(self.queue_depths()):
+            stats = list(self._stats[index])
+            handled = stats[_HANDLED]
+            shards.append({
+                "queue_depth": depth,
+                "submitted": self.submitted_count[index],
+                "dropped": self.dropped_count[index],
+                "handled": int(handled),
+                "errors": int(stats[_ERRORS]),
+                "avg_handler_latency_ms": (stats[_HANDLER_TIME] / handled * 1000.0) if handled else 0.0,
+                "max_handler_latency_ms": stats[_MAX_HANDLER_TIME] * 1000.0,
+                "avg_queue_wait_ms": (stats[_WAIT_TIME] / handled * 1000.0) if handled else 0.0,
+                "max_queue_wait_ms": stats[_MAX_WAIT_TIME] * 1000.0
+            })
+
+        return {
+            "mode": self.mode,
+            "queue_depth": sum(shard["queue_depth"] or 0 for shard in shards),
+            "submitted": sum(self.submitted_count),
+            "dropped": sum(self.dropped_count),
+            "handled": sum(shard["handled"] for shard in shards),
+            "errors": sum(shard["errors"] for shard in shards),
+            "max_handler_latency_ms": max(shard["max_handler_latency_ms"] for shard in shards),
+            "shards": shards
+        }
+
+    def _report_loop(self):
+        while self._running.is_set():
+            time.sleep(self.report_interval)
+            metrics = self.metrics()
+            shards = metrics.pop("shards")
+            logger.info("%s Metrics: %s Queue Depths: %s", self.name, metrics, [shard["queue_depth"] for shard in shards])